@@ -1,162 +1,75 @@
 import os
 import glob
 import subprocess
-from tqdm.notebook import trange
+from tqdm import trange
 import pandas as pd
 import re
 from openpyxl import load_workbook
 import calendar
 
+def _require_libreoffice():
+    # Проверка наличия libreoffice
+    try:
+        subprocess.run(['libreoffice', '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception:
+        raise RuntimeError('LibreOffice не установлена. Установите ее перед запуском этой функции!')
+
+def _convert_xls_file(xls_path):
+    """
+    Конвертирует один .xls в .xlsx рядом с ним и удаляет исходный файл.
+    Возвращает путь к .xlsx или None, если конвертация не удалась.
+    """
+    folder_path = os.path.dirname(xls_path)
+    file_name = os.path.splitext(os.path.basename(xls_path))[0]
+    xlsx_path = os.path.join(folder_path, file_name + '.xlsx')
+
+    # Конвертация xls в xlsx
+    try:
+        subprocess.run([
+            'libreoffice', '--headless', '--convert-to', 'xlsx', '--outdir', folder_path, xls_path
+        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if os.path.exists(xlsx_path):
+            os.remove(xls_path)
+            return xlsx_path
+    except Exception as e:
+        pass  # Можно добавить логгирование ошибок, если нужно
+    return None
+
 def convert_and_replace_xls_to_xlsx(root_folder):
     """
     Рекурсивно конвертирует все .xls-файлы в указанной папке (и вложенных папках) в .xlsx с помощью LibreOffice.
     Новые .xlsx-файлы сохраняются в тех же папках. Исходные .xls-файлы удаляются.
     Требует установленной LibreOffice (на Colab - !apt-get install -y libreoffice).
     """
-    # Проверка наличия libreoffice
-    try:
-        subprocess.run(['libreoffice', '--version'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    except Exception:
-        raise RuntimeError('LibreOffice не установлена. Установите ее перед запуском этой функции!')
+    _require_libreoffice()
 
     # Рекурсивный поиск .xls
     xls_files = [y for x in os.walk(root_folder) for y in glob.glob(os.path.join(x[0], '*.xls'))]
 
     for i in trange(len(xls_files), desc="Конвертация xls → xlsx", unit="файл"):
-        xls_path = xls_files[i]
-        folder_path = os.path.dirname(xls_path)
-        file_name = os.path.splitext(os.path.basename(xls_path))[0]
-        xlsx_path = os.path.join(folder_path, file_name + '.xlsx')
-
-        # Конвертация xls в xlsx
-        try:
-            subprocess.run([
-                'libreoffice', '--headless', '--convert-to', 'xlsx', '--outdir', folder_path, xls_path
-            ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if os.path.exists(xlsx_path):
-                os.remove(xls_path)
-        except Exception as e:
-            pass  # Можно добавить логгирование ошибок, если нужно
+        _convert_xls_file(xls_files[i])
 
 # Пример вызова:
 # convert_and_replace_xls_to_xlsx('/content/gdrive/MyDrive/VLGR')
 
 
 
-def excel_parser_STATEMENT(file_path):
-    """
-    Парсит Excel-файл в потоковый DataFrame.
-
-    Параметры:
-    - file_path: str, путь к файлу Excel
+# Переименование уровней ОСВ (названия из A6–A8) в столбцы объединённой таблицы
+STATEMENT_RENAME = {
+    'Контрагенты': 'Partner',
+    'Договоры': 'Contract',
+    'Подразделение': 'Estate',
+    'Статьи движения денежных средств': 'Category',
+    'Статьи затрат': 'Category',
+    'Банковские счета': 'Bank Account',
+    'Period': 'Date'
+}
 
-    Возвращает:
-    - DataFrame с потоковой структурой данных
+def _statement_frame(rows_data, level_names, rename=None):
+    """
+    Постобработка строк excel_parser_STATEMENT (pandas): счёт, дата периода, переименование
+    уровней (rename, по умолчанию STATEMENT_RENAME), «итого», порядок столбцов, очистка пробелов.
     """
-    def extract_month_year(text):
-        match = re.search(r'([А-ЯЁа-яё]+)\s+(\d{4})', text)
-        return f"{match.group(1)} {match.group(2)}" if match else text
-
-    def get_cell_color(cell):
-        return cell.fill.start_color.rgb if cell.fill.start_color else None
-
-    wb = load_workbook(file_path, data_only=True)
-    sheet = wb.active
-
-    # Автоматическое формирование маски из ячеек A6, A7
-    level_names = {
-        'account': sheet['A6'].value if sheet['A6'].value else None,
-        'sublevel': sheet['A7'].value if sheet['A7'].value else None,
-        'detail': sheet['A8'].value if sheet['A8'].value else None,
-    }
-
-    company_name = sheet['A1'].value.strip()
-    date_info = extract_month_year(sheet['A2'].value.strip())
-
-    start_row = 9
-    max_row = sheet.max_row
-
-    columns_mapping = {
-        2: ('Сальдо на начало периода', 'Дебет'),
-        3: ('Сальдо на начало периода', 'Кредит'),
-        4: ('Обороты за период', 'Дебет'),
-        5: ('Обороты за период', 'Кредит'),
-        6: ('Сальдо на конец периода', 'Дебет'),
-        7: ('Сальдо на конец периода', 'Кредит'),
-    }
-
-    current_account = None
-    current_sublevel = None
-    rows_data = []
-
-    for row in range(start_row, max_row + 1):
-        cell = sheet.cell(row=row, column=1)
-        cell_value = cell.value
-        cell_color = get_cell_color(cell)
-
-        if cell_color == 'FFD6E5CB' and (cell_value is not None and 'итого' in str(cell_value).strip().lower()):
-            for col_idx in range(2, 8):
-                cell_data = sheet.cell(row=row, column=col_idx).value
-                if cell_data not in (None, ''):
-                    indicator, debit_credit = columns_mapping[col_idx]
-                    rows_data.append({
-                        'Company': company_name,
-                        'Period': date_info,
-                        level_names['account']: cell_value,  # сохраняем точное название итога
-                        level_names['sublevel']: None,
-                        level_names['detail']: None,
-                        'Показатель': indicator,
-                        'Дебет/Кредит': debit_credit,
-                        'Value': cell_data
-                    })
-            continue
-
-        # if cell_color == 'FFE4F0DD':
-        #     current_account = cell_value
-        #     current_sublevel = None
-            
-        if cell_color == 'FFE4F0DD':
-            current_account = cell_value
-            current_sublevel = None
-            # Добавляем агрегатную строку, если есть значения!
-            for col_idx in range(2, 8):
-                cell_data = sheet.cell(row=row, column=col_idx).value
-                if cell_data not in (None, ''):
-                    indicator, debit_credit = columns_mapping[col_idx]
-                    rows_data.append({
-                        'Company': company_name,
-                        'Period': date_info,
-                        level_names['account']: current_account,
-                        level_names['sublevel']: None,
-                        level_names['detail']: None,
-                        'Показатель': indicator,
-                        'Дебет/Кредит': debit_credit,
-                        'Value': cell_data
-                    })
-            continue
-
-        elif cell_color == 'FFF0F6EF':
-            current_sublevel = cell_value
-
-        elif cell_color == 'FFD6E5CB':
-            continue
-
-        else:
-            for col_idx in range(2, 8):
-                cell_data = sheet.cell(row=row, column=col_idx).value
-                if cell_data not in (None, ''):
-                    indicator, debit_credit = columns_mapping[col_idx]
-                    rows_data.append({
-                        'Company': company_name,
-                        'Period': date_info,
-                        level_names['account']: current_account,
-                        level_names['sublevel']: current_sublevel,
-                        level_names['detail']: cell_value,
-                        'Показатель': indicator,
-                        'Дебет/Кредит': debit_credit,
-                        'Value': cell_data
-                    })
-
     df = pd.DataFrame(rows_data)
 
     # -----------------------------
@@ -207,15 +120,7 @@ def excel_parser_STATEMENT(file_path):
     df['Period'] = pd.to_datetime(df['Period'].apply(next_month_date))
 
     # Универсальное переименование столбцов по словарю
-    rename_dict = {
-        'Контрагенты': 'Partner',
-        'Договоры': 'Contract',
-        'Подразделение': 'Estate',
-        'Статьи движения денежных средств': 'Category',
-        'Статьи затрат': 'Category',
-        'Банковские счета': 'Bank Account',
-        'Period': 'Date'
-    }
+    rename_dict = STATEMENT_RENAME if rename is None else rename
     df = df.rename(columns=rename_dict)
 
     # 1. Добавить столбец если его нет
@@ -286,112 +191,161 @@ def excel_parser_STATEMENT(file_path):
     
     return df
 
-# # Пример использования
-# df = excel_parser_STATEMENT('/content/ОСВ 76 февраль 2025.xlsx')
-# df
-
-
-
-
-
+def excel_parser_STATEMENT(file_path, backend='pandas', sheets=None):
+    """
+    Парсит Excel-файл в потоковый DataFrame.
 
-import pandas as pd
-from datetime import datetime, timedelta
-from openpyxl import load_workbook
+    Параметры:
+    - file_path: путь к файлу Excel, bytes или file-like объект (например, вложение письма или файл из zip)
+    - backend: 'pandas' (по умолчанию) или 'polars' — постобработка в Polars, результат pl.DataFrame
+    - sheets: None — только активный лист; 'all' или список имён/масок/индексов листов —
+      книга загружается один раз, разбирается каждый подходящий лист, имя листа — в столбце SHEET
 
-def excel_parser_INCOME(file_path):
-    """
-    Парсит Excel-файл с анализом выручки в потоковую таблицу.
-    Теперь поддерживает множественные оттенки цвета для секций, компаний и объектов.
+    Возвращает:
+    - DataFrame с потоковой структурой данных
     """
-
-    from datetime import datetime, timedelta
-    from openpyxl import load_workbook
-    import pandas as pd
+    def extract_month_year(text):
+        match = re.search(r'([А-ЯЁа-яё]+)\s+(\d{4})', text)
+        return f"{match.group(1)} {match.group(2)}" if match else text
 
     def get_cell_color(cell):
-        return cell.fill.fgColor.rgb if hasattr(cell.fill.fgColor, 'rgb') else None
+        return cell.fill.start_color.rgb if cell.fill.start_color else None
 
-    def get_next_month_firstday(date_range_str):
-        if not isinstance(date_range_str, str):
-            return None
-        parts = date_range_str.split('-')
-        if len(parts) < 2:
-            return None
-        date_str = parts[1].strip().split(' ')[0]
-        try:
-            dt = datetime.strptime(date_str, '%d.%m.%Y')
-            next_month = (dt.replace(day=1) + timedelta(days=32)).replace(day=1)
-            return next_month.strftime('%Y-%m-%d')
-        except Exception:
-            return None
+    if sheets is not None:
+        return _parse_workbook_sheets(excel_parser_STATEMENT, file_path, sheets, backend=backend)
+    sheet = _worksheet_of(file_path)
 
-    # ВАРИАНТЫ ЦВЕТОВ (добавьте сюда все оттенки, которые реально встречаются)
-    SECTION_COLORS = ['00E0FFE0', 'FFE0FFE0', 'FFCCFFCC', '00CCFFCC', '00CFFFD7', None]
-    COMPANY_COLORS = ['00A6CAF0', 'FFA6CAF0', 'FFB7DEE8', 'FFB7DEE9', None]
-    OBJECT_COLORS  = ['00C0DCC0', 'FFC0DCC0', 'FF99CC99', 'FF92D050', 'FF00B050', None]
+    # Автоматическое формирование маски из ячеек A6, A7
+    level_names = {
+        'account': sheet['A6'].value if sheet['A6'].value else None,
+        'sublevel': sheet['A7'].value if sheet['A7'].value else None,
+        'detail': sheet['A8'].value if sheet['A8'].value else None,
+    }
 
-    wb = load_workbook(file_path, data_only=True)
-    ws = wb.active
+    company_name = sheet['A1'].value.strip()
+    date_info = extract_month_year(sheet['A2'].value.strip())
 
-    report_date = ws['B3'].value.strip() if ws['B3'].value else None
+    start_row = 9
+    max_row = sheet.max_row
 
-    start_row = None
-    for row in range(1, ws.max_row + 1):
-        if ws.cell(row=row, column=2).value and 'Наименование' in str(ws.cell(row=row, column=2).value):
-            start_row = row + 1
-            break
-    if start_row is None:
-        raise ValueError("Не найдена строка с заголовком 'Наименование'.")
+    columns_mapping = {
+        2: ('Сальдо на начало периода', 'Дебет'),
+        3: ('Сальдо на начало периода', 'Кредит'),
+        4: ('Обороты за период', 'Дебет'),
+        5: ('Обороты за период', 'Кредит'),
+        6: ('Сальдо на конец периода', 'Дебет'),
+        7: ('Сальдо на конец периода', 'Кредит'),
+    }
 
-    current_section = None
-    current_company = None
-    current_object = None
+    current_account = None
+    current_sublevel = None
     rows_data = []
 
-    for row in range(start_row, ws.max_row + 1):
-        cell = ws.cell(row=row, column=2)
+    for row in range(start_row, max_row + 1):
+        cell = sheet.cell(row=row, column=1)
         cell_value = cell.value
         cell_color = get_cell_color(cell)
 
-        # Сравниваем по спискам цветов:
-        if cell_color in SECTION_COLORS:
-            current_section = str(cell_value).strip() if cell_value else None
-            current_company = None
-            current_object = None
-            continue
-        elif cell_color in COMPANY_COLORS:
-            current_company = str(cell_value).strip() if cell_value else None
-            current_object = None
-            continue
-        elif cell_color in OBJECT_COLORS:
-            current_object = str(cell_value).strip() if cell_value else None
+        if cell_color == 'FFD6E5CB' and (cell_value is not None and 'итого' in str(cell_value).strip().lower()):
+            for col_idx in range(2, 8):
+                cell_data = sheet.cell(row=row, column=col_idx).value
+                if cell_data not in (None, ''):
+                    indicator, debit_credit = columns_mapping[col_idx]
+                    rows_data.append({
+                        'Company': company_name,
+                        'Period': date_info,
+                        level_names['account']: cell_value,  # сохраняем точное название итога
+                        level_names['sublevel']: None,
+                        level_names['detail']: None,
+                        'Показатель': indicator,
+                        'Дебет/Кредит': debit_credit,
+                        'Value': cell_data
+                    })
             continue
 
-        # Пропуск пустых строк
-        if not any([ws.cell(row=row, column=col).value for col in range(2, 6)]):
+        # if cell_color == 'FFE4F0DD':
+        #     current_account = cell_value
+        #     current_sublevel = None
+            
+        if cell_color == 'FFE4F0DD':
+            current_account = cell_value
+            current_sublevel = None
+            # Добавляем агрегатную строку, если есть значения!
+            for col_idx in range(2, 8):
+                cell_data = sheet.cell(row=row, column=col_idx).value
+                if cell_data not in (None, ''):
+                    indicator, debit_credit = columns_mapping[col_idx]
+                    rows_data.append({
+                        'Company': company_name,
+                        'Period': date_info,
+                        level_names['account']: current_account,
+                        level_names['sublevel']: None,
+                        level_names['detail']: None,
+                        'Показатель': indicator,
+                        'Дебет/Кредит': debit_credit,
+                        'Value': cell_data
+                    })
             continue
 
-        # Основные поля (2-5 столбцы)
-        act_value        = ws.cell(row=row, column=2).value
-        contract_value   = ws.cell(row=row, column=3).value
-        contragent_value = ws.cell(row=row, column=4).value
-        revenue_value    = ws.cell(row=row, column=5).value
+        elif cell_color == 'FFF0F6EF':
+            current_sublevel = cell_value
 
-        rows_data.append({
-            'Date': report_date,
-            'Category': current_section,
-            'Company': current_company,
-            'Estate': current_object,
-            'Document': act_value,
-            'Contract': contract_value,
-            'Partner': contragent_value,
-            'Value': revenue_value,
-        })
+        elif cell_color == 'FFD6E5CB':
+            continue
+
+        else:
+            for col_idx in range(2, 8):
+                cell_data = sheet.cell(row=row, column=col_idx).value
+                if cell_data not in (None, ''):
+                    indicator, debit_credit = columns_mapping[col_idx]
+                    rows_data.append({
+                        'Company': company_name,
+                        'Period': date_info,
+                        level_names['account']: current_account,
+                        level_names['sublevel']: current_sublevel,
+                        level_names['detail']: cell_value,
+                        'Показатель': indicator,
+                        'Дебет/Кредит': debit_credit,
+                        'Value': cell_data
+                    })
+
+    if backend != 'pandas':
+        return _statement_polars(rows_data, level_names)
+    return _statement_frame(rows_data, level_names)
+
+# # Пример использования
+# df = excel_parser_STATEMENT('/content/ОСВ 76 февраль 2025.xlsx')
+# df
+
+
+
+
+
+
+import pandas as pd
+from datetime import datetime, timedelta
+from openpyxl import load_workbook
 
+def _income_next_month_firstday(date_range_str):
+    """'01.01.2025 - 31.01.2025' -> '2025-02-01' (первое число месяца после конца периода) или None."""
+    if not isinstance(date_range_str, str):
+        return None
+    parts = date_range_str.split('-')
+    if len(parts) < 2:
+        return None
+    date_str = parts[1].strip().split(' ')[0]
+    try:
+        dt = datetime.strptime(date_str, '%d.%m.%Y')
+        next_month = (dt.replace(day=1) + timedelta(days=32)).replace(day=1)
+        return next_month.strftime('%Y-%m-%d')
+    except Exception:
+        return None
+
+def _income_frame(rows_data):
+    """Постобработка строк excel_parser_INCOME (pandas): дата отчёта, «Итого:», Value в число, очистка пробелов."""
     df = pd.DataFrame(rows_data)
 
-    df['Date'] = df['Date'].apply(get_next_month_firstday)
+    df['Date'] = df['Date'].apply(_income_next_month_firstday)
     df['Date'] = pd.to_datetime(df['Date'])
 
     mask_itogo = (df['Document'] == 'Итого:')
@@ -448,14 +402,500 @@ def excel_parser_INCOME(file_path):
     
     return df
 
+def excel_parser_INCOME(file_path, backend='pandas', sheets=None):
+    """
+    Парсит Excel-файл с анализом выручки в потоковую таблицу.
+    Теперь поддерживает множественные оттенки цвета для секций, компаний и объектов.
+    file_path — путь к файлу, bytes или file-like объект.
+    backend — 'pandas' (по умолчанию) или 'polars' (постобработка в Polars, результат pl.DataFrame).
+    sheets — None (активный лист) | 'all' | список имён/масок/индексов листов: книга загружается
+    один раз, каждый лист разбирается отдельно, имя листа — в столбце SHEET.
+    """
+
+    from datetime import datetime, timedelta
+    from openpyxl import load_workbook
+    import pandas as pd
+
+    def get_cell_color(cell):
+        return cell.fill.fgColor.rgb if hasattr(cell.fill.fgColor, 'rgb') else None
+
+    # ВАРИАНТЫ ЦВЕТОВ (добавьте сюда все оттенки, которые реально встречаются)
+    SECTION_COLORS = ['00E0FFE0', 'FFE0FFE0', 'FFCCFFCC', '00CCFFCC', '00CFFFD7', None]
+    COMPANY_COLORS = ['00A6CAF0', 'FFA6CAF0', 'FFB7DEE8', 'FFB7DEE9', None]
+    OBJECT_COLORS  = ['00C0DCC0', 'FFC0DCC0', 'FF99CC99', 'FF92D050', 'FF00B050', None]
+
+    if sheets is not None:
+        return _parse_workbook_sheets(excel_parser_INCOME, file_path, sheets, backend=backend)
+    ws = _worksheet_of(file_path)
+
+    report_date = ws['B3'].value.strip() if ws['B3'].value else None
+
+    start_row = None
+    for row in range(1, ws.max_row + 1):
+        if ws.cell(row=row, column=2).value and 'Наименование' in str(ws.cell(row=row, column=2).value):
+            start_row = row + 1
+            break
+    if start_row is None:
+        raise ValueError("Не найдена строка с заголовком 'Наименование'.")
+
+    current_section = None
+    current_company = None
+    current_object = None
+    rows_data = []
+
+    for row in range(start_row, ws.max_row + 1):
+        cell = ws.cell(row=row, column=2)
+        cell_value = cell.value
+        cell_color = get_cell_color(cell)
+
+        # Сравниваем по спискам цветов:
+        if cell_color in SECTION_COLORS:
+            current_section = str(cell_value).strip() if cell_value else None
+            current_company = None
+            current_object = None
+            continue
+        elif cell_color in COMPANY_COLORS:
+            current_company = str(cell_value).strip() if cell_value else None
+            current_object = None
+            continue
+        elif cell_color in OBJECT_COLORS:
+            current_object = str(cell_value).strip() if cell_value else None
+            continue
+
+        # Пропуск пустых строк
+        if not any([ws.cell(row=row, column=col).value for col in range(2, 6)]):
+            continue
+
+        # Основные поля (2-5 столбцы)
+        act_value        = ws.cell(row=row, column=2).value
+        contract_value   = ws.cell(row=row, column=3).value
+        contragent_value = ws.cell(row=row, column=4).value
+        revenue_value    = ws.cell(row=row, column=5).value
+
+        rows_data.append({
+            'Date': report_date,
+            'Category': current_section,
+            'Company': current_company,
+            'Estate': current_object,
+            'Document': act_value,
+            'Contract': contract_value,
+            'Partner': contragent_value,
+            'Value': revenue_value,
+        })
+
+    if backend != 'pandas':
+        return _income_polars(rows_data, _income_next_month_firstday(report_date))
+
+    return _income_frame(rows_data)
+
 
 
 import os
 import glob
 import pandas as pd
-from tqdm import trange
+import numpy as np
+import shutil
+import tempfile
+from tqdm import tqdm, trange
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ----------------- Отбор файлов по «шапке» отчёта (период / компания) -----------------
+# Перед полным парсингом из первых строк листа (режим read_only) дешево читаются
+# компания и отчётный период. Файлы, которые заведомо не попадают в фильтр, не парсятся.
+
+_MONTHS_RU = {
+    'январь': 1, 'февраль': 2, 'март': 3, 'апрель': 4, 'май': 5, 'июнь': 6,
+    'июль': 7, 'август': 8, 'сентябрь': 9, 'октябрь': 10, 'ноябрь': 11, 'декабрь': 12
+}
+
+def _read_header_grid(file_path, max_rows=12, max_cols=12):
+    """
+    Читает левый верхний угол активного листа (max_rows × max_cols) в режиме read_only.
+    file_path — путь, bytes, file-like объект или _ZipMember.
+    Возвращает список строк (списков значений), дополненных None до max_cols.
+    """
+    wb = load_workbook(_workbook_source(file_path), read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        grid = []
+        for row in ws.iter_rows(min_row=1, max_row=max_rows, max_col=max_cols, values_only=True):
+            row = list(row)
+            grid.append(row + [None] * (max_cols - len(row)))
+    finally:
+        wb.close()
+    while len(grid) < max_rows:
+        grid.append([None] * max_cols)
+    return grid
+
+def _first_day_of_next_month(dt):
+    return (pd.Timestamp(dt).replace(day=1) + pd.DateOffset(months=1)).normalize()
+
+def _header_period(text):
+    """
+    Определяет период по тексту шапки: 'дд.мм.гггг - дд.мм.гггг', 'N квартал гггг',
+    'Месяц гггг' или 'гггг г.'. Возвращает (начало, конец) или (None, None).
+    """
+    if not text:
+        return None, None
+    s = str(text).replace('\xa0', ' ').lower()
+
+    dates = re.findall(r'\d{2}\.\d{2}\.\d{4}', s)
+    if dates:
+        parsed = [pd.to_datetime(d, format='%d.%m.%Y', errors='coerce') for d in dates]
+        parsed = [d for d in parsed if not pd.isna(d)]
+        if parsed:
+            return min(parsed), max(parsed)
+
+    m = re.search(r'(\d)\s*квартал\w*\s+(\d{4})', s)
+    if m:
+        start = pd.Timestamp(year=int(m.group(2)), month=3 * int(m.group(1)) - 2, day=1)
+        return start, start + pd.DateOffset(months=3) - pd.Timedelta(days=1)
+
+    m = re.search(r'([а-яё]+)\s+(\d{4})', s)
+    if m and m.group(1) in _MONTHS_RU:
+        start = pd.Timestamp(year=int(m.group(2)), month=_MONTHS_RU[m.group(1)], day=1)
+        return start, start + pd.DateOffset(months=1) - pd.Timedelta(days=1)
+
+    m = re.search(r'(\d{4})\s*г', s)
+    if m:
+        year = int(m.group(1))
+        return pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year, month=12, day=31)
+
+    return None, None
+
+def sniff_report_header(file_path, report_type):
+    """
+    Быстро читает метаданные отчёта из «шапки» без полного парсинга файла.
+
+    Аргументы:
+        file_path   (str | bytes | file-like): Путь к .xlsx-файлу или его содержимое
+        report_type (str): 'STATEMENT' | 'INCOME' | 'SUPPLIERS'
+
+    Возвращает:
+        dict: {'Company': str | None, 'Date_from': Timestamp | None, 'Date_to': Timestamp | None}
+              Даты в тех же единицах, что и столбец 'Date' на выходе парсера
+              (для ОСВ и выручки — первое число следующего месяца).
+              None означает «определить не удалось» — такой файл фильтром не отсекается.
+    """
+    return _header_meta_from_grid(_read_header_grid(file_path), report_type)
+
+def _header_meta_from_grid(grid, report_type):
+    meta = {'Company': None, 'Date_from': None, 'Date_to': None}
+
+    def _str(v):
+        s = str(v).strip() if v is not None else ''
+        return s or None
+
+    if report_type == 'STATEMENT':
+        # A1 — компания, A2 — 'Оборотно-сальдовая ведомость ... за Февраль 2025 г.'
+        meta['Company'] = _str(grid[0][0])
+        start, _ = _header_period(_str(grid[1][0]))
+        if start is not None:
+            meta['Date_from'] = meta['Date_to'] = _first_day_of_next_month(start)
+
+    elif report_type == 'INCOME':
+        # B3 — 'дд.мм.гггг - дд.мм.гггг'; компания указана только в теле отчёта
+        _, end = _header_period(_str(grid[2][1]))
+        if end is not None:
+            meta['Date_from'] = meta['Date_to'] = _first_day_of_next_month(end)
+
+    elif report_type == 'SUPPLIERS':
+        # Компания — та же логика, что и в excel_parser_SUPPLIERS (_find_company)
+        for r in range(4):
+            for c in range(3):
+                val = _str(grid[r][c])
+                if val and len(val) >= 3 and not re.search(r'(период|отчет|дата|счет|наименование|организац)', val, re.I):
+                    meta['Company'] = val
+                    break
+            if meta['Company']:
+                break
+        # Период — первая строка шапки, в которой он распознаётся
+        for r in range(6):
+            text = ' '.join(str(v) for v in grid[r] if v is not None)
+            start, end = _header_period(text)
+            if start is not None:
+                meta['Date_from'], meta['Date_to'] = start, end
+                break
+
+    else:
+        raise ValueError(f"Неизвестный тип отчёта: {report_type}")
+
+    return meta
+
+def _normalize_filters(date_from, date_to, companies):
+    date_from = pd.Timestamp(date_from) if date_from is not None else None
+    date_to = pd.Timestamp(date_to) if date_to is not None else None
+    if isinstance(companies, str):
+        companies = [companies]
+    if companies:
+        companies = {normalize_company_names(c).upper() for c in companies if normalize_company_names(c)}
+    else:
+        companies = None
+    return date_from, date_to, companies
+
+def _header_may_match(meta, date_from, date_to, companies):
+    """False — только если по метаданным файл заведомо не попадает в фильтр."""
+    if date_from is not None and meta.get('Date_to') is not None and meta['Date_to'] < date_from:
+        return False
+    if date_to is not None and meta.get('Date_from') is not None and meta['Date_from'] > date_to:
+        return False
+    if companies and meta.get('Company'):
+        if normalize_company_names(meta['Company']).upper() not in companies:
+            return False
+    return True
+
+def filter_files_by_header(files, report_type, date_from=None, date_to=None, companies=None):
+    """
+    Отбирает файлы, которые могут содержать данные за период [date_from, date_to]
+    и/или по компаниям companies, по метаданным из «шапки» (sniff_report_header).
+    Файлы с нераспознанной шапкой остаются в выборке — их отсечёт фильтр строк после парсинга.
+    """
+    date_from, date_to, companies = _normalize_filters(date_from, date_to, companies)
+    if date_from is None and date_to is None and not companies:
+        return list(files)
+
+    selected = []
+    for f in files:
+        try:
+            meta = sniff_report_header(f, report_type)
+        except Exception:
+            selected.append(f)
+            continue
+        if _header_may_match(meta, date_from, date_to, companies):
+            selected.append(f)
+    return selected
+
+def filter_rows_by_period_company(df, date_from=None, date_to=None, companies=None):
+    """
+    Фильтр строк после парсинга: Date в [date_from, date_to], Company из companies.
+    Строки с пустыми Date/Company (итоги) сохраняются — файл уже прошёл отбор по шапке.
+    """
+    date_from, date_to, companies = _normalize_filters(date_from, date_to, companies)
+    if df.empty or (date_from is None and date_to is None and not companies):
+        return df
+
+    mask = pd.Series(True, index=df.index)
+    if (date_from is not None or date_to is not None) and 'Date' in df.columns:
+        dates = pd.to_datetime(df['Date'], errors='coerce')
+        if date_from is not None:
+            mask &= dates.isna() | (dates >= date_from)
+        if date_to is not None:
+            mask &= dates.isna() | (dates <= date_to)
+    if companies and 'Company' in df.columns:
+        uniq = df['Company'].dropna().unique()
+        keep = {c for c in uniq if (normalize_company_names(c) or '').upper() in companies}
+        mask &= df['Company'].isna() | df['Company'].isin(keep)
+    return df.loc[mask].reset_index(drop=True)
+
+# ----------------- Общий прогон парсеров по списку файлов -----------------
+
+def _parse_one_file(file, root_main, parser_func, backend='pandas', sheets=None):
+    kwargs = {} if sheets is None else {'sheets': sheets}
+    if backend != 'pandas':
+        import polars as pl
+        df = parser_func(file, backend='polars', **kwargs)
+        return df.with_columns(pl.lit(_source_file_name(file, root_main), dtype=pl.Utf8).alias('SOURCE_FILE'))
+    df = parser_func(file, **kwargs)
+    # Получаем относительный путь файла от root_main:
+    df['SOURCE_FILE'] = _source_file_name(file, root_main)
+    return df
+
+def _run_parse_tasks(tasks, desc="Парсинг файлов", max_workers=None, executor='process',
+                     guard=None, errors=None, prefetch=0, transfer='auto'):
+    """
+    Выполняет задачи [(func, args, file), ...] последовательно (max_workers=None/1)
+    или в одном пуле (executor='process' | 'thread'). В пул задачи подаются от самых
+    больших файлов к самым маленьким, чтобы длинные файлы не оказались в хвосте.
+    guard — защищённый режим (каждый файл в отдельном процессе с таймаутом и лимитами),
+    см. _run_guarded_tasks.
+    prefetch — сколько следующих файлов заранее читать в память фоновыми потоками
+    (см. _prefetch_sources); в защищённом режиме не используется.
+    transfer — как процессы пула возвращают таблицы: 'arrow' — файлами Arrow IPC в общей памяти
+    (см. _transfer_task), 'pickle' — сериализацией; 'auto' — 'arrow', если установлен pyarrow.
+    В защищённом режиме результат по-прежнему передаётся через pickle.
+
+    Возвращает список результатов в порядке tasks; для упавших задач — None (ошибка печатается).
+    errors (list, optional): сюда добавляются записи об ошибках {'file', 'status', 'error', ...}.
+    """
+    if guard:
+        return _run_guarded_tasks(tasks, desc, max_workers, guard, errors)
+
+    results = [None] * len(tasks)
+
+    def _report(i, e):
+        print(f'Ошибка при парсинге файла {tasks[i][2]}: {e}')
+        if errors is not None:
+            errors.append({'file': str(tasks[i][2]), 'status': 'error', 'error': f'{type(e).__name__}: {e}'})
+
+    if not max_workers or max_workers <= 1:
+        with tqdm(total=len(tasks), desc=desc, unit="файл") as pbar:
+            for i, source in _task_sources(tasks, range(len(tasks)), prefetch):
+                func, args, file = tasks[i]
+                try:
+                    results[i] = func(*_with_source(args, file, source))
+                except Exception as e:
+                    _report(i, e)
+                pbar.update(1)
+        return results
+
+    def _size(i):
+        try:
+            return _source_size(tasks[i][2])
+        except (OSError, TypeError):
+            return 0
+    order = sorted(range(len(tasks)), key=_size, reverse=True)
+
+    if executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=_process_context())
+    else:
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+    spill_dir = None
+    if _resolve_transfer(transfer, executor, max_workers) == 'arrow':
+        spill_dir = tempfile.mkdtemp(prefix='VLGR-transfer-', dir=_transfer_base_dir())
+    try:
+        with pool:
+            futures = {}
+            with tqdm(total=len(tasks), desc=desc, unit="файл") as pbar:
+                def _collect(done):
+                    for fut in done:
+                        i = futures.pop(fut)
+                        try:
+                            results[i] = _transfer_decode(fut.result()) if spill_dir else fut.result()
+                        except Exception as e:
+                            _report(i, e)
+                        pbar.update(1)
+
+                for i, source in _task_sources(tasks, order, prefetch):
+                    # С предвыборкой в пуле держится не больше max_workers + prefetch файлов в памяти
+                    if prefetch and len(futures) >= max_workers + prefetch:
+                        _collect(wait(futures, return_when=FIRST_COMPLETED)[0])
+                    func, args, file = tasks[i]
+                    args = _with_source(args, file, source)
+                    if spill_dir:
+                        futures[pool.submit(_transfer_task, spill_dir, func, *args)] = i
+                    else:
+                        futures[pool.submit(func, *args)] = i
+                while futures:
+                    _collect(wait(futures, return_when=FIRST_COMPLETED)[0])
+    finally:
+        if spill_dir:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+    return results
+
+# ----------------- Целевые схемы объединённых таблиц -----------------
+# Столбец -> dtype; порядок ключей = порядок столбцов результата.
+# Каждый пофайловый DataFrame приводится к схеме, после чего объединение —
+# прямое поколоночное склеивание массивов без выравнивания столбцов и upcast в object.
+
+STATEMENT_SCHEMA = {
+    'Date': 'datetime64[ns]', 'Company': 'object', 'Estate': 'object', 'Type': 'object',
+    'Category': 'object', 'Partner': 'object', 'Contract': 'object', 'Document': 'object',
+    'Bank Account': 'object', 'Value': 'float64', 'Счет': 'object',
+    'Показатель': 'object', 'Дебет/Кредит': 'object', 'SOURCE_FILE': 'object',
+}
+INCOME_SCHEMA = {
+    'Date': 'datetime64[ns]', 'Company': 'object', 'Estate': 'object', 'Type': 'object',
+    'Category': 'object', 'Partner': 'object', 'Contract': 'object', 'Document': 'object',
+    'Value': 'float64', 'Счет': 'object', 'SOURCE_FILE': 'object',
+}
+SUPPLIERS_SCHEMA = {
+    'Date': 'object', 'Company': 'object', 'Doc': 'object', 'AnDT': 'object', 'AnCR': 'object',
+    'DtCr': 'object', 'Счет': 'object', 'Value': 'float64', 'SOURCE_FILE': 'object',
+}
+# SUPPLIERS после enrich_suppliers_semantics
+SUPPLIERS_ENRICHED_SCHEMA = dict(SUPPLIERS_SCHEMA, **{
+    'Partner': 'object', 'Supplier': 'object', 'Related Company': 'object', 'Category': 'object',
+    'Estate': 'object', 'Contract': 'object', 'Document': 'object', 'Bank Account': 'object', 'temp': 'object',
+})
+REPORT_SCHEMAS = {
+    'STATEMENT': STATEMENT_SCHEMA,
+    'INCOME': INCOME_SCHEMA,
+    'SUPPLIERS': SUPPLIERS_SCHEMA,
+    'SUPPLIERS_ENRICHED': SUPPLIERS_ENRICHED_SCHEMA,
+}
+
+def conform_to_schema(df, schema):
+    """
+    Приводит DataFrame одного файла к целевой схеме.
+
+    Аргументы:
+        df     (pd.DataFrame): Результат парсера одного файла
+        schema (str | dict): Тип отчёта ('STATEMENT' | 'INCOME' | 'SUPPLIERS') или схема {столбец: dtype}
+
+    Возвращает:
+        (pd.DataFrame, list): DataFrame со столбцами схемы в её порядке (недостающие — пустые,
+        dtype приводится только там, где отличается) и список лишних столбцов, которых нет в схеме.
+    """
+    if isinstance(schema, str):
+        schema = REPORT_SCHEMAS[schema]
+
+    data = {}
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            data[col] = pd.Series(None, index=df.index, dtype=dtype)
+            continue
+        s = df[col]
+        if str(s.dtype) != dtype:
+            if dtype == 'float64':
+                s = pd.to_numeric(s, errors='coerce').astype('float64')
+            elif dtype.startswith('datetime64'):
+                s = pd.to_datetime(s, errors='coerce').astype(dtype)
+        data[col] = s
+
+    extras = [col for col in df.columns if col not in schema]
+    for col in extras:
+        data[col] = df[col]
+    return pd.DataFrame(data, index=df.index), extras
+
+def _stack_frames(frames, schema, extra_columns):
+    """Поколоночное склеивание уже приведённых к схеме DataFrame."""
+    data = {}
+    for col, dtype in list(schema.items()) + [(c, 'object') for c in extra_columns]:
+        parts = []
+        for f in frames:
+            if col in f.columns:
+                parts.append(f[col].to_numpy())
+            else:
+                parts.append(np.full(len(f), None, dtype=object))
+        if parts:
+            data[col] = np.concatenate(parts)
+        else:
+            data[col] = pd.Series([], dtype=dtype)
+    return pd.DataFrame(data)
+
+def _combine_report_frames(frames, report_type, extra_columns='keep'):
+    """
+    Объединяет пофайловые DataFrame отчёта одного типа по схеме REPORT_SCHEMAS[report_type].
 
-def parse_statement_folder(root_main, root_statement, parser_func):
+    extra_columns: 'keep' — лишние столбцы (например, незнакомые названия уровней из A6–A8)
+                   добавляются в конец; 'drop' — отбрасываются. В обоих случаях о них печатается отчёт.
+    """
+    schema = REPORT_SCHEMAS[report_type]
+    frames = [df for df in frames if df is not None]
+
+    conformed = []
+    extras_seen = {}
+    for df in frames:
+        df, extras = conform_to_schema(df, schema)
+        for col in extras:
+            extras_seen.setdefault(col, []).append(df['SOURCE_FILE'].iloc[0] if len(df) else None)
+        conformed.append(df)
+
+    # SHEET (разбор с sheets=) — ожидаемый дополнительный столбец: не сообщается и не отбрасывается
+    reported = {col: files for col, files in extras_seen.items() if col != SHEET_COLUMN}
+    if reported:
+        print(f'Столбцы вне схемы {report_type}:')
+        for col, files in reported.items():
+            print(f'  {col!r}: {len(files)} файл(ов), например {files[0]}')
+
+    extra_cols = [col for col in extras_seen if extra_columns == 'keep' or col == SHEET_COLUMN]
+    return _stack_frames(conformed, schema, extra_cols)
+
+
+def parse_statement_folder(root_main, root_statement, parser_func,
+                           date_from=None, date_to=None, companies=None,
+                           max_workers=None, store=None, guard=None, shard=None,
+                           include_zip=False, backend='pandas', prefetch=0, sheets=None, transfer='auto'):
     """
     Обрабатывает все .xlsx-файлы ОСВ/ведомостей во вложенных папках, объединяет их в единый DataFrame.
 
@@ -463,53 +903,64 @@ def parse_statement_folder(root_main, root_statement, parser_func):
         root_main     (str): Корневая папка, например '/content/gdrive/MyDrive/Волгоград'
         root_statement(str): Подкаталог ведомостей, например 'Ведомость'
         parser_func (callable): Функция-парсер одного файла (например, VLGR.excel_parser_STATEMENT)
+        date_from, date_to (str | datetime, optional): Границы периода по столбцу 'Date'
+        companies   (str | list, optional): Компании (сравниваются после normalize_company_name)
+            Файлы, которые по «шапке» заведомо не попадают в фильтр, не парсятся.
+        max_workers (int, optional): Число процессов для параллельного парсинга (по умолчанию — последовательно)
+        store (str, optional): Путь к файлу SQLite — результат дополнительно загружается в хранилище (store_load)
+        guard (bool | dict, optional): Защищённый режим — каждый файл в отдельном процессе с таймаутом
+            и лимитами строк/памяти (см. GUARD_DEFAULTS); отчёт об ошибках — в df.attrs['parse_errors']
+        shard (tuple, optional): (i, n) — обработать только i-ю из n частей файлов (см. shard_files)
+        include_zip (bool): Читать также .xlsx внутри .zip-архивов (без распаковки на диск);
+            SOURCE_FILE таких файлов — '<путь к архиву>/<путь внутри архива>'
+        backend (str): 'pandas' | 'polars' | 'polars-lazy' — постобработка и объединение в Polars,
+            результат pl.DataFrame / pl.LazyFrame (parser_func должен принимать backend=, как excel_parser_*)
+        prefetch (int): Сколько следующих файлов заранее читать в память фоновыми потоками
+            (для сетевых папок, например Google Drive); 0 — без предвыборки
+        sheets (str | list, optional): 'all' или список имён/масок/индексов листов — разбирать
+            эти листы каждой книги (книга загружается один раз), имя листа — в столбце SHEET.
+            Отбор файлов по шапке при этом не выполняется: фильтры применяются к строкам
+        transfer (str): Как процессы возвращают таблицы файлов: 'auto' | 'arrow' — файлами Arrow IPC
+            в общей памяти, без pickle строк; 'pickle' — сериализацией (см. _transfer_task)
 
     Возвращает:
         pd.DataFrame: Общий потоковый DataFrame по всем найденным ведомостям
     """
+    _check_backend(backend)
     base_dir = os.path.join(root_main, root_statement)
-    all_files = glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True)
+    all_files = sorted(glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True))
+    if include_zip:
+        all_files = sorted(all_files + zip_workbooks(base_dir), key=str)
 
     print(f'Найдено файлов: {len(all_files)}')
+    if shard is not None:
+        all_files = shard_files(all_files, root_main, shard)
+        print(f'Шард {shard[0]} из {shard[1]}: {len(all_files)}')
+    if (date_from is not None or date_to is not None or companies) and sheets is None:
+        all_files = filter_files_by_header(all_files, 'STATEMENT', date_from, date_to, companies)
+        print(f'Отобрано по фильтрам: {len(all_files)}')
+
+    tasks = [(_parse_one_file, (file, root_main, parser_func, backend, sheets), file) for file in all_files]
+    errors = []
+    all_data = _run_parse_tasks(tasks, "Парсинг файлов", max_workers,
+                                guard=guard, errors=errors, prefetch=prefetch, transfer=transfer)
+    if backend != 'pandas':
+        df = _finish_report_polars(all_data, 'STATEMENT', backend, date_from, date_to, companies, store)
+        _attach_parse_errors(df, errors, guard)
+        return df
 
-    all_data = []
-    for i in trange(len(all_files), desc="Парсинг файлов", unit="файл"):
-        file = all_files[i]
-        try:
-            df = parser_func(file)
-            # Получаем относительный путь файла от root_main:
-            rel_path = os.path.relpath(file, root_main)
-            df['SOURCE_FILE'] = rel_path
-            # df['SOURCE_FILE'] = os.path.basename(file)  # если нужно имя файла
-            all_data.append(df)
-        except Exception as e:
-            print(f'Ошибка при парсинге файла {file}: {e}')
-
-    if all_data:
-        df_all = pd.concat(all_data, ignore_index=True)
-    else:
-        df_all = pd.DataFrame()
-
-    # Желаемый порядок столбцов --------------------------------------
-    desired_order = [
-        'Date', 'Company', 'Estate', 'Type', 'Category', 
-        'Partner', 'Contract', 'Document', 'Bank Account', 'Value'
-    ]
-
-    df = df_all
-    # Сначала берем те, которые есть, в нужном порядке
-    columns_in_order = [col for col in desired_order if col in df.columns]
-    # Потом добавляем остальные, которых нет в последовательности
-    other_columns = [col for col in df.columns if col not in columns_in_order]
-    # Итоговый порядок
-    final_order = columns_in_order + other_columns
-    # Переупорядочиваем DataFrame
-    df = df[final_order]
-    
+    df = _combine_report_frames(all_data, 'STATEMENT')
+    df = filter_rows_by_period_company(df, date_from, date_to, companies)
+    if store:
+        store_load(store, df, 'STATEMENT')
+    _attach_parse_errors(df, errors, guard)
     return df
 
 
-def parse_income_folder(root_main, root_income, parser_func):
+def parse_income_folder(root_main, root_income, parser_func,
+                        date_from=None, date_to=None, companies=None,
+                        max_workers=None, store=None, guard=None, shard=None,
+                        include_zip=False, backend='pandas', prefetch=0, sheets=None, transfer='auto'):
     """
     Проходит по всем .xlsx-файлам во вложенных каталогах, парсит их заданной функцией и объединяет в один DataFrame.
 
@@ -517,40 +968,63 @@ def parse_income_folder(root_main, root_income, parser_func):
         root_main   (str): Корневая папка, например '/content/gdrive/MyDrive/Волгоград'
         root_income (str): Подкаталог выручки, например 'Выручка'
         parser_func (callable): Функция-парсер одного файла (например, VLGR.excel_parser_INCOME)
+        date_from, date_to (str | datetime, optional): Границы периода по столбцу 'Date'
+        companies   (str | list, optional): Компании (сравниваются после normalize_company_name)
+            Файлы, которые по «шапке» заведомо не попадают в фильтр, не парсятся.
+        max_workers (int, optional): Число процессов для параллельного парсинга (по умолчанию — последовательно)
+        store (str, optional): Путь к файлу SQLite — результат дополнительно загружается в хранилище (store_load)
+        guard (bool | dict, optional): Защищённый режим — каждый файл в отдельном процессе с таймаутом
+            и лимитами строк/памяти (см. GUARD_DEFAULTS); отчёт об ошибках — в df.attrs['parse_errors']
+        shard (tuple, optional): (i, n) — обработать только i-ю из n частей файлов (см. shard_files)
+        include_zip (bool): Читать также .xlsx внутри .zip-архивов (без распаковки на диск);
+            SOURCE_FILE таких файлов — '<путь к архиву>/<путь внутри архива>'
+        backend (str): 'pandas' | 'polars' | 'polars-lazy' — постобработка и объединение в Polars,
+            результат pl.DataFrame / pl.LazyFrame (parser_func должен принимать backend=, как excel_parser_*)
+        prefetch (int): Сколько следующих файлов заранее читать в память фоновыми потоками
+            (для сетевых папок, например Google Drive); 0 — без предвыборки
+        sheets (str | list, optional): 'all' или список имён/масок/индексов листов — разбирать
+            эти листы каждой книги (книга загружается один раз), имя листа — в столбце SHEET.
+            Отбор файлов по шапке при этом не выполняется: фильтры применяются к строкам
+        transfer (str): Как процессы возвращают таблицы файлов: 'auto' | 'arrow' — файлами Arrow IPC
+            в общей памяти, без pickle строк; 'pickle' — сериализацией (см. _transfer_task)
 
     Возвращает:
         pd.DataFrame: Общий потоковый DataFrame по всем найденным выгрузкам
     """
 
+    _check_backend(backend)
     # Формируем абсолютный путь к каталогу с выгрузками
     base_dir = os.path.join(root_main, root_income)
 
     # Рекурсивный поиск всех .xlsx файлов во всех вложенных папках
-    all_files = glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True)
+    all_files = sorted(glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True))
+    if include_zip:
+        all_files = sorted(all_files + zip_workbooks(base_dir), key=str)
 
     print(f'Найдено файлов: {len(all_files)}')
-
-    all_data = []
+    if shard is not None:
+        all_files = shard_files(all_files, root_main, shard)
+        print(f'Шард {shard[0]} из {shard[1]}: {len(all_files)}')
+    if (date_from is not None or date_to is not None or companies) and sheets is None:
+        all_files = filter_files_by_header(all_files, 'INCOME', date_from, date_to, companies)
+        print(f'Отобрано по фильтрам: {len(all_files)}')
 
     # Проходим по всем найденным файлам с прогресс-баром
-    for i in trange(len(all_files), desc="Парсинг файлов", unit="файл"):
-        file = all_files[i]
-        try:
-            df = parser_func(file)
-            # Получаем относительный путь файла от root_main:
-            rel_path = os.path.relpath(file, root_main)
-            df['SOURCE_FILE'] = rel_path
-            # df['SOURCE_FILE'] = os.path.basename(file)  # можно добавить имя файла в итоговую таблицу
-            all_data.append(df)
-        except Exception as e:
-            print(f'Ошибка при парсинге файла {file}: {e}')
+    tasks = [(_parse_one_file, (file, root_main, parser_func, backend, sheets), file) for file in all_files]
+    errors = []
+    all_data = _run_parse_tasks(tasks, "Парсинг файлов", max_workers,
+                                guard=guard, errors=errors, prefetch=prefetch, transfer=transfer)
+    if backend != 'pandas':
+        df_all = _finish_report_polars(all_data, 'INCOME', backend, date_from, date_to, companies, store)
+        _attach_parse_errors(df_all, errors, guard)
+        return df_all
 
     # Объединяем все DataFrame в один
-    if all_data:
-        df_all = pd.concat(all_data, ignore_index=True)
-    else:
-        df_all = pd.DataFrame()
-
+    df_all = _combine_report_frames(all_data, 'INCOME')
+    df_all = filter_rows_by_period_company(df_all, date_from, date_to, companies)
+    if store:
+        store_load(store, df_all, 'INCOME')
+    _attach_parse_errors(df_all, errors, guard)
     return df_all
 
 
@@ -666,9 +1140,34 @@ import pandas as pd
 from openpyxl import load_workbook
 from tqdm import trange
 
-def excel_parser_SUPPLIERS(file_path: str, debug: bool=False) -> pd.DataFrame:
+def _suppliers_frame(out):
+    """Постобработка записей excel_parser_SUPPLIERS (pandas): очистка Company/Счет, порядок столбцов."""
+    if not out:
+        return pd.DataFrame(columns=['Date','Company','Doc','AnDT','AnCR','DtCr','Счет','Value'])
+
+    def _clean_text(x):
+        if x is None or (isinstance(x, float) and pd.isna(x)):
+            return None
+        s = re.sub(r'\s+', ' ', str(x)).strip()
+        return s if s else None
+
+    df = pd.DataFrame(out)
+
+    # финальная очистка только строковых полей
+    for col in ['Company','Счет']:
+        if col in df.columns:
+            df[col] = df[col].apply(_clean_text)
+
+    # порядок столбцов
+    return df[['Date','Company','Doc','AnDT','AnCR','DtCr','Счет','Value']]
+
+def excel_parser_SUPPLIERS(file_path, debug: bool=False, backend: str='pandas', sheets=None) -> pd.DataFrame:
     """
     Парсер 'Поставщики услуг' с корректным разделением Счет/Value и разбиением Doc/AnDT/AnCR на списки.
+    file_path — путь к файлу, bytes или file-like объект.
+    backend — 'pandas' (по умолчанию) или 'polars' (результат pl.DataFrame).
+    sheets — None (активный лист) | 'all' | список имён/масок/индексов листов: книга загружается
+    один раз, каждый лист разбирается отдельно, имя листа — в столбце SHEET.
 
     Логика колонок:
       • Определяем по шапке блоки 'Дебет/Дт' и 'Кредит/Кт'. Под каждым ищем подзаголовок 'Счет'.
@@ -739,12 +1238,6 @@ def excel_parser_SUPPLIERS(file_path: str, debug: bool=False) -> pd.DataFrame:
         parts = [p for p in parts if p and p != '<...>']
         return parts
 
-    def _clean_text(x):
-        if x is None or (isinstance(x, float) and pd.isna(x)):
-            return None
-        s = re.sub(r'\s+', ' ', str(x)).strip()
-        return s if s else None
-
     # --------- поиски в листе (компания, старт, шапка) ----------
     def _find_company(ws):
         for r in range(1, min(ws.max_row, 4)+1):
@@ -800,8 +1293,9 @@ def excel_parser_SUPPLIERS(file_path: str, debug: bool=False) -> pd.DataFrame:
         return dt_acc_col, dt_acc_col + 1, cr_acc_col, cr_acc_col + 1
 
     # ----------------- основная логика -----------------
-    wb = load_workbook(file_path, data_only=True)
-    ws = wb.active
+    if sheets is not None:
+        return _parse_workbook_sheets(excel_parser_SUPPLIERS, file_path, sheets, debug=debug, backend=backend)
+    ws = _worksheet_of(file_path)
 
     company   = _find_company(ws)
     start_row = _find_start_row(ws)
@@ -891,52 +1385,73 @@ def excel_parser_SUPPLIERS(file_path: str, debug: bool=False) -> pd.DataFrame:
                 'Value'  : cr_val
             })
 
-    if not out:
-        return pd.DataFrame(columns=['Date','Company','Doc','AnDT','AnCR','DtCr','Счет','Value'])
-
-    df = pd.DataFrame(out)
-
-    # финальная очистка только строковых полей
-    for col in ['Company','Счет']:
-        if col in df.columns:
-            df[col] = df[col].apply(_clean_text)
-
-    # порядок столбцов
-    return df[['Date','Company','Doc','AnDT','AnCR','DtCr','Счет','Value']]
+    if backend != 'pandas':
+        return _suppliers_polars(out)
+    return _suppliers_frame(out)
 
 
 def parse_suppliers_folder(root_main: str,
                            root_suppliers: str = 'Поставщики услуг',
-                           parser_func = None) -> pd.DataFrame:
+                           parser_func = None,
+                           date_from=None,
+                           date_to=None,
+                           companies=None,
+                           max_workers=None,
+                           store=None,
+                           guard=None,
+                           shard=None,
+                           include_zip=False,
+                           backend='pandas',
+                           prefetch=0,
+                           sheets=None,
+                           transfer='auto') -> pd.DataFrame:
     """
     Рекурсивно парсит все .xlsx из подкаталога 'Поставщики услуг' и объединяет.
+    date_from / date_to / companies — фильтры по периоду и компании: файлы, которые
+    по «шапке» заведомо не попадают в фильтр, не парсятся.
+    max_workers — число процессов для параллельного парсинга (по умолчанию — последовательно).
+    store — путь к файлу SQLite: результат дополнительно загружается в хранилище (store_load).
+    guard — защищённый режим: каждый файл в отдельном процессе с таймаутом и лимитами
+    строк/памяти (см. GUARD_DEFAULTS); отчёт об ошибках — в out.attrs['parse_errors'].
+    shard — (i, n): обработать только i-ю из n частей файлов (см. shard_files).
+    include_zip — читать также .xlsx внутри .zip-архивов (без распаковки на диск).
+    backend — 'pandas' | 'polars' | 'polars-lazy': результат pl.DataFrame / pl.LazyFrame.
+    prefetch — сколько следующих файлов заранее читать в память (сетевые папки); 0 — без предвыборки.
+    sheets — 'all' | список имён/масок/индексов листов: разбирать эти листы каждой книги, столбец SHEET.
+    transfer — 'auto' | 'arrow' | 'pickle': как процессы возвращают таблицы файлов (см. _transfer_task).
     Возвращает: Date, Company, Doc(list), AnDT(list), AnCR(list), DtCr, Счет, Value, SOURCE_FILE
     """
+    _check_backend(backend)
     if parser_func is None:
         parser_func = excel_parser_SUPPLIERS
 
     base_dir = os.path.join(root_main, root_suppliers)
-    files = glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True)
+    files = sorted(glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True))
+    if include_zip:
+        files = sorted(files + zip_workbooks(base_dir), key=str)
     print(f'Найдено файлов: {len(files)}')
+    if shard is not None:
+        files = shard_files(files, root_main, shard)
+        print(f'Шард {shard[0]} из {shard[1]}: {len(files)}')
+    if (date_from is not None or date_to is not None or companies) and sheets is None:
+        files = filter_files_by_header(files, 'SUPPLIERS', date_from, date_to, companies)
+        print(f'Отобрано по фильтрам: {len(files)}')
 
-    frames = []
-    for i in trange(len(files), desc="Поставщики услуг: парсинг", unit="файл"):
-        f = files[i]
-        try:
-            df = parser_func(f)
-            df['SOURCE_FILE'] = os.path.relpath(f, root_main)
-            frames.append(df)
-        except Exception as e:
-            print(f'Ошибка {f}: {e}')
-
-    if not frames:
-        return pd.DataFrame(columns=['Date','Company','Doc','AnDT','AnCR','DtCr','Счет','Value','SOURCE_FILE'])
+    tasks = [(_parse_one_file, (f, root_main, parser_func, backend, sheets), f) for f in files]
+    errors = []
+    frames = _run_parse_tasks(tasks, "Поставщики услуг: парсинг", max_workers,
+                              guard=guard, errors=errors, prefetch=prefetch, transfer=transfer)
+    if backend != 'pandas':
+        out = _finish_report_polars(frames, 'SUPPLIERS', backend, date_from, date_to, companies, store)
+        _attach_parse_errors(out, errors, guard)
+        return out
 
-    out = pd.concat(frames, ignore_index=True)
-    # финальная раскладка
-    desired = ['Date','Company','Doc','AnDT','AnCR','DtCr','Счет','Value','SOURCE_FILE']
-    other = [c for c in out.columns if c not in desired]
-    return out[desired + other]
+    out = _combine_report_frames(frames, 'SUPPLIERS')
+    out = filter_rows_by_period_company(out, date_from, date_to, companies)
+    if store:
+        store_load(store, out, 'SUPPLIERS')
+    _attach_parse_errors(out, errors, guard)
+    return out
 
 
 
@@ -955,15 +1470,62 @@ def parse_suppliers_folder(root_main: str,
 import re
 import pandas as pd
 
-def enrich_suppliers_semantics(
-    df_suppliers: pd.DataFrame,
+def _enrich_norm(s: str | None) -> str:
+    if s is None: return ""
+    s = str(s).lower()
+    s = s.replace("\xa0", " ")
+    s = re.sub(r"[\t\r\n]+", " ", s)
+    s = re.sub(r"[\"'`«»“”„]", "", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+def load_enrich_terms(
     root_estate_dictionary: str,
     category_source_df: pd.DataFrame,
     category_source_col: str = "Category",
-    debug: bool = False,
-    show_progress: bool = True,
-    progress_each: int = 500,
-    normalize_company_fn=None
+    debug: bool = False
+) -> dict:
+    """
+    Справочники для enrich_suppliers_semantics: {'estate': [...], 'category': [...]}.
+    Загружаются один раз и передаются в enrich_suppliers_semantics(terms=...) — например,
+    при обогащении по файлам, чтобы не перечитывать словарь объектов на каждом файле.
+    """
+    norm = _enrich_norm
+
+    # Estate — из словаря объектов
+    try:
+        dict_df = pd.read_excel(root_estate_dictionary)
+        cols = {c.lower(): c for c in dict_df.columns}
+        col_src = next((cols[k] for k in cols if "исходное" in k and "наимен" in k), None)
+        col_std = next((cols[k] for k in cols if "наимен" in k and "объект"  in k), None)
+        estate_terms = []
+        if col_src: estate_terms += [norm(x) for x in dict_df[col_src].dropna().astype(str)]
+        if col_std: estate_terms += [norm(x) for x in dict_df[col_std].dropna().astype(str)]
+        estate_terms = sorted(set([x for x in estate_terms if x]))
+    except Exception as e:
+        if debug: print(f"[enrich] Не удалось прочитать словарь объектов: {e}")
+        estate_terms = []
+
+    # Category — ИЗ ДРУГОЙ ТАБЛИЦЫ (общая база)
+    if category_source_df is not None and category_source_col in category_source_df.columns:
+        category_terms = sorted(set([norm(x) for x in category_source_df[category_source_col].dropna().astype(str) if norm(x)]))
+    else:
+        category_terms = []
+        if debug: print(f"[enrich] В category_source_df нет столбца '{category_source_col}'")
+
+    return {'estate': estate_terms, 'category': category_terms}
+
+def enrich_suppliers_semantics(
+    df_suppliers: pd.DataFrame,
+    root_estate_dictionary: str = None,
+    category_source_df: pd.DataFrame = None,
+    category_source_col: str = "Category",
+    debug: bool = False,
+    show_progress: bool = True,
+    progress_each: int = 500,
+    normalize_company_fn=None,
+    terms: dict = None,
+    copy: bool = True
 ) -> pd.DataFrame:
     """
     Пост-обработка результатов VLGR.parse_suppliers_folder.
@@ -977,6 +1539,9 @@ def enrich_suppliers_semantics(
            - AnDT -> Related Company
            - 'Переуступка долга...' из Doc -> Category
            - 'Корректировка долга...' из Doc -> Document
+
+    terms — готовые справочники из load_enrich_terms (тогда root_estate_dictionary /
+    category_source_df не читаются); copy=False — обогащать df_suppliers на месте, без копии.
     """
 
     # -------- прогресс: инициализация --------
@@ -995,17 +1560,10 @@ def enrich_suppliers_semantics(
         except Exception:
             normalize_company_fn = (lambda x: x)
 
-    df = df_suppliers.copy()
+    df = df_suppliers.copy() if copy else df_suppliers
 
     # ---------- утилиты ----------
-    def norm(s: str | None) -> str:
-        if s is None: return ""
-        s = str(s).lower()
-        s = s.replace("\xa0", " ")
-        s = re.sub(r"[\t\r\n]+", " ", s)
-        s = re.sub(r"[\"'`«»“”„]", "", s)
-        s = re.sub(r"\s+", " ", s).strip()
-        return s
+    norm = _enrich_norm
 
     def split_list_cell(v) -> list[str]:
         if v is None: return []
@@ -1048,26 +1606,10 @@ def enrich_suppliers_semantics(
         return any(s2.startswith(norm(p)) for p in prefixes)
 
     # ---------- справочники ----------
-    # Estate — из словаря объектов
-    try:
-        dict_df = pd.read_excel(root_estate_dictionary)
-        cols = {c.lower(): c for c in dict_df.columns}
-        col_src = next((cols[k] for k in cols if "исходное" in k and "наимен" in k), None)
-        col_std = next((cols[k] for k in cols if "наимен" in k and "объект"  in k), None)
-        estate_terms = []
-        if col_src: estate_terms += [norm(x) for x in dict_df[col_src].dropna().astype(str)]
-        if col_std: estate_terms += [norm(x) for x in dict_df[col_std].dropna().astype(str)]
-        estate_terms = sorted(set([x for x in estate_terms if x]))
-    except Exception as e:
-        if debug: print(f"[enrich] Не удалось прочитать словарь объектов: {e}")
-        estate_terms = []
-
-    # Category — ИЗ ДРУГОЙ ТАБЛИЦЫ (общая база)
-    if category_source_col in category_source_df.columns:
-        category_terms = sorted(set([norm(x) for x in category_source_df[category_source_col].dropna().astype(str) if norm(x)]))
-    else:
-        category_terms = []
-        if debug: print(f"[enrich] В category_source_df нет столбца '{category_source_col}'")
+    if terms is None:
+        terms = load_enrich_terms(root_estate_dictionary, category_source_df, category_source_col, debug)
+    estate_terms = terms['estate']
+    category_terms = terms['category']
 
     contract_terms = [norm("договор"), norm("дог.")]
     document_terms = [norm(x) for x in ["Поступление","Акт","Накладная","УПД","Списание"]]
@@ -1240,3 +1782,4733 @@ def enrich_suppliers_semantics(
 
     return df
 
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import pandas as pd
+
+# ----------------- Единый проход по дереву: определение типа отчёта и парсинг -----------------
+
+REPORT_TYPES = ('STATEMENT', 'INCOME', 'SUPPLIERS')
+
+def _classify_header_grid(grid):
+    """
+    Определяет тип отчёта по «подписи» шапки (первые строки листа):
+      • STATEMENT — ОСВ: в шапке есть 'Обороты за период' и 'Сальдо на конец периода';
+      • SUPPLIERS — карточка счёта: под 'Дебет/Дт' или 'Кредит/Кт' стоит подзаголовок 'Счет';
+      • INCOME    — анализ выручки: в столбце B есть заголовок 'Наименование', в B3 — период.
+    Возвращает 'STATEMENT' | 'INCOME' | 'SUPPLIERS' | None.
+    """
+    head = grid[:8]
+    texts = [[str(v).strip().lower() if v is not None else '' for v in row] for row in head]
+    flat = [t for row in texts for t in row if t]
+
+    if any(t.startswith('обороты за период') for t in flat) and any(t.startswith('сальдо на конец') for t in flat):
+        return 'STATEMENT'
+
+    for r in range(len(texts) - 1):
+        for c, t in enumerate(texts[r]):
+            if t and re.search(r'\b(дебет|дт|кредит|кт)\b', t) and 'счет' in texts[r + 1][c]:
+                return 'SUPPLIERS'
+
+    col_b = [str(row[1]) for row in grid if len(row) > 1 and row[1] is not None]
+    if any('Наименование' in v for v in col_b) and _header_period(grid[2][1])[1] is not None:
+        return 'INCOME'
+
+    return None
+
+def detect_report_type(file_path):
+    """
+    Определяет тип отчёта ('STATEMENT' | 'INCOME' | 'SUPPLIERS') по шапке файла без полного парсинга.
+    Возвращает None, если файл не похож ни на один из отчётов.
+    """
+    return _classify_header_grid(_read_header_grid(file_path))
+
+def _ingest_one_file(file, root_main, parsers, date_from=None, date_to=None, companies=None, sheets=None):
+    """
+    Задача пула для ingest_folder: одна загрузка шапки на файл — и определение типа,
+    и проверка фильтров; затем полный парсинг нужным парсером.
+    Возвращает (report_type, df); df = None, если файл не распознан или отсечён фильтром.
+    """
+    grid = _read_header_grid(file)
+    report_type = _classify_header_grid(grid)
+    if report_type is None:
+        return None, None
+
+    filters = _normalize_filters(date_from, date_to, companies)
+    if any(x is not None for x in filters) and sheets is None:
+        if not _header_may_match(_header_meta_from_grid(grid, report_type), *filters):
+            return report_type, None
+
+    return report_type, _parse_one_file(file, root_main, parsers[report_type], sheets=sheets)
+
+def ingest_folder(root_main, subfolder=None, parsers=None,
+                  date_from=None, date_to=None, companies=None,
+                  max_workers=None, executor='process', store=None, guard=None, shard=None,
+                  include_zip=False, prefetch=0, sheets=None, transfer='auto'):
+    """
+    Один рекурсивный обход дерева выгрузок: каждый .xlsx классифицируется по шапке
+    (STATEMENT / INCOME / SUPPLIERS) и отправляется в нужный парсер в общем пуле.
+    Заменяет раздельные вызовы parse_statement_folder / parse_income_folder / parse_suppliers_folder.
+
+    Аргументы:
+        root_main  (str): Корневая папка, например '/content/gdrive/MyDrive/Волгоград'
+        subfolder  (str, optional): Обходить только этот подкаталог root_main
+        parsers   (dict, optional): Замена парсеров по типу, например {'SUPPLIERS': my_parser}
+        date_from, date_to, companies: Фильтры, как в parse_*_folder
+        max_workers (int, optional): Размер пула (по умолчанию — последовательно)
+        executor   (str): 'process' | 'thread'
+        store      (str, optional): Путь к файлу SQLite — таблицы дополнительно загружаются в хранилище
+        guard (bool | dict, optional): Защищённый режим, как в parse_*_folder; отчёт об ошибках —
+                   в attrs['parse_errors'] каждой таблицы
+        shard (tuple, optional): (i, n) — обработать только i-ю из n частей файлов (см. shard_files)
+        include_zip (bool): Читать также .xlsx внутри .zip-архивов (без распаковки на диск);
+            SOURCE_FILE таких файлов — '<путь к архиву>/<путь внутри архива>'
+        prefetch (int): Сколько следующих файлов заранее читать в память фоновыми потоками
+            (для сетевых папок); файл читается один раз — и для определения типа, и для парсинга
+        sheets (str | list, optional): Разбирать эти листы каждой книги ('all' | имена/маски/индексы);
+            тип отчёта определяется по шапке активного листа, фильтры применяются к строкам
+        transfer (str): 'auto' | 'arrow' | 'pickle' — как процессы пула возвращают таблицы файлов
+            (см. _transfer_task); при executor='thread' не используется
+
+    Возвращает:
+        dict: {'STATEMENT': DataFrame, 'INCOME': DataFrame, 'SUPPLIERS': DataFrame}
+              — те же таблицы, что дают соответствующие parse_*_folder.
+    """
+    all_parsers = {
+        'STATEMENT': excel_parser_STATEMENT,
+        'INCOME': excel_parser_INCOME,
+        'SUPPLIERS': excel_parser_SUPPLIERS,
+    }
+    all_parsers.update(parsers or {})
+
+    base_dir = os.path.join(root_main, subfolder) if subfolder else root_main
+    files = sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(base_dir)
+        for name in names
+        if name.lower().endswith('.xlsx') and not name.startswith('~$')
+    )
+    if include_zip:
+        files = sorted(files + zip_workbooks(base_dir), key=str)
+    print(f'Найдено файлов: {len(files)}')
+    if shard is not None:
+        files = shard_files(files, root_main, shard)
+        print(f'Шард {shard[0]} из {shard[1]}: {len(files)}')
+
+    tasks = [
+        (_ingest_one_file, (f, root_main, all_parsers, date_from, date_to, companies, sheets), f)
+        for f in files
+    ]
+    errors = []
+    results = _run_parse_tasks(tasks, "Парсинг отчётов", max_workers, executor,
+                               guard=guard, errors=errors, prefetch=prefetch, transfer=transfer)
+
+    frames = {report_type: [] for report_type in REPORT_TYPES}
+    unknown = []
+    for file, res in zip(files, results):
+        if res is None:
+            continue
+        report_type, df = res
+        if report_type is None:
+            unknown.append(_source_file_name(file, root_main))
+        elif df is not None:
+            frames[report_type].append(df)
+
+    print('Разобрано файлов: ' + ', '.join(f'{t}={len(frames[t])}' for t in REPORT_TYPES))
+    if unknown:
+        print(f'Не удалось определить тип отчёта ({len(unknown)}): {unknown[:10]}')
+
+    tables = {
+        report_type: filter_rows_by_period_company(
+            _combine_report_frames(frames[report_type], report_type), date_from, date_to, companies)
+        for report_type in REPORT_TYPES
+    }
+    if store:
+        store_load(store, tables)
+    for df in tables.values():
+        _attach_parse_errors(df, errors)
+    _write_parse_report(errors, guard)
+    return tables
+
+# Пример вызова:
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', max_workers=4)
+# df_statement, df_income, df_suppliers = tables['STATEMENT'], tables['INCOME'], tables['SUPPLIERS']
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import json
+import hashlib
+import datetime as _dt
+from urllib.parse import quote, unquote
+import pandas as pd
+
+# ----------------- Parquet-датасет: запись по партициям (месяц Date × Company) и чтение -----------------
+# Структура:
+#   <root>/<REPORT_TYPE>/month=2025-02/company=<ООО "Ромашка" в URL-кодировке>/part-<hash SOURCE_FILE>.parquet
+#   <root>/<REPORT_TYPE>/_manifest.json — какие part-файлы записаны из каждого SOURCE_FILE.
+# Повторная запись того же SOURCE_FILE заменяет его части целиком (идемпотентно).
+
+_DATASET_NULL_PARTITION = '__NULL__'
+_DATASET_ROW_COLUMN = '_ROW'  # порядковый номер строки внутри SOURCE_FILE — для восстановления исходного порядка
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError('Для работы с Parquet нужен pyarrow: pip install pyarrow')
+
+def _source_key(source_file):
+    return hashlib.sha1(str(source_file).encode('utf-8')).hexdigest()[:16]
+
+def _is_list_column(series):
+    sample = series.dropna()
+    return len(sample) > 0 and isinstance(sample.iloc[0], (list, tuple, np.ndarray))
+
+def _df_to_arrow(df):
+    """
+    pandas -> Arrow с предсказуемыми типами (одинаковыми во всех part-файлах):
+    списки (Doc/AnDT/AnCR) -> list<string>, 'Date' -> timestamp / date32,
+    числа -> float64/int64, всё остальное -> string.
+    """
+    import pyarrow as pa
+
+    arrays, names = [], []
+    for col in df.columns:
+        s = df[col]
+        if _is_list_column(s):
+            values = [None if not isinstance(v, (list, tuple, np.ndarray)) else [None if x is None else str(x) for x in v]
+                      for v in s]
+            arr = pa.array(values, type=pa.list_(pa.string()))
+        elif pd.api.types.is_datetime64_any_dtype(s):
+            arr = pa.array(s.astype('datetime64[ns]'), type=pa.timestamp('ns'))
+        elif col == 'Date':
+            dates = pd.to_datetime(s, errors='coerce')
+            arr = pa.array([None if pd.isna(d) else d.date() for d in dates], type=pa.date32())
+        elif pd.api.types.is_bool_dtype(s):
+            arr = pa.array(s, type=pa.bool_())
+        elif pd.api.types.is_integer_dtype(s):
+            arr = pa.array(s, type=pa.int64())
+        elif pd.api.types.is_float_dtype(s):
+            arr = pa.array(s, type=pa.float64())
+        else:
+            arr = pa.array([None if (v is None or (isinstance(v, float) and pd.isna(v))) else str(v) for v in s],
+                           type=pa.string())
+        arrays.append(arr)
+        names.append(str(col))
+    return pa.Table.from_arrays(arrays, names=names)
+
+def _arrow_to_df(table):
+    """Arrow -> pandas; столбцы-списки возвращаются как обычные списки Python (как у парсеров)."""
+    import pyarrow as pa
+
+    df = table.to_pandas()
+    for field in table.schema:
+        if pa.types.is_list(field.type):
+            df[field.name] = [list(v) if v is not None else [] for v in df[field.name]]
+    return df
+
+def _partition_values(df):
+    """Значения партиций (month, company) для каждой строки."""
+    dates = pd.to_datetime(df['Date'], errors='coerce') if 'Date' in df.columns else pd.Series(pd.NaT, index=df.index)
+    month = dates.dt.strftime('%Y-%m').fillna(_DATASET_NULL_PARTITION)
+    if 'Company' in df.columns:
+        company = df['Company'].astype(object).where(df['Company'].notna(), _DATASET_NULL_PARTITION).astype(str)
+    else:
+        company = pd.Series(_DATASET_NULL_PARTITION, index=df.index)
+    return month, company
+
+def _load_manifest(type_root):
+    path = os.path.join(type_root, '_manifest.json')
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def _save_manifest(type_root, manifest):
+    path = os.path.join(type_root, '_manifest.json')
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+def delete_from_dataset(root, report_type, source_files):
+    """
+    Удаляет из Parquet-датасета все части, записанные из указанных SOURCE_FILE.
+    Возвращает число удалённых part-файлов.
+    """
+    type_root = os.path.join(root, report_type)
+    manifest = _load_manifest(type_root)
+    removed = 0
+    for source in source_files:
+        for rel in manifest.pop(source, []):
+            path = os.path.join(type_root, rel)
+            if os.path.exists(path):
+                os.remove(path)
+                removed += 1
+    if os.path.isdir(type_root):
+        _save_manifest(type_root, manifest)
+    return removed
+
+def write_dataset(tables, root, report_type=None, compression='snappy'):
+    """
+    Сохраняет объединённые таблицы в Parquet-датасет с партициями по месяцу Date и Company.
+
+    Аргументы:
+        tables (dict | pd.DataFrame): {'STATEMENT': df, 'INCOME': df, 'SUPPLIERS': df} (результат ingest_folder)
+                                      или один DataFrame (тогда нужен report_type)
+        root (str): Корневая папка датасета
+        report_type (str, optional): Тип отчёта для одиночного DataFrame
+        compression (str): Сжатие Parquet
+
+    Семантика дозаписи: для каждого SOURCE_FILE из новых данных старые части удаляются
+    и записываются новые; остальные источники в датасете не затрагиваются.
+    Возвращает dict {report_type: число записанных part-файлов}.
+    """
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    if isinstance(tables, pd.DataFrame):
+        if report_type is None:
+            raise ValueError('Для одиночного DataFrame нужно указать report_type')
+        tables = {report_type: tables}
+
+    written = {}
+    for rtype, df in tables.items():
+        written[rtype] = 0
+        if df is None or df.empty:
+            continue
+        if 'SOURCE_FILE' not in df.columns:
+            raise ValueError(f'{rtype}: нет столбца SOURCE_FILE — замена по источникам невозможна')
+
+        type_root = os.path.join(root, rtype)
+        os.makedirs(type_root, exist_ok=True)
+        sources = df['SOURCE_FILE'].dropna().unique().tolist()
+        delete_from_dataset(root, rtype, sources)
+        manifest = _load_manifest(type_root)
+
+        df = df.assign(**{_DATASET_ROW_COLUMN: df.groupby('SOURCE_FILE', sort=False).cumcount().to_numpy()})
+        month, company = _partition_values(df)
+        keys = pd.DataFrame({'src': df['SOURCE_FILE'].to_numpy(), 'month': month.to_numpy(), 'company': company.to_numpy()})
+        for (src, m, c), idx in keys.groupby(['src', 'month', 'company'], sort=False).indices.items():
+            rel = os.path.join(f'month={m}', f'company={quote(c, safe="")}', f'part-{_source_key(src)}.parquet')
+            path = os.path.join(type_root, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            table = _df_to_arrow(df.iloc[idx])
+            pq.write_table(table, path + '.tmp', compression=compression)
+            os.replace(path + '.tmp', path)
+            manifest.setdefault(src, []).append(rel)
+            written[rtype] += 1
+
+        _save_manifest(type_root, manifest)
+    return written
+
+def _select_partition_files(type_root, date_from=None, date_to=None, companies=None):
+    """Отбор part-файлов по именам каталогов партиций — без чтения данных."""
+    date_from, date_to, companies = _normalize_filters(date_from, date_to, companies)
+    m_from = date_from.strftime('%Y-%m') if date_from is not None else None
+    m_to = date_to.strftime('%Y-%m') if date_to is not None else None
+
+    files = []
+    if not os.path.isdir(type_root):
+        return files
+    for month_dir in sorted(os.listdir(type_root)):
+        if not month_dir.startswith('month='):
+            continue
+        m = month_dir[len('month='):]
+        if m != _DATASET_NULL_PARTITION:
+            if (m_from and m < m_from) or (m_to and m > m_to):
+                continue
+        for company_dir in sorted(os.listdir(os.path.join(type_root, month_dir))):
+            c = unquote(company_dir[len('company='):])
+            if companies and c != _DATASET_NULL_PARTITION:
+                if (normalize_company_names(c) or '').upper() not in companies:
+                    continue
+            part_dir = os.path.join(type_root, month_dir, company_dir)
+            files += [os.path.join(part_dir, f) for f in sorted(os.listdir(part_dir)) if f.endswith('.parquet')]
+    return files
+
+def read_dataset(root, report_type, date_from=None, date_to=None, companies=None, columns=None):
+    """
+    Читает таблицу отчёта из Parquet-датасета, загружая только нужные партиции и столбцы.
+
+    Аргументы:
+        root (str): Корневая папка датасета (см. write_dataset)
+        report_type (str): 'STATEMENT' | 'INCOME' | 'SUPPLIERS'
+        date_from, date_to, companies: Фильтры, как в parse_*_folder (партиции отсекаются по месяцу и компании)
+        columns (list, optional): Какие столбцы читать (по умолчанию — все)
+
+    Возвращает:
+        pd.DataFrame
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    files = _select_partition_files(os.path.join(root, report_type), date_from, date_to, companies)
+    if not files:
+        schema = REPORT_SCHEMAS.get(report_type, {})
+        cols = columns or list(schema)
+        return pd.DataFrame({c: pd.Series([], dtype=schema.get(c, 'object')) for c in cols})
+
+    schema = pa.unify_schemas([pq.read_schema(f) for f in files])
+    dataset = ds.dataset(files, schema=schema, format='parquet')
+
+    read_cols = None
+    if columns is not None:
+        read_cols = list(columns)
+        for c in ('Date', 'Company', 'SOURCE_FILE', _DATASET_ROW_COLUMN):
+            if c in schema.names and c not in read_cols:
+                read_cols.append(c)
+    df = _arrow_to_df(dataset.to_table(columns=read_cols))
+
+    # Исходный порядок строк: по источнику, внутри источника — как в файле
+    if _DATASET_ROW_COLUMN in df.columns:
+        df = (df.sort_values(['SOURCE_FILE', _DATASET_ROW_COLUMN], kind='stable')
+                .drop(columns=_DATASET_ROW_COLUMN)
+                .reset_index(drop=True))
+
+    # Партиции — с точностью до месяца; точный фильтр по строкам
+    df = filter_rows_by_period_company(df, date_from, date_to, companies)
+    if columns is not None:
+        df = df[list(columns)]
+    return df
+
+# Пример вызова:
+# write_dataset(ingest_folder('/content/gdrive/MyDrive/Волгоград'), '/content/gdrive/MyDrive/Волгоград/_dataset')
+# df = read_dataset('/content/gdrive/MyDrive/Волгоград/_dataset', 'STATEMENT', date_from='2025-01-01', columns=['Date', 'Company', 'Value'])
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import json
+import sqlite3
+import pandas as pd
+
+# ----------------- Локальное хранилище SQLite (один файл, без сервера) -----------------
+# Таблица на каждый тип отчёта (STATEMENT / INCOME / SUPPLIERS), индексы по Company, Estate,
+# Счет, Date и SOURCE_FILE. Повторная загрузка заменяет строки того же SOURCE_FILE.
+# Даты хранятся текстом ISO ('2025-02-01'), списки (Doc/AnDT/AnCR) — JSON-строкой.
+
+STORE_INDEX_COLUMNS = ('Company', 'Estate', 'Счет', 'Date', 'SOURCE_FILE')
+
+def _q(name):
+    """Экранирование имени столбца/таблицы для SQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _store_connect(db_path):
+    con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('CREATE TABLE IF NOT EXISTS "_columns" (report_type TEXT, name TEXT, kind TEXT, '
+                'PRIMARY KEY (report_type, name))')
+    return con
+
+def _store_column_kind(series, name):
+    if _is_list_column(series):
+        return 'list'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    if name == 'Date':
+        return 'date'
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return 'real'
+    return 'text'
+
+def _store_encode(series, kind):
+    if kind == 'list':
+        return [None if not isinstance(v, (list, tuple, np.ndarray)) else json.dumps([str(x) for x in v], ensure_ascii=False)
+                for v in series]
+    if kind in ('datetime', 'date'):
+        dates = pd.to_datetime(series, errors='coerce')
+        return [None if pd.isna(d) else d.strftime('%Y-%m-%d') for d in dates]
+    if kind == 'real':
+        return [None if pd.isna(v) else float(v) for v in series]
+    return [None if (v is None or (isinstance(v, float) and pd.isna(v))) else str(v) for v in series]
+
+def _store_decode(df, kinds):
+    for col, kind in kinds.items():
+        if col not in df.columns:
+            continue
+        if kind == 'list':
+            df[col] = [json.loads(v) if v is not None else [] for v in df[col]]
+        elif kind == 'datetime':
+            df[col] = pd.to_datetime(df[col]).astype('datetime64[ns]')
+        elif kind == 'date':
+            df[col] = [None if pd.isna(d) else d.date() for d in pd.to_datetime(df[col])]
+        elif kind == 'real':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return df
+
+def _store_kinds(con, report_type):
+    rows = con.execute('SELECT name, kind FROM "_columns" WHERE report_type = ?', (report_type,)).fetchall()
+    return dict(rows)
+
+def store_load(db_path, tables, report_type=None):
+    """
+    Загружает объединённые таблицы в локальное хранилище SQLite.
+
+    Аргументы:
+        db_path (str): Путь к файлу базы, например '/content/gdrive/MyDrive/Волгоград/ledger.sqlite'
+        tables (dict | pd.DataFrame): {'STATEMENT': df, ...} (результат ingest_folder) или один DataFrame
+        report_type (str, optional): Тип отчёта для одиночного DataFrame
+
+    Строки с теми же SOURCE_FILE, что и в новых данных, заменяются целиком (upsert по источнику).
+    Возвращает dict {report_type: число загруженных строк}.
+    """
+    if isinstance(tables, pd.DataFrame):
+        if report_type is None:
+            raise ValueError('Для одиночного DataFrame нужно указать report_type')
+        tables = {report_type: tables}
+
+    loaded = {}
+    con = _store_connect(db_path)
+    try:
+        for rtype, df in tables.items():
+            loaded[rtype] = 0
+            if df is None or df.empty:
+                continue
+            if 'SOURCE_FILE' not in df.columns:
+                raise ValueError(f'{rtype}: нет столбца SOURCE_FILE — замена по источникам невозможна')
+
+            kinds = _store_kinds(con, rtype)
+            new_kinds = {str(c): _store_column_kind(df[c], str(c)) for c in df.columns}
+            sql_types = {'real': 'REAL'}
+
+            with con:
+                if not kinds:
+                    cols_sql = ', '.join(f'{_q(c)} {sql_types.get(k, "TEXT")}' for c, k in new_kinds.items())
+                    con.execute(f'CREATE TABLE IF NOT EXISTS {_q(rtype)} ({cols_sql})')
+                    for c in STORE_INDEX_COLUMNS:
+                        if c in new_kinds:
+                            con.execute(f'CREATE INDEX IF NOT EXISTS {_q(f"ix_{rtype}_{c}")} ON {_q(rtype)} ({_q(c)})')
+                else:
+                    for c, k in new_kinds.items():
+                        if c not in kinds:
+                            con.execute(f'ALTER TABLE {_q(rtype)} ADD COLUMN {_q(c)} {sql_types.get(k, "TEXT")}')
+                con.executemany('INSERT OR IGNORE INTO "_columns" VALUES (?, ?, ?)',
+                                [(rtype, c, k) for c, k in new_kinds.items()])
+
+                sources = df['SOURCE_FILE'].dropna().unique().tolist()
+                con.executemany(f'DELETE FROM {_q(rtype)} WHERE "SOURCE_FILE" = ?', [(s,) for s in sources])
+
+                columns = list(new_kinds)
+                encoded = [_store_encode(df[c], new_kinds[str(c)]) for c in df.columns]
+                placeholders = ', '.join('?' for _ in columns)
+                con.executemany(
+                    f'INSERT INTO {_q(rtype)} ({", ".join(_q(c) for c in columns)}) VALUES ({placeholders})',
+                    zip(*encoded)
+                )
+            loaded[rtype] = len(df)
+    finally:
+        con.close()
+    return loaded
+
+def store_query(db_path, report_type, date_from=None, date_to=None, companies=None,
+                estates=None, accounts=None, columns=None, where=None, params=()):
+    """
+    Выборка из хранилища по индексированным столбцам; возвращает DataFrame.
+
+    Аргументы:
+        db_path (str): Путь к файлу базы (см. store_load)
+        report_type (str): 'STATEMENT' | 'INCOME' | 'SUPPLIERS'
+        date_from, date_to: Границы по Date
+        companies (str | list): Компании (сравниваются после normalize_company_name)
+        estates, accounts (str | list): Точные значения Estate / Счет
+        columns (list, optional): Какие столбцы вернуть
+        where (str, optional): Дополнительное SQL-условие, например '"Value" > ?'; params — его параметры
+    """
+    con = _store_connect(db_path)
+    try:
+        kinds = _store_kinds(con, report_type)
+        if not kinds:
+            return pd.DataFrame(columns=columns or list(REPORT_SCHEMAS.get(report_type, {})))
+
+        conds, args = [], []
+        date_from, date_to, companies = _normalize_filters(date_from, date_to, companies)
+        if date_from is not None:
+            conds.append('"Date" >= ?'); args.append(date_from.strftime('%Y-%m-%d'))
+        if date_to is not None:
+            conds.append('"Date" <= ?'); args.append(date_to.strftime('%Y-%m-%d'))
+        if companies:
+            # Нормализация в Python по списку различных компаний (индексный просмотр), затем IN (...)
+            distinct = [r[0] for r in con.execute(f'SELECT DISTINCT "Company" FROM {_q(report_type)}')]
+            selected = [c for c in distinct if c is not None and (normalize_company_names(c) or '').upper() in companies]
+            conds.append(f'"Company" IN ({", ".join("?" for _ in selected) or "NULL"})'); args += selected
+        for col, values in (('Estate', estates), ('Счет', accounts)):
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else list(values)
+            conds.append(f'{_q(col)} IN ({", ".join("?" for _ in values) or "NULL"})'); args += values
+        if where:
+            conds.append(f'({where})'); args += list(params)
+
+        select = ', '.join(_q(c) for c in columns) if columns else '*'
+        sql = f'SELECT {select} FROM {_q(report_type)}'
+        if conds:
+            sql += ' WHERE ' + ' AND '.join(conds)
+        df = pd.read_sql_query(sql, con, params=args)
+    finally:
+        con.close()
+    return _store_decode(df, kinds)
+
+def store_delete(db_path, report_type, source_files):
+    """Удаляет из хранилища строки указанных SOURCE_FILE. Возвращает число удалённых строк."""
+    con = _store_connect(db_path)
+    try:
+        if not _store_kinds(con, report_type):
+            return 0
+        with con:
+            cur = con.executemany(f'DELETE FROM {_q(report_type)} WHERE "SOURCE_FILE" = ?',
+                                  [(s,) for s in source_files])
+        return cur.rowcount
+    finally:
+        con.close()
+
+# Пример вызова:
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', store='/content/ledger.sqlite')
+# df = store_query('/content/ledger.sqlite', 'STATEMENT', companies='ООО Ромашка', accounts=['76.05'], date_from='2025-01-01')
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import pandas as pd
+
+# ----------------- Уровни строк ОСВ: итог / счёт / детализация -----------------
+
+# Столбцы STATEMENT, которые не являются уровнями иерархии (A6–A8)
+_STATEMENT_NON_LEVEL_COLUMNS = {
+    'Date', 'Company', 'Type', 'Document', 'Value', 'Счет',
+    'Показатель', 'Дебет/Кредит', 'SOURCE_FILE',
+}
+
+def statement_level_columns(df):
+    """Столбцы уровней иерархии ОСВ ниже счёта (Partner, Contract, Estate, Category, ...)."""
+    return [c for c in df.columns if c not in _STATEMENT_NON_LEVEL_COLUMNS and c != SHEET_COLUMN]
+
+def statement_row_kind(df):
+    """
+    Тип каждой строки плоской ОСВ (результат excel_parser_STATEMENT / parse_statement_folder):
+      'total'   — строки 'итого' (текст итога перенесён в Category);
+      'account' — агрегатная строка счёта (все уровни ниже счёта пустые);
+      'detail'  — строки детализации.
+    Возвращает pd.Series со значениями 'total' / 'account' / 'detail'.
+    """
+    kind = pd.Series('detail', index=df.index, dtype=object)
+    levels = statement_level_columns(df)
+    if levels:
+        kind[df[levels].isna().all(axis=1)] = 'account'
+    else:
+        kind[:] = 'account'
+    if 'Category' in df.columns:
+        is_total = df['Category'].astype(str).str.lower().str.contains('итого', na=False)
+        kind[is_total] = 'total'
+    return kind
+
+def statement_leaf_mask(df, kind=None):
+    """
+    Маска «листовых» строк ОСВ, сумма которых не дублируется: строки детализации
+    и строки счетов, у которых в том же файле нет детализации.
+    """
+    if kind is None:
+        kind = statement_row_kind(df)
+    key = df['Счет'].astype(str)
+    if 'SOURCE_FILE' in df.columns:
+        key = df['SOURCE_FILE'].astype(str) + '\x1f' + key
+    if SHEET_COLUMN in df.columns:
+        key = df[SHEET_COLUMN].astype(str) + '\x1f' + key
+    with_detail = key[kind == 'detail'].unique()
+    return (kind == 'detail') | ((kind == 'account') & ~key.isin(with_detail))
+
+
+# ----------------- Куб оборотов с инкрементальным обновлением -----------------
+# Куб хранит частичные агрегаты на уровне SOURCE_FILE × измерения: при поступлении новых
+# или изменённых файлов пересчитываются только их строки, а не вся история.
+# Итоговый отчёт (turnover_report) — суммирование небольшого куба по источникам.
+
+TURNOVER_CUBE_DIMS = ['Date', 'Company', 'Estate', 'Category', 'Показатель', 'Дебет/Кредит']
+
+def _cube_base_rows(df, report_type):
+    """Строки без итогов (чтобы суммы не дублировались), Date — первое число месяца."""
+    if report_type == 'STATEMENT':
+        df = df[statement_leaf_mask(df)]
+    elif report_type == 'INCOME':
+        df = df[df['Category'] != 'Итого за месяц']
+    elif report_type == 'SUPPLIERS':
+        df = df[pd.to_datetime(df['Date'], errors='coerce').notna()]
+    dates = pd.to_datetime(df['Date'], errors='coerce')
+    return df.assign(Date=dates.dt.to_period('M').dt.to_timestamp())
+
+def build_turnover_cube(df, report_type='STATEMENT', dims=None):
+    """
+    Материализует агрегаты Value по Date × Company × Estate × Category × Показатель × Дебет/Кредит.
+
+    Аргументы:
+        df (pd.DataFrame): Объединённая таблица (parse_*_folder / ingest_folder / read_dataset)
+        report_type (str): 'STATEMENT' | 'INCOME' | 'SUPPLIERS'
+        dims (list, optional): Измерения (по умолчанию TURNOVER_CUBE_DIMS; для SUPPLIERS — DtCr
+                               вместо Показатель/Дебет/Кредит). Отсутствующие в df столбцы пропускаются.
+
+    Возвращает:
+        pd.DataFrame: SOURCE_FILE + измерения + Value (сумма) + Rows (число строк)
+    """
+    if dims is None:
+        dims = TURNOVER_CUBE_DIMS if report_type != 'SUPPLIERS' else ['Date', 'Company', 'Estate', 'Category', 'Счет', 'DtCr']
+    if df.empty:
+        return pd.DataFrame(columns=['SOURCE_FILE'] + list(dims) + ['Value', 'Rows'])
+
+    base = _cube_base_rows(df, report_type)
+    keys = ['SOURCE_FILE'] + [d for d in dims if d in base.columns]
+    cube = (base.groupby(keys, dropna=False, sort=False)['Value']
+                .agg(Value='sum', Rows='count')
+                .reset_index())
+    cube.attrs['report_type'] = report_type
+    return cube
+
+def update_turnover_cube(cube, df_changed, report_type='STATEMENT', removed_sources=()):
+    """
+    Инкрементально обновляет куб: строки SOURCE_FILE из df_changed (и removed_sources)
+    удаляются, новые частичные агрегаты считаются только по df_changed.
+
+    Печатает затронутые периоды (Date), возвращает обновлённый куб.
+    """
+    dims = [c for c in cube.columns if c not in ('SOURCE_FILE', 'Value', 'Rows')]
+    changed = set(df_changed['SOURCE_FILE'].dropna().unique()) if not df_changed.empty else set()
+    changed |= set(removed_sources)
+
+    stale = cube['SOURCE_FILE'].isin(changed)
+    fresh = build_turnover_cube(df_changed, report_type, dims) if not df_changed.empty else cube.iloc[:0]
+
+    affected = pd.concat([cube.loc[stale, 'Date'], fresh['Date']]).dropna().unique()
+    print(f'Куб: заменено источников {len(changed)}, затронуто периодов {len(affected)}')
+
+    out = pd.concat([cube[~stale], fresh], ignore_index=True)
+    out.attrs['report_type'] = report_type
+    return out
+
+def turnover_report(cube, date_from=None, date_to=None, companies=None, dims=None):
+    """
+    Отчёт по обороту из куба: сумма частичных агрегатов по всем источникам.
+
+    dims — измерения отчёта (по умолчанию — все измерения куба).
+    """
+    if dims is None:
+        dims = [c for c in cube.columns if c not in ('SOURCE_FILE', 'Value', 'Rows')]
+    cube = filter_rows_by_period_company(cube, date_from, date_to, companies)
+    return (cube.groupby(list(dims), dropna=False)[['Value', 'Rows']]
+                .sum()
+                .reset_index())
+
+def save_turnover_cube(cube, root, report_type):
+    """Сохраняет куб рядом с данными: <root>/<REPORT_TYPE>/_cube.parquet (см. write_dataset)."""
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    path = os.path.join(root, report_type, '_cube.parquet')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pq.write_table(_df_to_arrow(cube), path + '.tmp')
+    os.replace(path + '.tmp', path)
+    return path
+
+def load_turnover_cube(root, report_type):
+    """Читает куб, сохранённый save_turnover_cube; None, если куба ещё нет."""
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    path = os.path.join(root, report_type, '_cube.parquet')
+    if not os.path.exists(path):
+        return None
+    cube = _arrow_to_df(pq.read_table(path))
+    cube.attrs['report_type'] = report_type
+    return cube
+
+def refresh_turnover_cube(root, report_type, df_changed, removed_sources=()):
+    """
+    Обновляет сохранённый куб датасета по новым/изменённым данным df_changed
+    (если куба ещё нет — строит его по всему датасету) и сохраняет.
+    """
+    cube = load_turnover_cube(root, report_type)
+    if cube is None:
+        cube = build_turnover_cube(read_dataset(root, report_type), report_type)
+    else:
+        cube = update_turnover_cube(cube, df_changed, report_type, removed_sources)
+    save_turnover_cube(cube, root, report_type)
+    return cube
+
+# Пример вызова:
+# write_dataset({'STATEMENT': df_new}, root_ds)
+# cube = refresh_turnover_cube(root_ds, 'STATEMENT', df_new)
+# report = turnover_report(cube, date_from='2025-01-01', dims=['Date', 'Company', 'Показатель', 'Дебет/Кредит'])
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import numpy as np
+import pandas as pd
+
+# ----------------- Проверка балансовых тождеств ОСВ -----------------
+# Для всех файлов сразу (векторно) проверяется:
+#   'balance'  — сальдо на начало + обороты = сальдо на конец (в свёрнутом виде Дт − Кт) для каждой строки;
+#   'children' — строка счёта = сумма строк детализации этого счёта;
+#   'total'    — строка 'итого' = сумма строк счетов файла.
+# Обороты сравниваются по Дебету и Кредиту отдельно, сальдо — свёрнуто (Дт − Кт),
+# т.к. развёрнутое сальдо родителя не обязано совпадать с суммой развёрнутых сальдо детей.
+
+_OSV_MEASURES = {
+    'Сальдо на начало периода|Дебет': 'OpenDt',
+    'Сальдо на начало периода|Кредит': 'OpenCr',
+    'Обороты за период|Дебет': 'TurnDt',
+    'Обороты за период|Кредит': 'TurnCr',
+    'Сальдо на конец периода|Дебет': 'CloseDt',
+    'Сальдо на конец периода|Кредит': 'CloseCr',
+}
+
+_OSV_CHECKED = {
+    'Сальдо на начало периода (Дт − Кт)': lambda w: w['OpenDt'] - w['OpenCr'],
+    'Обороты за период / Дебет': lambda w: w['TurnDt'],
+    'Обороты за период / Кредит': lambda w: w['TurnCr'],
+    'Сальдо на конец периода (Дт − Кт)': lambda w: w['CloseDt'] - w['CloseCr'],
+}
+
+def _statement_wide(df, keys):
+    """Одна строка на сочетание keys, столбцы OpenDt … CloseCr — суммы Value."""
+    if df.empty:
+        return pd.DataFrame(columns=list(keys) + list(_OSV_MEASURES.values()))
+    ent = df.groupby(list(keys), dropna=False, sort=False).ngroup().to_numpy()
+    measure = (df['Показатель'].astype(str) + '|' + df['Дебет/Кредит'].astype(str)).map(_OSV_MEASURES)
+    long = pd.DataFrame({
+        'ent': ent,
+        'measure': measure.to_numpy(),
+        'v': pd.to_numeric(df['Value'], errors='coerce').to_numpy(dtype='float64', na_value=0.0),
+    }).dropna(subset=['measure'])
+    wide = (long.groupby(['ent', 'measure'])['v'].sum()
+                .unstack(fill_value=0.0)
+                .reindex(columns=list(_OSV_MEASURES.values()), fill_value=0.0))
+    first = df[list(keys)].assign(ent=ent).drop_duplicates('ent').set_index('ent')
+    return first.join(wide, how='left').fillna({m: 0.0 for m in _OSV_MEASURES.values()}).reset_index(drop=True)
+
+def _compare_measures(expected, actual, keys, check, tolerance):
+    """Сравнивает две широкие таблицы по keys и возвращает строки расхождений."""
+    merged = expected.merge(actual, on=list(keys), how='inner', suffixes=('_exp', '_act'))
+    out = []
+    for label, fn in _OSV_CHECKED.items():
+        exp = fn(merged.rename(columns=lambda c: c[:-4] if c.endswith('_exp') else c + '#'))
+        act = fn(merged.rename(columns=lambda c: c[:-4] if c.endswith('_act') else c + '#'))
+        delta = act - exp
+        bad = delta.abs() > tolerance
+        if bad.any():
+            part = merged.loc[bad, list(keys)].copy()
+            part['Check'] = check
+            part['Measure'] = label
+            part['Expected'] = exp[bad].to_numpy()
+            part['Actual'] = act[bad].to_numpy()
+            part['Delta'] = delta[bad].to_numpy()
+            out.append(part)
+    return out
+
+def validate_statement_balances(df, tolerance=0.01):
+    """
+    Векторная проверка балансовых тождеств по плоской ОСВ (excel_parser_STATEMENT /
+    parse_statement_folder / ingest_folder) для всех файлов сразу.
+
+    Аргументы:
+        df (pd.DataFrame): Плоская ОСВ (один или много файлов)
+        tolerance (float): Допустимое расхождение (копейки округления)
+
+    Возвращает:
+        pd.DataFrame расхождений: SOURCE_FILE (и SHEET, если разбирались листы), Date, Company,
+        Check ('balance' | 'children' | 'total'), Счет, Level (значения уровней ниже счёта через ' / '),
+        Measure, Expected, Actual, Delta. Пустая таблица — все тождества выполняются.
+    """
+    sheet_keys = [SHEET_COLUMN] if SHEET_COLUMN in df.columns else []
+    columns = (['SOURCE_FILE'] + sheet_keys +
+               ['Date', 'Company', 'Check', 'Счет', 'Level', 'Measure', 'Expected', 'Actual', 'Delta'])
+    if df.empty:
+        return pd.DataFrame(columns=columns)
+
+    df = df.copy() if 'SOURCE_FILE' in df.columns else df.assign(SOURCE_FILE=None)
+    kind = statement_row_kind(df)
+    levels = statement_level_columns(df)
+    file_keys = ['SOURCE_FILE'] + sheet_keys + ['Date', 'Company']
+    parts = []
+
+    # 1. Сальдо на начало + обороты = сальдо на конец (каждая строка-сущность)
+    row_keys = file_keys + ['Счет'] + levels
+    wide = _statement_wide(df, row_keys)
+    opening = (wide['OpenDt'] - wide['OpenCr']) + (wide['TurnDt'] - wide['TurnCr'])
+    closing = wide['CloseDt'] - wide['CloseCr']
+    delta = opening - closing
+    bad = delta.abs() > tolerance
+    if bad.any():
+        part = wide.loc[bad, row_keys].copy()
+        part['Check'] = 'balance'
+        part['Measure'] = 'Сальдо на конец периода (Дт − Кт)'
+        part['Expected'] = closing[bad].to_numpy()
+        part['Actual'] = opening[bad].to_numpy()
+        part['Delta'] = (opening - closing)[bad].to_numpy()
+        parts.append(part)
+
+    # 2. Строка счёта = сумма детализации
+    acc_keys = file_keys + ['Счет']
+    accounts = _statement_wide(df[kind == 'account'], acc_keys)
+    details = _statement_wide(df[kind == 'detail'], acc_keys)
+    parts += _compare_measures(accounts, details, acc_keys, 'children', tolerance)
+
+    # 3. 'итого' = сумма счетов (без счетов-родителей, чьи субсчета тоже есть в файле)
+    if not accounts.empty:
+        acc_codes = accounts[['SOURCE_FILE'] + sheet_keys + ['Счет']].astype(str)
+        is_parent = np.zeros(len(accounts), dtype=bool)
+        for _, idx in acc_codes.groupby(['SOURCE_FILE'] + sheet_keys).indices.items():
+            codes = acc_codes['Счет'].to_numpy()[idx]
+            for j, code in zip(idx, codes):
+                is_parent[j] = any(other.startswith(code + '.') for other in codes)
+        acc_sum = (accounts[~is_parent]
+                   .groupby(file_keys, dropna=False)[list(_OSV_MEASURES.values())]
+                   .sum()
+                   .reset_index())
+        totals = _statement_wide(df[kind == 'total'], file_keys + ['Category'])
+        for p in _compare_measures(totals, acc_sum, file_keys, 'total', tolerance):
+            parts.append(p.assign(Счет=None))
+
+    if not parts:
+        return pd.DataFrame(columns=columns)
+
+    out = pd.concat(parts, ignore_index=True)
+    present_levels = [c for c in levels if c in out.columns]
+    if present_levels:
+        out['Level'] = out[present_levels].apply(
+            lambda r: ' / '.join(str(v) for v in r if v is not None and not (isinstance(v, float) and np.isnan(v))) or None,
+            axis=1)
+    else:
+        out['Level'] = None
+    for col in columns:
+        if col not in out.columns:
+            out[col] = None
+    return out[columns].sort_values(['SOURCE_FILE', 'Check', 'Счет'], kind='stable').reset_index(drop=True)
+
+# Пример вызова:
+# issues = validate_statement_balances(parse_statement_folder(root_main, 'Ведомость', excel_parser_STATEMENT))
+# issues.groupby(['SOURCE_FILE', 'Check']).size()
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import re
+import pandas as pd
+
+# ----------------- Сверка выручки (INCOME) с оборотами ОСВ (STATEMENT) -----------------
+# Ключи нормализуются один раз на каждое различное значение (а не на строку), обе стороны
+# агрегируются до ключей и только потом соединяются — объём работы линеен по числу строк.
+
+_COMPANY_KEY_COLUMNS = ('Company', 'Partner', 'Supplier', 'Related Company')
+
+def _reconcile_key(series, col):
+    """Нормализованный ключ соединения для столбца col (пустые значения -> '')."""
+    if col == 'Date':
+        dates = pd.to_datetime(series, errors='coerce')
+        return dates.dt.to_period('M').dt.to_timestamp()
+    uniq = series.dropna().unique()
+    if col in _COMPANY_KEY_COLUMNS:
+        mapping = {u: (normalize_company_names(u) or '').upper() for u in uniq}
+    else:
+        mapping = {u: re.sub(r'\s+', ' ', str(u)).strip().lower() for u in uniq}
+    return series.map(mapping).fillna('')
+
+def _reconcile_side(df, keys):
+    data = {k: _reconcile_key(df[k], k).to_numpy() for k in keys}
+    data['Value'] = pd.to_numeric(df['Value'], errors='coerce').fillna(0.0).to_numpy()
+    return (pd.DataFrame(data)
+              .groupby(list(keys), dropna=False, sort=False)['Value']
+              .agg(Value='sum', Rows='count')
+              .reset_index())
+
+def reconcile_income_statement(df_income, df_statement,
+                               keys=('Company', 'Partner', 'Date'),
+                               accounts=None,
+                               indicator='Обороты за период',
+                               side='Дебет',
+                               tolerance=0.01):
+    """
+    Сверяет выручку из excel_parser_INCOME с оборотами из excel_parser_STATEMENT.
+
+    Аргументы:
+        df_income    (pd.DataFrame): Выручка (parse_income_folder / ingest_folder['INCOME'])
+        df_statement (pd.DataFrame): ОСВ (parse_statement_folder / ingest_folder['STATEMENT'])
+        keys (tuple): Ключи сверки; Company/Partner нормализуются normalize_company_name,
+                      Date приводится к месяцу, прочие — к нижнему регистру без лишних пробелов
+        accounts (list, optional): Счета ОСВ (по префиксу, например ['62', '90.01']); по умолчанию — все
+        indicator, side: Какие обороты ОСВ сравнивать ('Обороты за период', 'Дебет' | 'Кредит')
+        tolerance (float): Допустимое расхождение сумм
+
+    Возвращает:
+        dict:
+            'matched'   — ключи, по которым суммы совпали (Value_income ≈ Value_statement);
+            'delta'     — ключи, найденные в обеих таблицах, но с расхождением (Delta = income − statement);
+            'unmatched' — ключи только с одной стороны (столбец Side: 'income' | 'statement').
+    """
+    keys = list(keys)
+    for name, df in (('INCOME', df_income), ('STATEMENT', df_statement)):
+        missing = [k for k in keys if k not in df.columns]
+        if missing:
+            raise ValueError(f'{name}: нет столбцов для сверки: {missing}')
+
+    # Выручка без строк 'Итого за месяц'
+    income = df_income[df_income['Category'] != 'Итого за месяц'] if 'Category' in df_income.columns else df_income
+
+    # ОСВ: только листовые строки (без дублирования итогов) нужного показателя
+    st = df_statement[statement_leaf_mask(df_statement)]
+    st = st[(st['Показатель'] == indicator) & (st['Дебет/Кредит'] == side)]
+    if accounts:
+        accounts = [accounts] if isinstance(accounts, str) else list(accounts)
+        acc = st['Счет'].astype(str)
+        mask = pd.Series(False, index=st.index)
+        for a in accounts:
+            mask |= (acc == a) | acc.str.startswith(a + '.')
+        st = st[mask]
+
+    inc_agg = _reconcile_side(income, keys)
+    st_agg = _reconcile_side(st, keys)
+
+    merged = inc_agg.merge(st_agg, on=keys, how='outer', suffixes=('_income', '_statement'), indicator=True)
+    both = merged['_merge'] == 'both'
+    merged['Delta'] = merged['Value_income'].fillna(0.0) - merged['Value_statement'].fillna(0.0)
+
+    value_cols = keys + ['Value_income', 'Value_statement', 'Delta', 'Rows_income', 'Rows_statement']
+    matched = merged.loc[both & (merged['Delta'].abs() <= tolerance), value_cols]
+    delta = merged.loc[both & (merged['Delta'].abs() > tolerance), value_cols]
+    unmatched = merged.loc[~both, value_cols].copy()
+    unmatched.insert(len(keys), 'Side', merged.loc[~both, '_merge'].map({'left_only': 'income', 'right_only': 'statement'}).astype(object))
+
+    return {
+        'matched': matched.sort_values(keys).reset_index(drop=True),
+        'delta': delta.sort_values('Delta', key=lambda s: s.abs(), ascending=False).reset_index(drop=True),
+        'unmatched': unmatched.sort_values(keys).reset_index(drop=True),
+    }
+
+# Пример вызова:
+# rec = reconcile_income_statement(tables['INCOME'], tables['STATEMENT'], keys=('Company', 'Date'), accounts=['62'])
+# rec['delta'].head(20)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import re
+from collections import defaultdict
+import pandas as pd
+
+# ----------------- Кластеризация написаний контрагентов (Partner / Supplier) -----------------
+# 1) Точная склейка по ключу: normalize_company_name -> ОПФ + отсортированные слова
+#    ('ООО Ромашка' и 'Ромашка ООО' дают один ключ).
+# 2) Нечёткая склейка опечаток. Кандидатные пары — только внутри блоков (с той же ОПФ):
+#      • блок по варианту названия с одним удалённым символом — любая одиночная опечатка
+#        (замена, вставка, удаление, перестановка соседних букв) даёт общий ключ;
+#      • блок по редкому целому слову — названия, отличающиеся другими словами.
+#    Слишком большие блоки (частые слова) пропускаются, поэтому попарного сравнения всех имён нет.
+#    Пары-кандидаты проверяются по коэффициенту Дайса на триграммах (порог threshold).
+# 3) Защита от ложных склеек: склеиваются только названия с одинаковым набором слов, из которых
+#    одно отличается одной опечаткой не в окончании. Лишнее слово ('Ромашка' / 'Ромашка Плюс')
+#    или другое окончание ('Иванов' / 'Иванова') — разные лица: такие пары не склеиваются, а попадают
+#    в attrs['review'] для ручной проверки. Короткие слова (инициалы) и слова с цифрами — только точно.
+#    Латинские буквы, похожие на кириллические ('Ромaшка' с латинской a), приводятся к кириллице в ключе.
+
+_ENTITY_OPF = {'ИП', 'АНО', 'ДПО', 'ООО', 'ЗАО', 'ОАО', 'НПО', 'АО', 'ПАО', 'ФГБУ', 'УФССП', 'УФФССП',
+               'КПК', 'ОСФР', 'УФК', 'НО', 'МУП', 'ВГДОО', 'ВРМОО'}
+
+_LATIN_LOOKALIKES = str.maketrans('ABCEHKMOPTXY', 'АВСЕНКМОРТХУ')
+
+def _fold_lookalikes(token):
+    """Латинские буквы-двойники -> кириллица в словах с кириллицей (и в ОПФ, набранной латиницей: OOO)."""
+    folded = token.translate(_LATIN_LOOKALIKES)
+    if folded in _ENTITY_OPF or re.search('[А-Я]', token):
+        return folded
+    return token
+
+def _entity_key(normalized):
+    """(ОПФ, слова названия без ОПФ) по результату normalize_company_name."""
+    tokens = re.sub(r'[^0-9A-ZА-Я]+', ' ', (normalized or '').upper().replace('Ё', 'Е')).split()
+    tokens = [_fold_lookalikes(t) for t in tokens]
+    opf = ' '.join(t for t in tokens if t in _ENTITY_OPF)
+    words = tuple(sorted(t for t in tokens if t not in _ENTITY_OPF))
+    return opf, words
+
+def _entity_trigrams(words):
+    text = ' ' + ' '.join(words) + ' '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _entity_strict_tokens(words):
+    return frozenset(w for w in words if len(w) <= 2 or any(ch.isdigit() for ch in w))
+
+def _entity_word_typo(a, b):
+    """
+    Слова отличаются одной опечаткой (замена, вставка, удаление, перестановка соседних букв),
+    не затрагивающей последнюю букву: другое окончание — другое слово, а не опечатка.
+    """
+    if abs(len(a) - len(b)) > 1:
+        return False
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    j = 0
+    while j < n - i and a[-1 - j] == b[-1 - j]:
+        j += 1
+    ra, rb = a[i:len(a) - j], b[i:len(b) - j]
+    single = (len(ra) <= 1 and len(rb) <= 1) or (len(ra) == len(rb) == 2 and ra == rb[::-1])
+    return single and j >= 1
+
+def _entity_typo_variant(wa, wb):
+    """Наборы слов совпадают, кроме одного слова с одной опечаткой (_entity_word_typo)."""
+    if len(wa) != len(wb):
+        return False
+    rest_a, rest_b = list(wa), list(wb)
+    for w in wa:
+        if w in rest_b:
+            rest_a.remove(w)
+            rest_b.remove(w)
+    return len(rest_a) == 1 and _entity_word_typo(rest_a[0], rest_b[0])
+
+class _UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+def build_company_name_mapping(data, columns=('Partner', 'Supplier'), threshold=0.7, max_block_size=50):
+    """
+    Строит таблицу соответствия «написание -> каноническое имя» для контрагентов.
+
+    Аргументы:
+        data (pd.DataFrame | pd.Series | list): Таблица (берутся столбцы columns) или список имён
+        columns (tuple): Столбцы с названиями компаний, если data — DataFrame
+        threshold (float): Порог сходства (коэффициент Дайса по триграммам, 0..1) для склейки опечаток
+        max_block_size (int): Блоки крупнее (частые слова) не используются для поиска кандидатов
+
+    Возвращает:
+        pd.DataFrame: Name (исходное написание), Normalized (normalize_company_name), Canonical,
+                      Cluster (номер кластера), Count (сколько раз встречается написание).
+        Каноническое имя — нормализованная форма самого частого написания в кластере.
+        attrs['review'] — похожие, но не склеенные пары (лишнее слово, другое окончание):
+        список {'Name', 'Candidate', 'Similarity'} для ручной проверки.
+    """
+    if isinstance(data, pd.DataFrame):
+        values = pd.concat([data[c] for c in columns if c in data.columns], ignore_index=True)
+    else:
+        values = pd.Series(list(data), dtype=object)
+    values = values.dropna()
+    values = values[values.astype(str).str.strip() != '']
+    counts = values.astype(str).value_counts()
+    names = counts.index.tolist()
+    if not names:
+        return pd.DataFrame(columns=['Name', 'Normalized', 'Canonical', 'Cluster', 'Count'])
+
+    # 1. Точные ключи
+    normalized = [normalize_company_names(n) for n in names]
+    key_ids = {}
+    name_key = [key_ids.setdefault(_entity_key(n), len(key_ids)) for n in normalized]
+    keys = list(key_ids)
+
+    # 2. Кандидатные пары
+    pairs = []
+    first_with_variant = {}            # вариант с удалённым символом -> первый ключ с ним
+    token_blocks = defaultdict(list)   # редкое слово -> ключи
+    for k, (opf, words) in enumerate(keys):
+        body = ' '.join(words)
+        if len(body) >= 4:
+            head = opf + '|'
+            for variant in [body] + [body[:pos] + body[pos + 1:] for pos in range(len(body))]:
+                j = first_with_variant.setdefault(head + variant, k)
+                if j != k:
+                    pairs.append((j, k))
+        for w in set(words):
+            if len(w) >= 4 and not any(ch.isdigit() for ch in w):
+                token_blocks[(opf, w)].append(k)
+    for members in token_blocks.values():
+        if 2 <= len(members) <= max_block_size:
+            pairs += [(a, b) for pos, a in enumerate(members) for b in members[pos + 1:]]
+
+    # 3. Проверка пар по триграммам
+    grams = {}
+    strict = {}
+    def _features(k):
+        if k not in grams:
+            grams[k] = _entity_trigrams(keys[k][1])
+            strict[k] = _entity_strict_tokens(keys[k][1])
+        return grams[k], strict[k]
+
+    uf = _UnionFind(len(keys))
+    review = []
+    for a, b in pairs:
+        if uf.find(a) == uf.find(b):
+            continue
+        ga, sa = _features(a)
+        gb, sb = _features(b)
+        similarity = 2 * len(ga & gb) / (len(ga) + len(gb))
+        if sa != sb or similarity < threshold:
+            continue
+        if _entity_typo_variant(keys[a][1], keys[b][1]):
+            uf.union(a, b)
+        else:
+            review.append((a, b, similarity))
+
+    # 4. Кластеры и канонические имена
+    cluster_of_key = [uf.find(k) for k in range(len(keys))]
+    out = pd.DataFrame({
+        'Name': names,
+        'Normalized': normalized,
+        'Cluster': [cluster_of_key[k] for k in name_key],
+        'Count': counts.to_numpy(),
+    })
+    # names уже отсортированы по убыванию частоты — первое написание в кластере самое частое
+    canonical = out.groupby('Cluster', sort=False)['Normalized'].first()
+    out['Canonical'] = out['Cluster'].map(canonical)
+    out['Cluster'] = pd.factorize(out['Cluster'])[0]
+    out = out[['Name', 'Normalized', 'Canonical', 'Cluster', 'Count']]
+
+    key_name = {}
+    for name, k in zip(normalized, name_key):
+        key_name.setdefault(k, name)
+    out.attrs['review'] = [
+        {'Name': key_name[a], 'Candidate': key_name[b], 'Similarity': round(similarity, 3)}
+        for a, b, similarity in review if uf.find(a) != uf.find(b)
+    ]
+    return out
+
+def apply_company_name_mapping(df, mapping, columns=('Partner', 'Supplier')):
+    """
+    Массово заменяет написания компаний на канонические имена по таблице build_company_name_mapping.
+    Значения, которых нет в таблице, не меняются. Возвращает новый DataFrame.
+    """
+    lookup = dict(zip(mapping['Name'], mapping['Canonical']))
+    out = df.copy()
+    for col in columns:
+        if col in out.columns:
+            mapped = out[col].astype(object).map(lambda v: lookup.get(v, v) if isinstance(v, str) else v)
+            out[col] = mapped
+    return out
+
+# Пример вызова:
+# mapping = build_company_name_mapping(df_suppliers_enriched, columns=('Partner', 'Supplier'))
+# mapping.to_csv('company_mapping.csv', index=False)
+# df_suppliers_enriched = apply_company_name_mapping(df_suppliers_enriched, mapping)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import sys
+import json
+import time
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import wait as _mp_wait
+import pandas as pd
+from tqdm import tqdm
+
+# ----------------- Защищённый прогон: таймаут, лимиты строк/памяти, изоляция процессов -----------------
+# guard=True | dict в parse_*_folder / ingest_folder: каждый файл парсится в собственном процессе.
+# Зависание, переполнение памяти или аварийное завершение процесса затрагивают только этот файл —
+# он попадает в отчёт об ошибках, остальные файлы обрабатываются дальше в полном темпе.
+#
+# Статусы в отчёте:
+#   'timeout' — файл не уложился в timeout секунд, процесс остановлен;
+#   'row_cap' — на листе (по размеру листа из файла) или в результате больше max_rows строк;
+#   'memory'  — превышен max_memory_mb (MemoryError в процессе-обработчике);
+#   'crash'   — процесс завершился без результата (например, убит OOM-killer'ом);
+#   'error'   — обычное исключение парсера.
+
+GUARD_DEFAULTS = {
+    'timeout': 600,         # секунд на файл (None — без ограничения)
+    'max_rows': None,       # максимум строк на листе / в результате файла
+    'max_memory_mb': None,  # лимит адресного пространства процесса-обработчика, МБ (только Unix)
+    'report': None,         # путь к JSON-файлу, куда дополнительно записывается отчёт об ошибках
+}
+
+class _GuardLimitError(Exception):
+    """Файл превышает лимит guard (max_rows)."""
+
+def _guard_options(guard):
+    opts = dict(GUARD_DEFAULTS)
+    if isinstance(guard, dict):
+        unknown = set(guard) - set(GUARD_DEFAULTS)
+        if unknown:
+            raise ValueError(f'Неизвестные параметры guard: {sorted(unknown)}')
+        opts.update(guard)
+    return opts
+
+def _guard_sheet_rows(file):
+    """Число строк самого большого листа по размеру (dimension) из файла; None, если размер не записан."""
+    if not isinstance(file, _ZipMember) and not (isinstance(file, str) and file.lower().endswith('.xlsx')):
+        return None
+    wb = load_workbook(_workbook_source(file), read_only=True)
+    try:
+        sizes = [ws.max_row for ws in wb.worksheets]
+    finally:
+        wb.close()
+    sizes = [n for n in sizes if n is not None]
+    return max(sizes) if sizes else None
+
+def _guarded_worker(conn, func, args, file, max_rows, max_memory_mb):
+    """Тело процесса-обработчика: лимиты -> проверка размера листа -> парсинг -> отправка результата."""
+    try:
+        if max_memory_mb:
+            try:
+                import resource
+                limit = int(max_memory_mb) * 1024 * 1024
+                resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+            except (ImportError, ValueError, OSError):
+                pass
+        if max_rows:
+            n_rows = _guard_sheet_rows(file)
+            if n_rows is not None and n_rows > max_rows:
+                raise _GuardLimitError(f'на листе {n_rows} строк при лимите {max_rows}')
+        result = func(*args)
+        df = result[1] if isinstance(result, tuple) else result  # ingest_folder: (report_type, df)
+        n_rows = len(df) if df is not None else 0
+        if max_rows and n_rows > max_rows:
+            raise _GuardLimitError(f'в результате {n_rows} строк при лимите {max_rows}')
+        conn.send(('ok', result))
+    except MemoryError:
+        conn.send(('memory', f'превышен лимит памяти {max_memory_mb} МБ'))
+    except _GuardLimitError as e:
+        conn.send(('row_cap', str(e)))
+    except BaseException as e:
+        tb = traceback.format_exc(limit=-3)
+        try:
+            conn.send(('error', f'{type(e).__name__}: {e}', tb))
+        except Exception:
+            pass
+    finally:
+        conn.close()
+
+def _module_importable():
+    """Новый процесс может импортировать модуль по имени: он не вставлен в ячейку ноутбука (__main__ без файла)."""
+    if __name__ != '__main__':
+        return True
+    return bool(getattr(sys.modules.get('__main__'), '__file__', None))
+
+def _process_context():
+    """
+    Способ запуска процессов-обработчиков. fork — процесс стартует мгновенно и не импортирует
+    модули заново. Но если в родителе уже загружен polars (его пул потоков не переживает fork —
+    дочерний процесс может зависнуть), используется forkserver с заранее импортированным модулем.
+    Код, вставленный в ячейки Colab, импортировать нечем — тогда остаётся fork.
+    """
+    methods = mp.get_all_start_methods()
+    if 'polars' in sys.modules and 'forkserver' in methods and _module_importable():
+        ctx = mp.get_context('forkserver')
+        ctx.set_forkserver_preload([__name__])
+        return ctx
+    if 'fork' in methods:
+        return mp.get_context('fork')
+    return mp.get_context()
+
+def _run_guarded_tasks(tasks, desc, max_workers, guard, errors=None):
+    """
+    Аналог _run_parse_tasks, в котором каждая задача выполняется в отдельном процессе.
+    Одновременно работает до max_workers процессов (по умолчанию 1); файлы подаются
+    от больших к маленьким. Возвращает результаты в порядке tasks (None для упавших),
+    записи об ошибках добавляет в errors.
+    """
+    opts = _guard_options(guard)
+    timeout = opts['timeout']
+    ctx = _process_context()
+    results = [None] * len(tasks)
+
+    def _size(i):
+        try:
+            return _source_size(tasks[i][2])
+        except (OSError, TypeError):
+            return 0
+    pending = sorted(range(len(tasks)), key=_size, reverse=True)
+    pending.reverse()  # pop() с конца — самые большие первыми
+    running = {}       # i -> (process, conn, start)
+    n_workers = max(1, max_workers or 1)
+
+    def _fail(i, status, message, started, **extra):
+        file = tasks[i][2]
+        print(f'Ошибка при парсинге файла {file}: [{status}] {message}')
+        if errors is not None:
+            errors.append(dict({'file': str(file), 'status': status, 'error': message,
+                                'seconds': round(time.monotonic() - started, 3)}, **extra))
+
+    def _finish(i, msg):
+        proc, conn, started = running.pop(i)
+        conn.close()
+        proc.join()
+        if msg is None:
+            _fail(i, 'crash', f'процесс завершился без результата (код {proc.exitcode})',
+                  started, exitcode=proc.exitcode)
+        elif msg[0] == 'ok':
+            results[i] = msg[1]
+        else:
+            _fail(i, msg[0], msg[1], started, **({'traceback': msg[2]} if len(msg) > 2 else {}))
+
+    with tqdm(total=len(tasks), desc=desc, unit="файл") as pbar:
+        while pending or running:
+            while pending and len(running) < n_workers:
+                i = pending.pop()
+                func, args, file = tasks[i]
+                recv_conn, send_conn = ctx.Pipe(duplex=False)
+                proc = ctx.Process(target=_guarded_worker,
+                                   args=(send_conn, func, args, file, opts['max_rows'], opts['max_memory_mb']),
+                                   daemon=True)
+                proc.start()
+                send_conn.close()
+                running[i] = (proc, recv_conn, time.monotonic())
+
+            now = time.monotonic()
+            wait_for = None
+            if timeout:
+                wait_for = max(0.0, min(started + timeout for _, _, started in running.values()) - now)
+            by_handle = {}
+            for i, (proc, conn, _) in running.items():
+                by_handle[conn] = i
+                by_handle[proc.sentinel] = i
+            ready = _mp_wait(list(by_handle), timeout=wait_for)
+
+            done = set()
+            for handle in ready:
+                i = by_handle[handle]
+                if i in done:
+                    continue
+                conn = running[i][1]
+                msg = None
+                if conn.poll():
+                    try:
+                        msg = conn.recv()
+                    except (EOFError, OSError):
+                        msg = None
+                done.add(i)
+                _finish(i, msg)
+                pbar.update(1)
+
+            if timeout:
+                now = time.monotonic()
+                for i in [i for i, (_, _, started) in running.items() if now - started >= timeout]:
+                    proc = running[i][0]
+                    proc.terminate()
+                    proc.join(5)
+                    if proc.is_alive():
+                        proc.kill()
+                    proc, conn, started = running.pop(i)
+                    conn.close()
+                    proc.join()
+                    _fail(i, 'timeout', f'превышен таймаут {timeout} с', started)
+                    pbar.update(1)
+    return results
+
+def _attach_parse_errors(df, errors, guard=None):
+    """
+    Кладёт отчёт об ошибках в df.attrs['parse_errors'] и, если задано guard['report'], пишет его в JSON.
+    У Polars-таблиц attrs нет — для них отчёт доступен только через guard['report'].
+    """
+    if hasattr(df, 'attrs'):
+        df.attrs['parse_errors'] = list(errors)
+    _write_parse_report(errors, guard)
+
+def _write_parse_report(errors, guard=None):
+    """Пишет отчёт об ошибках в guard['report'] (JSON), если он задан."""
+    report = _guard_options(guard)['report'] if guard else None
+    if report:
+        with open(report, 'w', encoding='utf-8') as f:
+            json.dump(errors, f, ensure_ascii=False, indent=2, default=str)
+
+def parse_errors_frame(obj):
+    """
+    Отчёт об ошибках парсинга в виде DataFrame (file, status, error, seconds, ...).
+    obj — результат parse_*_folder или ingest_folder.
+    """
+    if isinstance(obj, dict):
+        obj = next(iter(obj.values()), None)
+    errors = getattr(obj, 'attrs', {}).get('parse_errors', []) if obj is not None else []
+    return pd.DataFrame(errors, columns=None if errors else ['file', 'status', 'error', 'seconds'])
+
+# Пример вызова:
+# df = parse_statement_folder(root, 'Ведомость', excel_parser_STATEMENT, max_workers=4,
+#                             guard={'timeout': 300, 'max_rows': 500_000, 'max_memory_mb': 4096})
+# parse_errors_frame(df)   # карантин: файлы, которые не разобрались, и причина
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import json
+import time
+import traceback
+import pandas as pd
+
+# ----------------- Наблюдение за папкой: инкрементальная дозагрузка новых/изменённых выгрузок -----------------
+# Опрос (polling) дерева root_main раз в interval секунд — работает и на Google Drive, и на локальной папке.
+# Состояние хранится в <dataset_root>/_watch_state.json:
+#   files   — {SOURCE_FILE: {'mtime', 'size', 'type', 'status'}} — что уже загружено в датасет;
+#   pending — {SOURCE_FILE: [mtime, size]} — что видели при прошлом опросе (для debounce).
+# Файл берётся в работу, только когда он «успокоился»: его mtime старше debounce секунд и размер/mtime
+# не менялись с прошлого опроса (недокачанный файл не парсится). Изменённые файлы перезаписываются в
+# датасете целиком по SOURCE_FILE (write_dataset), удалённые — удаляются (delete_from_dataset).
+
+WATCH_STATE_FILE = '_watch_state.json'
+
+def _load_watch_state(path):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    else:
+        state = {}
+    state.setdefault('files', {})
+    state.setdefault('pending', {})
+    return state
+
+def _save_watch_state(path, state):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(path + '.tmp', path)
+
+def _scan_watch_tree(root_main, subfolders=None):
+    """{относительный путь: (mtime, size)} всех .xlsx/.xls под root_main (или его subfolders)."""
+    bases = [os.path.join(root_main, s) for s in subfolders] if subfolders else [root_main]
+    found = {}
+    for base in bases:
+        for dirpath, _, names in os.walk(base):
+            for name in names:
+                low = name.lower()
+                if name.startswith('~$') or not low.endswith(('.xlsx', '.xls')):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # файл исчез между листингом и stat
+                found[os.path.relpath(path, root_main)] = (st.st_mtime, st.st_size)
+    return found
+
+def watch_once(root_main, dataset_root, subfolders=None, debounce=10, batch_size=50,
+               parsers=None, max_workers=None, guard=None, store=None, refresh_cube=False,
+               state_path=None):
+    """
+    Один цикл наблюдения: найти новые/изменённые/удалённые файлы и синхронизировать с ними датасет.
+
+    Аргументы:
+        root_main    (str): Корневая папка выгрузок (SOURCE_FILE считается относительно неё)
+        dataset_root (str): Папка Parquet-датасета (write_dataset / read_dataset)
+        subfolders  (list, optional): Наблюдать только эти подкаталоги, например ['Ведомость', 'Выручка']
+        debounce   (float): Сколько секунд файл должен не меняться, прежде чем его парсить
+        batch_size   (int): Сколько файлов парсить и записывать за один пакет
+        parsers, max_workers, guard: Как в ingest_folder
+        store        (str, optional): Файл SQLite — изменения дублируются в хранилище
+        refresh_cube (bool): Обновлять сохранённые кубы оборотов (refresh_turnover_cube) для STATEMENT / INCOME
+        state_path   (str, optional): Файл состояния (по умолчанию <dataset_root>/_watch_state.json)
+
+    Возвращает:
+        dict: {'added': [...], 'updated': [...], 'removed': [...], 'unknown': [...], 'errors': [...], 'waiting': [...]}
+    """
+    state_path = state_path or os.path.join(dataset_root, WATCH_STATE_FILE)
+    state = _load_watch_state(state_path)
+    known, pending = state['files'], state['pending']
+    summary = {k: [] for k in ('added', 'updated', 'removed', 'unknown', 'errors', 'waiting')}
+
+    all_parsers = {
+        'STATEMENT': excel_parser_STATEMENT,
+        'INCOME': excel_parser_INCOME,
+        'SUPPLIERS': excel_parser_SUPPLIERS,
+    }
+    all_parsers.update(parsers or {})
+
+    now = time.time()
+    found = _scan_watch_tree(root_main, subfolders)
+
+    # --- Отбор «успокоившихся» изменённых файлов ---
+    ready = []
+    new_pending = {}
+    for rel, sig in sorted(found.items()):
+        rec = known.get(rel)
+        if rec is not None and [rec['mtime'], rec['size']] == list(sig):
+            continue
+        prev = pending.get(rel)
+        if now - sig[0] < debounce or (prev is not None and list(prev) != list(sig)):
+            new_pending[rel] = list(sig)
+            summary['waiting'].append(rel)
+            continue
+        ready.append(rel)
+
+    # .xls -> .xlsx (исходный .xls удаляется; .xlsx обрабатывается в этом же цикле).
+    # Неудачная конвертация запоминается в known: тот же .xls не конвертируется повторно, пока не изменится
+    xls = [rel for rel in ready if rel.lower().endswith('.xls')]
+    if xls:
+        try:
+            _require_libreoffice()
+            no_office = None
+        except RuntimeError as e:
+            no_office = str(e)
+        for rel in xls:
+            ready.remove(rel)
+            out = None if no_office else _convert_xls_file(os.path.join(root_main, rel))
+            if out is None:
+                summary['errors'].append({'file': rel, 'status': 'error',
+                                          'error': no_office or 'не удалось сконвертировать .xls'})
+                mtime, size = found[rel]
+                known[rel] = {'mtime': mtime, 'size': size, 'type': None, 'status': 'error'}
+                continue
+            st = os.stat(out)
+            found[os.path.relpath(out, root_main)] = (st.st_mtime, st.st_size)
+            ready.append(os.path.relpath(out, root_main))
+        ready = sorted(set(ready))
+
+    # --- Удалённые файлы ---
+    removed = {}
+    for rel, rec in list(known.items()):
+        if rel not in found:
+            if rec.get('type'):
+                removed.setdefault(rec['type'], []).append(rel)
+            del known[rel]
+            summary['removed'].append(rel)
+    for report_type, sources in removed.items():
+        delete_from_dataset(dataset_root, report_type, sources)
+        if store:
+            store_delete(store, report_type, sources)
+        if refresh_cube and report_type in ('STATEMENT', 'INCOME'):
+            refresh_turnover_cube(dataset_root, report_type, pd.DataFrame(columns=['SOURCE_FILE']), sources)
+    if summary['removed']:
+        state['pending'] = new_pending
+        _save_watch_state(state_path, state)
+
+    # --- Новые и изменённые файлы, пакетами ---
+    for start in range(0, len(ready), batch_size):
+        batch = ready[start:start + batch_size]
+        paths = [os.path.join(root_main, rel) for rel in batch]
+        tasks = [(_ingest_one_file, (path, root_main, all_parsers), path) for path in paths]
+        errors = []
+        results = _run_parse_tasks(tasks, f"Наблюдение: пакет {start // batch_size + 1}", max_workers,
+                                   guard=guard, errors=errors)
+        for e in errors:
+            e['file'] = os.path.relpath(e['file'], root_main)
+        failed = {e['file'] for e in errors}
+
+        frames = {report_type: [] for report_type in REPORT_TYPES}
+        stale = {}  # тип -> источники, которые больше не относятся к этому типу
+        for rel, res in zip(batch, results):
+            mtime, size = found[rel]
+            old_type = known.get(rel, {}).get('type')
+            if res is None:
+                if rel not in failed:
+                    errors.append({'file': rel, 'status': 'error', 'error': 'нет результата'})
+                known[rel] = {'mtime': mtime, 'size': size, 'type': old_type, 'status': 'error'}
+                continue
+            report_type, df = res
+            if old_type and old_type != report_type:
+                stale.setdefault(old_type, []).append(rel)
+            if report_type is None:
+                summary['unknown'].append(rel)
+            else:
+                if df is not None:
+                    frames[report_type].append(df)
+                summary['updated' if rel in known else 'added'].append(rel)
+            known[rel] = {'mtime': mtime, 'size': size, 'type': report_type,
+                          'status': 'ok' if report_type else 'unknown'}
+        summary['errors'].extend(errors)
+
+        for report_type, sources in stale.items():
+            delete_from_dataset(dataset_root, report_type, sources)
+            if store:
+                store_delete(store, report_type, sources)
+        tables = {t: _combine_report_frames(frames[t], t) for t in REPORT_TYPES if frames[t]}
+        if tables:
+            write_dataset(tables, dataset_root)
+            if store:
+                store_load(store, tables)
+            if refresh_cube:
+                for report_type in ('STATEMENT', 'INCOME'):
+                    if report_type in tables:
+                        refresh_turnover_cube(dataset_root, report_type, tables[report_type],
+                                              stale.get(report_type, ()))
+        # состояние сохраняется после каждого пакета — прерванный цикл продолжится с того же места
+        state['pending'] = new_pending
+        _save_watch_state(state_path, state)
+
+    state['pending'] = new_pending
+    _save_watch_state(state_path, state)
+    return summary
+
+def watch_folder(root_main, dataset_root, interval=60, max_cycles=None, **kwargs):
+    """
+    Долгоживущий режим: каждые interval секунд вызывает watch_once и печатает, что изменилось.
+    kwargs — параметры watch_once (subfolders, debounce, batch_size, max_workers, guard, store, refresh_cube, ...).
+    max_cycles — остановиться после заданного числа циклов (по умолчанию — до Ctrl+C).
+    Ошибка цикла (сбой диска, занятый part-файл и т.п.) печатается, и наблюдение продолжается со следующего цикла.
+    Возвращает сводку последнего успешного цикла.
+    """
+    cycle = 0
+    summary = None
+    try:
+        while max_cycles is None or cycle < max_cycles:
+            started = time.time()
+            try:
+                summary = watch_once(root_main, dataset_root, **kwargs)
+            except Exception as e:
+                print(time.strftime('%Y-%m-%d %H:%M:%S'), f'ошибка цикла наблюдения: {type(e).__name__}: {e}')
+                traceback.print_exc(limit=-3)
+            else:
+                changes = {k: len(v) for k, v in summary.items() if v}
+                if changes:
+                    print(time.strftime('%Y-%m-%d %H:%M:%S'), 'изменения:', changes)
+                    for e in summary['errors']:
+                        print(f"  ошибка: {e['file']}: {e['error']}")
+            cycle += 1
+            if max_cycles is not None and cycle >= max_cycles:
+                break
+            time.sleep(max(0.0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        print('Наблюдение остановлено')
+    return summary
+
+# Пример вызова:
+# watch_folder('/content/gdrive/MyDrive/Волгоград', '/content/gdrive/MyDrive/_dataset',
+#              subfolders=['Ведомость', 'Выручка', 'Поставщики услуг'], interval=300, debounce=60,
+#              max_workers=4, guard={'timeout': 600}, refresh_cube=True)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import json
+import shutil
+import hashlib
+
+# ----------------- Шардирование: разбор дерева выгрузок на нескольких машинах -----------------
+# Файл относится к шарду i из n по стабильному хэшу пути относительно root_main (он же SOURCE_FILE),
+# поэтому разбиение не зависит от порядка обхода, машины и числа файлов — шарды не пересекаются
+# и вместе покрывают всё дерево. Каждая машина пишет свой датасет (write_dataset), затем
+# merge_datasets собирает части в общий датасет, read_dataset которого совпадает с однопроцессным прогоном.
+
+def shard_of(source_file, n_shards):
+    """Номер шарда (0..n_shards-1) для относительного пути файла."""
+    key = source_file.replace(os.sep, '/').encode('utf-8')
+    return int.from_bytes(hashlib.sha1(key).digest()[:8], 'big') % n_shards
+
+def shard_files(files, root_main, shard):
+    """
+    Оставляет из files только файлы шарда shard=(i, n).
+    Путь хэшируется относительно root_main — так же, как формируется SOURCE_FILE.
+    """
+    i, n = shard
+    if not (isinstance(i, int) and isinstance(n, int) and 0 <= i < n):
+        raise ValueError(f'Некорректный шард {shard!r}: ожидается (i, n), 0 <= i < n')
+    return [f for f in files if shard_of(_source_file_name(f, root_main), n) == i]
+
+def merge_datasets(shard_roots, root, report_types=None):
+    """
+    Сливает Parquet-датасеты шардов в один датасет root.
+
+    Аргументы:
+        shard_roots (list): Папки датасетов, записанных каждым шардом
+        root (str): Итоговая папка датасета (может уже содержать данные — источники шардов в ней заменяются)
+        report_types (list, optional): Какие таблицы сливать (по умолчанию — все найденные в шардах)
+
+    Part-файлы копируются как есть (имена уникальны по SOURCE_FILE), манифесты объединяются.
+    Если один SOURCE_FILE встречается в нескольких шардах — ValueError (шарды пересекаются).
+    Кубы оборотов не копируются — их нужно перестроить (refresh_turnover_cube).
+    Возвращает dict {report_type: число скопированных part-файлов}.
+    """
+    if report_types is None:
+        report_types = sorted({
+            name for shard_root in shard_roots if os.path.isdir(shard_root)
+            for name in os.listdir(shard_root)
+            if os.path.exists(os.path.join(shard_root, name, '_manifest.json'))
+        })
+
+    copied = {}
+    for report_type in report_types:
+        manifests = []
+        owner = {}
+        for shard_root in shard_roots:
+            manifest = _load_manifest(os.path.join(shard_root, report_type))
+            for source in manifest:
+                if source in owner:
+                    raise ValueError(f'{report_type}: {source!r} есть и в {owner[source]}, и в {shard_root}')
+                owner[source] = shard_root
+            manifests.append((shard_root, manifest))
+
+        type_root = os.path.join(root, report_type)
+        delete_from_dataset(root, report_type, list(owner))
+        os.makedirs(type_root, exist_ok=True)
+        merged = _load_manifest(type_root)
+        copied[report_type] = 0
+        for shard_root, manifest in manifests:
+            for source, parts in manifest.items():
+                for rel in parts:
+                    dst = os.path.join(type_root, rel)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    shutil.copyfile(os.path.join(shard_root, report_type, rel), dst + '.tmp')
+                    os.replace(dst + '.tmp', dst)
+                    copied[report_type] += 1
+                merged[source] = list(parts)
+        _save_manifest(type_root, merged)
+    return copied
+
+# Пример вызова:
+# # машина k из 4:
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', max_workers=4, shard=(k, 4))
+# write_dataset(tables, f'/content/gdrive/MyDrive/_shards/{k}')
+# # после завершения всех шардов:
+# merge_datasets([f'/content/gdrive/MyDrive/_shards/{k}' for k in range(4)], '/content/gdrive/MyDrive/_dataset')
+# df_statement = read_dataset('/content/gdrive/MyDrive/_dataset', 'STATEMENT')
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import io
+import os
+import zipfile
+
+# ----------------- Источники книг: путь, bytes, file-like, файл внутри .zip -----------------
+# Парсеры и чтение шапки принимают не только путь: bytes (вложение письма), file-like объект
+# (поток из API/хранилища) и _ZipMember — ссылку на .xlsx внутри архива. Файл из архива
+# читается в память без распаковки на диск; _ZipMember передаётся в процессы пула по ссылке
+# (путь к архиву + имя), а не содержимым.
+
+class _ZipMember:
+    """Ссылка на .xlsx внутри .zip-архива (сериализуемая для пула процессов)."""
+    __slots__ = ('zip_path', 'member', 'size')
+
+    def __init__(self, zip_path, member, size=0):
+        self.zip_path = zip_path
+        self.member = member
+        self.size = size
+
+    def __getstate__(self):
+        return (self.zip_path, self.member, self.size)
+
+    def __setstate__(self, state):
+        self.zip_path, self.member, self.size = state
+
+    def __eq__(self, other):
+        return isinstance(other, _ZipMember) and (self.zip_path, self.member) == (other.zip_path, other.member)
+
+    def __hash__(self):
+        return hash((self.zip_path, self.member))
+
+    def __str__(self):
+        return f'{self.zip_path}/{self.member}'
+
+    __repr__ = __str__
+
+    def read_bytes(self):
+        with zipfile.ZipFile(self.zip_path) as zf:
+            return zf.read(self.member)
+
+def _workbook_source(src):
+    """Приводит источник книги к тому, что принимает openpyxl.load_workbook (путь или seekable file-like)."""
+    if isinstance(src, _PrefetchedFile):
+        return io.BytesIO(src.data)
+    if isinstance(src, _ZipMember):
+        return io.BytesIO(src.read_bytes())
+    if _SLOW_DISK is not None and isinstance(src, (str, os.PathLike)):
+        return io.BytesIO(_read_source_bytes(src))
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(bytes(src))
+    if hasattr(src, 'read'):
+        if getattr(src, 'seekable', lambda: False)():
+            src.seek(0)
+            return src
+        return io.BytesIO(src.read())
+    return src
+
+def _source_file_name(file, root_main):
+    """SOURCE_FILE для файла: путь относительно root_main; для файла из архива — '<архив>/<имя внутри>'."""
+    if isinstance(file, _PrefetchedFile):
+        file = file.source
+    if isinstance(file, _ZipMember):
+        return os.path.relpath(file.zip_path, root_main) + '/' + file.member
+    return os.path.relpath(file, root_main)
+
+def _source_size(file):
+    if isinstance(file, _PrefetchedFile):
+        return len(file.data)
+    if isinstance(file, _ZipMember):
+        return file.size
+    return os.path.getsize(file)
+
+def zip_workbooks(source):
+    """
+    Список .xlsx внутри архивов: source — путь к .zip или папка (все .zip в ней рекурсивно).
+    Возвращает список _ZipMember, которые можно передавать в excel_parser_* и _run_parse_tasks.
+    """
+    if os.path.isdir(source):
+        archives = sorted(
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(source)
+            for name in names
+            if name.lower().endswith('.zip')
+        )
+    else:
+        archives = [source]
+
+    members = []
+    for zip_path in archives:
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                infos = zf.infolist()
+        except (zipfile.BadZipFile, OSError) as e:
+            print(f'Не удалось открыть архив {zip_path}: {e}')
+            continue
+        for info in infos:
+            name = info.filename
+            base = name.rsplit('/', 1)[-1]
+            if info.is_dir() or name.startswith('__MACOSX/') or base.startswith('~$'):
+                continue
+            if base.lower().endswith('.xlsx'):
+                members.append(_ZipMember(zip_path, name, info.file_size))
+    return members
+
+# Пример вызова:
+# df = excel_parser_STATEMENT(attachment_bytes)                 # bytes из письма
+# df = parse_statement_folder(root, 'Ведомость', excel_parser_STATEMENT, include_zip=True)
+# tables = ingest_folder(root, include_zip=True, max_workers=4)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import re
+import datetime as _dt
+import pandas as pd
+
+# ----------------- Polars-бэкенд: постобработка парсеров и объединение таблиц в Polars -----------------
+# backend='polars' в excel_parser_* и parse_*_folder: чтение листа (openpyxl) остаётся прежним,
+# а вся постобработка (переименования, «итого», даты, чистка текста) и объединение файлов
+# выполняются выражениями Polars — результат сразу pl.DataFrame (или pl.LazyFrame при
+# backend='polars-lazy') без промежуточного pandas.
+# Отличия от pandas-результата: текстовые столбцы — pl.Utf8 (числа в текстовых полях приводятся
+# к строке), списки Doc/AnDT/AnCR — pl.List(pl.Utf8), Date в SUPPLIERS — pl.Date.
+
+POLARS_BACKENDS = ('polars', 'polars-lazy')
+
+def _require_polars():
+    try:
+        import polars  # noqa: F401
+    except ImportError:
+        raise ImportError('Для backend="polars" нужен polars: pip install polars')
+    return polars
+
+def _check_backend(backend):
+    if backend != 'pandas' and backend not in POLARS_BACKENDS:
+        raise ValueError(f"Неизвестный backend: {backend!r} (ожидается 'pandas', 'polars' или 'polars-lazy')")
+
+def _pl_text(v):
+    return None if v is None else str(v)
+
+def _pl_number(v):
+    """Число из ячейки, как pd.to_numeric(errors='coerce'): иначе None."""
+    if v is None or isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return None if v != v else float(v)
+    try:
+        return float(str(v).strip())
+    except ValueError:
+        return None
+
+def _pl_rows_frame(rows, columns, numeric=('Value',)):
+    """pl.DataFrame из списка словарей парсера: текстовые столбцы -> Utf8, numeric -> Float64."""
+    pl = _require_polars()
+    data = {}
+    for key in columns:
+        name = '' if key is None else key
+        if key in numeric:
+            data[name] = pl.Series(name, [_pl_number(r.get(key)) for r in rows], dtype=pl.Float64)
+        else:
+            data[name] = pl.Series(name, [_pl_text(r.get(key)) for r in rows], dtype=pl.Utf8)
+    return pl.DataFrame(data)
+
+def _pl_clean_spaces(col):
+    """Выражение: пробелы по краям убираются, внутренние схлопываются; '', 'nan', 'none' -> null."""
+    pl = _require_polars()
+    s = pl.col(col).cast(pl.Utf8).str.strip_chars().str.replace_all(r'\s+', ' ')
+    return pl.when(s.str.to_lowercase().is_in(['nan', 'none', ''])).then(None).otherwise(s).alias(col)
+
+def _statement_period_date(period_text):
+    """Дата строки ОСВ: первое число месяца, следующего за периодом 'Февраль 2025'."""
+    text = str(period_text).strip().replace('\xa0', ' ')
+    match = re.search(r'([а-яё]+)\s*(\d{4})', text.lower())
+    if match and match.group(1) in _MONTHS_RU:
+        return _first_day_of_next_month(_dt.datetime(int(match.group(2)), _MONTHS_RU[match.group(1)], 1)).to_pydatetime()
+    return pd.Timestamp(period_text).to_pydatetime()
+
+def _statement_polars(rows_data, level_names, rename=None):
+    """Постобработка строк excel_parser_STATEMENT в Polars (тот же порядок шагов, что в pandas-ветке)."""
+    pl = _require_polars()
+    if not rows_data:
+        raise ValueError('В ведомости нет строк с данными')
+
+    df = _pl_rows_frame(rows_data, list(rows_data[0]))
+
+    if 'Счет, Наименование счета' in df.columns:
+        df = df.rename({'Счет, Наименование счета': 'Счет'}).with_columns(
+            pl.col('Счет').fill_null('None').str.splitn(',', 2).struct.field('field_0').str.strip_chars().alias('Счет'))
+
+    # уровень без названия (A8 пуст) переносится в sublevel
+    if not level_names['detail'] and level_names['sublevel'] and '' in df.columns:
+        sub = level_names['sublevel']
+        df = df.with_columns(pl.coalesce(pl.col(sub), pl.col(''))).drop('')
+
+    df = df.with_columns(pl.lit(_statement_period_date(rows_data[0]['Period']), dtype=pl.Datetime('ns')).alias('Period'))
+
+    rename_dict = STATEMENT_RENAME if rename is None else rename
+    df = df.rename({k: v for k, v in rename_dict.items() if k in df.columns})
+
+    for col in ('Category', 'Type', 'Document'):
+        if col not in df.columns:
+            df = df.with_columns(pl.lit(None, dtype=pl.Utf8).alias(col))
+
+    # «итого»: название итога -> Category, в Счет — единственный счёт файла (или '76')
+    if 'Счет' in df.columns:
+        is_itogo = pl.col('Счет').str.to_lowercase().str.contains('итого').fill_null(False)
+        unique_accounts = df.filter(~is_itogo)['Счет'].drop_nulls().unique(maintain_order=True).to_list()
+        if len(unique_accounts) == 1:
+            account_value = unique_accounts[0]
+        elif '76' in unique_accounts:
+            account_value = '76'
+        else:
+            account_value = None
+        df = df.with_columns(
+            pl.when(is_itogo).then(pl.col('Счет')).otherwise(pl.col('Category')).alias('Category'),
+            pl.when(is_itogo).then(pl.lit(account_value, dtype=pl.Utf8)).otherwise(pl.col('Счет')).alias('Счет'),
+        )
+
+    desired_order = ['Date', 'Company', 'Estate', 'Type', 'Category',
+                     'Partner', 'Contract', 'Document', 'Bank Account', 'Value']
+    columns_in_order = [col for col in desired_order if col in df.columns]
+    df = df.select(columns_in_order + [col for col in df.columns if col not in columns_in_order])
+
+    df = df.with_columns([_pl_clean_spaces(c) for c in ('Estate', 'Category', 'Contract', 'Bank Account') if c in df.columns])
+    return df.with_columns(pl.col('Category').replace({'Аренда помещения': 'Аренда помещений'}))
+
+def _income_polars(rows_data, report_date):
+    """Постобработка строк excel_parser_INCOME в Polars (тот же порядок шагов, что в pandas-ветке)."""
+    pl = _require_polars()
+    columns = ['Date', 'Category', 'Company', 'Estate', 'Document', 'Contract', 'Partner', 'Value']
+    # Value чистится от пробелов/запятых как текст — поэтому сначала оставляем его строкой
+    df = _pl_rows_frame(rows_data, columns, numeric=())
+    df = df.with_columns(pl.lit(report_date, dtype=pl.Utf8).str.to_datetime('%Y-%m-%d', time_unit='ns').alias('Date'))
+
+    is_itogo = (pl.col('Document') == 'Итого:').fill_null(False)
+    df = df.with_columns(
+        pl.when(is_itogo).then(pl.lit('Итого за месяц')).otherwise(pl.col('Category')).alias('Category'),
+        *[pl.when(is_itogo).then(None).otherwise(pl.col(c)).alias(c) for c in ('Company', 'Estate', 'Document')],
+    )
+    df = df.filter(~pl.all_horizontal(pl.col(['Company', 'Document', 'Partner', 'Value']).is_null()))
+
+    df = df.with_columns(
+        pl.lit('Доходы').alias('Type'),
+        pl.col('Value').str.replace_all(' ', '', literal=True).str.replace_all(',', '.', literal=True)
+          .cast(pl.Float64, strict=False).alias('Value'),
+    ).select(['Date', 'Company', 'Estate', 'Type', 'Category', 'Partner', 'Contract', 'Document', 'Value'])
+
+    unique_companies = df['Company'].drop_nulls().unique()
+    if len(unique_companies) == 1:
+        df = df.with_columns(pl.col('Company').fill_null(unique_companies[0]))
+
+    df = df.with_columns(pl.lit('Данные по выручке').alias('Счет'))
+    df = df.with_columns([_pl_clean_spaces(c) for c in ('Estate', 'Category', 'Contract', 'Document')])
+    return df.with_columns(pl.col('Category').replace({'Аренда помещения': 'Аренда помещений'}))
+
+def _suppliers_polars(out):
+    """Постобработка строк excel_parser_SUPPLIERS в Polars: списки -> List(Utf8), Date -> pl.Date."""
+    pl = _require_polars()
+    schema = {'Date': pl.Date, 'Company': pl.Utf8, 'Doc': pl.List(pl.Utf8), 'AnDT': pl.List(pl.Utf8),
+              'AnCR': pl.List(pl.Utf8), 'DtCr': pl.Utf8, 'Счет': pl.Utf8, 'Value': pl.Float64}
+    df = pl.DataFrame({col: [r[col] for r in out] for col in schema}, schema=schema)
+    clean = {c: pl.col(c).str.replace_all(r'\s+', ' ').str.strip_chars() for c in ('Company', 'Счет')}
+    return df.with_columns([pl.when(e == '').then(None).otherwise(e).alias(c) for c, e in clean.items()])
+
+def _polars_schema_dtype(pl, col, dtype):
+    if col == 'Date' and dtype == 'object':
+        return pl.Date
+    if col in ('Doc', 'AnDT', 'AnCR'):
+        return pl.List(pl.Utf8)
+    if dtype == 'datetime64[ns]':
+        return pl.Datetime('ns')
+    if dtype == 'float64':
+        return pl.Float64
+    return pl.Utf8
+
+def _combine_report_frames_polars(frames, report_type, extra_columns='keep'):
+    """Объединение пофайловых pl.DataFrame по схеме REPORT_SCHEMAS[report_type] (аналог _combine_report_frames)."""
+    pl = _require_polars()
+    schema = {col: _polars_schema_dtype(pl, col, dtype) for col, dtype in REPORT_SCHEMAS[report_type].items()}
+    frames = [df for df in frames if df is not None]
+
+    extras_seen = {}
+    conformed = []
+    for df in frames:
+        extras = [col for col in df.columns if col not in schema]
+        for col in extras:
+            extras_seen.setdefault(col, []).append(df['SOURCE_FILE'][0] if df.height else None)
+        exprs = [(pl.col(col).cast(dtype, strict=False) if col in df.columns else pl.lit(None, dtype=dtype)).alias(col)
+                 for col, dtype in schema.items()]
+        keep = [c for c in extras if extra_columns == 'keep' or c == SHEET_COLUMN]
+        conformed.append(df.select(exprs + [pl.col(c).cast(pl.Utf8, strict=False) for c in keep]))
+
+    reported = {col: files for col, files in extras_seen.items() if col != SHEET_COLUMN}
+    if reported:
+        print(f'Столбцы вне схемы {report_type}:')
+        for col, files in reported.items():
+            print(f'  {col!r}: {len(files)} файл(ов), например {files[0]}')
+
+    if not conformed:
+        return pl.DataFrame(schema=schema)
+    return pl.concat(conformed, how='diagonal')
+
+def _filter_rows_polars(df, date_from=None, date_to=None, companies=None):
+    """Аналог filter_rows_by_period_company для pl.DataFrame."""
+    pl = _require_polars()
+    date_from, date_to, companies = _normalize_filters(date_from, date_to, companies)
+    if df.height == 0 or (date_from is None and date_to is None and not companies):
+        return df
+
+    cond = pl.lit(True)
+    if (date_from is not None or date_to is not None) and 'Date' in df.columns:
+        date = pl.col('Date').cast(pl.Datetime('ns'))
+        if date_from is not None:
+            cond &= date.is_null() | (date >= date_from.to_pydatetime())
+        if date_to is not None:
+            cond &= date.is_null() | (date <= date_to.to_pydatetime())
+    if companies and 'Company' in df.columns:
+        uniq = df['Company'].drop_nulls().unique().to_list()
+        keep = [c for c in uniq if (normalize_company_names(c) or '').upper() in companies]
+        cond &= pl.col('Company').is_null() | pl.col('Company').is_in(keep)
+    return df.filter(cond)
+
+def _finish_report_polars(frames, report_type, backend, date_from, date_to, companies, store):
+    """Общий хвост parse_*_folder для Polars-бэкенда: объединение, фильтр строк, хранилище, lazy."""
+    df = _combine_report_frames_polars(frames, report_type)
+    df = _filter_rows_polars(df, date_from, date_to, companies)
+    if store:
+        store_load(store, df.to_pandas(), report_type)
+    return df.lazy() if backend == 'polars-lazy' else df
+
+# Пример вызова:
+# df = parse_statement_folder(root, 'Ведомость', excel_parser_STATEMENT, backend='polars', max_workers=4)
+# df.group_by(['Company', 'Показатель', 'Дебет/Кредит']).agg(pl.col('Value').sum())
+# lf = parse_income_folder(root, 'Выручка', excel_parser_INCOME, backend='polars-lazy')
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import re
+import json
+import pickle
+import hashlib
+import pandas as pd
+
+# ----------------- Ленивый конвейер: convert -> parse -> normalize -> enrich со слиянием по файлам -----------------
+# Pipeline записывает шаги и ничего не выполняет до run(). При запуске работа по каждому файлу
+# слита в одну задачу пула: файл парсится, приводится к схеме, нормализуется и обогащается,
+# пока он «горячий», — без промежуточных полных таблиц и их копий. Объединение — один раз в конце.
+#
+# Кэш (cache_dir): результат по каждому файлу сохраняется вместе с отпечатком входов —
+# (mtime, размер) файла, код парсера и шагов вместе со всеми вызываемыми ими функциями
+# и таблицами-константами модуля (схемы), параметры шагов, хэш справочников обогащения.
+# Если отпечаток совпал, файл не парсится; если изменились только справочники — файл
+# не парсится заново, а только переобогащается из сохранённого результата парсинга.
+
+PIPELINE_FOLDERS = {'STATEMENT': 'Ведомость', 'INCOME': 'Выручка', 'SUPPLIERS': 'Поставщики услуг'}
+PIPELINE_PARSERS = {
+    'STATEMENT': excel_parser_STATEMENT,
+    'INCOME': excel_parser_INCOME,
+    'SUPPLIERS': excel_parser_SUPPLIERS,
+}
+
+def _value_token(obj, funcs):
+    """
+    Значение -> представление, одинаковое от сессии к сессии (порядок множеств, адреса объектов
+    не влияют). Найденные внутри функции добавляются в funcs — их код тоже входит в отпечаток.
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool, bytes)):
+        return obj
+    if isinstance(obj, dict):
+        return sorted(([_value_token(k, funcs), _value_token(v, funcs)] for k, v in obj.items()), key=repr)
+    if isinstance(obj, (list, tuple)):
+        return [_value_token(v, funcs) for v in obj]
+    if isinstance(obj, (set, frozenset)):
+        return sorted((_value_token(v, funcs) for v in obj), key=repr)
+    if isinstance(obj, re.Pattern):
+        return [obj.pattern, obj.flags]
+    if callable(obj):
+        funcs.append(obj)
+    return f'{getattr(obj, "__module__", "")}.{getattr(obj, "__qualname__", type(obj).__name__)}'
+
+def _code_digest(code, h, names):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            _code_digest(const, h, names)
+        else:
+            h.update(repr(_value_token(const, [])).encode())
+
+def _func_fingerprint(func):
+    """
+    Отпечаток функции: имя + байткод и константы — её и всех функций, классов и таблиц-констант
+    (схемы и т.п.) того же модуля, к которым она обращается по имени, транзитивно.
+    Изменение парсера или любого его помощника сбрасывает кэш.
+    """
+    h = hashlib.sha1()
+    seen = set()
+    stack = [func]
+    while stack:
+        f = stack.pop()
+        f = getattr(f, '__func__', f)
+        if id(f) in seen:
+            continue
+        seen.add(id(f))
+        h.update(f'{getattr(f, "__module__", "")}.{getattr(f, "__qualname__", repr(f))}'.encode())
+        if isinstance(f, type):
+            stack.extend(v for _, v in sorted(vars(f).items()) if hasattr(getattr(v, '__func__', v), '__code__'))
+            continue
+        code = getattr(f, '__code__', None)
+        if code is None:
+            continue
+        names = set()
+        _code_digest(code, h, names)
+        module_globals = getattr(f, '__globals__', {})
+        found = []
+        for name in sorted(names):
+            if name not in module_globals:
+                continue
+            obj = module_globals[name]
+            if getattr(obj, '__globals__', None) is module_globals:
+                found.append(obj)
+            elif isinstance(obj, type) and obj.__module__ == module_globals.get('__name__'):
+                found.append(obj)
+            elif isinstance(obj, (dict, list, tuple, set, frozenset, str, int, float, re.Pattern)):
+                funcs = []
+                h.update(f'{name}={_value_token(obj, funcs)!r}'.encode())
+                found.extend(x for x in funcs if getattr(x, '__globals__', None) is module_globals)
+            elif callable(obj):
+                h.update(f'{name}={_value_token(obj, [])}'.encode())  # функция другого модуля — по имени
+        stack.extend(reversed(found))
+    return h.hexdigest()
+
+def _file_signature(file):
+    if isinstance(file, _ZipMember):
+        st = os.stat(file.zip_path)
+        return [st.st_mtime, st.st_size, file.member]
+    st = os.stat(file)
+    return [st.st_mtime, st.st_size]
+
+def _digest(*parts):
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _cache_get(path, key):
+    try:
+        with open(path, 'rb') as f:
+            stored_key, df = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return df if stored_key == key else None
+
+def _cache_put(path, key, df):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump((key, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+def _normalize_columns(df, columns):
+    for col in columns:
+        if col in df.columns:
+            mapping = {v: normalize_company_names(v) for v in df[col].dropna().unique()}
+            df[col] = [mapping.get(v) if v is not None and v == v else None for v in df[col]]
+    return df
+
+def _pipeline_file_task(file, root_main, report_type, spec, terms, cache_dir):
+    """
+    Слитая работа по одному файлу: parse -> схема -> фильтр строк -> normalize -> enrich.
+    Возвращает (df, status): status — 'parsed' | 'enriched' (только переобогащение) | 'cached'.
+    """
+    source = _source_file_name(file, root_main)
+    parse_key = _digest(_file_signature(file), source, spec['parser'], spec['steps'], spec['filters'], spec['normalize'])
+    enrich_key = _digest(parse_key, spec['enrich'], _digest(terms)) if spec['enrich'] else None
+    cache_base = os.path.join(cache_dir, report_type, _source_key(source)) if cache_dir else None
+
+    if cache_base and enrich_key:
+        df = _cache_get(cache_base + '.enriched.pkl', enrich_key)
+        if df is not None:
+            return df, 'cached'
+
+    df = _cache_get(cache_base + '.parsed.pkl', parse_key) if cache_base else None
+    status = 'enriched'
+    if df is None:
+        status = 'parsed'
+        df = _parse_one_file(file, root_main, spec['parser_func'])
+        df, _ = conform_to_schema(df, report_type)
+        df = filter_rows_by_period_company(df, *spec['filters'])
+        _normalize_columns(df, spec['normalize'])
+        if cache_base:
+            _cache_put(cache_base + '.parsed.pkl', parse_key, df)
+    elif not enrich_key:
+        return df, 'cached'
+
+    if enrich_key:
+        df = enrich_suppliers_semantics(df, terms=terms, copy=False,
+                                        show_progress=False, **spec['enrich_kwargs'])
+        if cache_base:
+            _cache_put(cache_base + '.enriched.pkl', enrich_key, df)
+    return df, status
+
+class Pipeline:
+    """
+    Декларативный конвейер обработки выгрузок. Шаги записываются и выполняются только в run():
+
+        p = (Pipeline(root_main, cache_dir='/content/_cache')
+             .convert()
+             .parse('STATEMENT')
+             .parse('SUPPLIERS')
+             .normalize(['Company'])
+             .enrich(root_estate_dictionary, category_source='STATEMENT'))
+        print(p.explain())
+        tables = p.run(max_workers=4)      # {'STATEMENT': df, 'SUPPLIERS': df}
+
+    Результат каждой таблицы совпадает с ручной цепочкой parse_*_folder -> normalize_company_names
+    -> enrich_suppliers_semantics, но каждый файл проходит все шаги в одной задаче пула.
+    """
+
+    def __init__(self, root_main, cache_dir=None):
+        self.root_main = root_main
+        self.cache_dir = cache_dir
+        self._convert = False
+        self._parse = {}          # report_type -> параметры parse
+        self._normalize = []      # столбцы для normalize_company_names
+        self._enrich = None       # параметры enrich (только SUPPLIERS)
+        self.last_run = None
+
+    # ---------- запись шагов ----------
+    def convert(self):
+        """Конвертировать .xls -> .xlsx в папках отчётов (если .xls нет — шаг пропускается)."""
+        self._convert = True
+        return self
+
+    def parse(self, report_type, subfolder=None, parser_func=None,
+              date_from=None, date_to=None, companies=None, include_zip=False):
+        """Парсить отчёты report_type из root_main/subfolder (по умолчанию — стандартная папка отчёта)."""
+        if report_type not in PIPELINE_FOLDERS:
+            raise ValueError(f'Неизвестный тип отчёта: {report_type}')
+        self._parse[report_type] = {
+            'subfolder': subfolder or PIPELINE_FOLDERS[report_type],
+            'parser_func': parser_func or PIPELINE_PARSERS[report_type],
+            'filters': (date_from, date_to, companies),
+            'include_zip': include_zip,
+        }
+        return self
+
+    def normalize(self, columns=('Company',)):
+        """Нормализовать названия компаний (normalize_company_names) в столбцах columns."""
+        self._normalize = list(dict.fromkeys(list(self._normalize) + list(columns)))
+        return self
+
+    def enrich(self, root_estate_dictionary, category_source='STATEMENT', category_source_col='Category',
+               normalize_company_fn=None):
+        """
+        Обогатить SUPPLIERS (enrich_suppliers_semantics).
+        category_source — DataFrame-справочник категорий или тип(ы) отчёта этого же конвейера.
+        """
+        self._enrich = {
+            'root_estate_dictionary': root_estate_dictionary,
+            'category_source': category_source,
+            'category_source_col': category_source_col,
+            'normalize_company_fn': normalize_company_fn,
+        }
+        return self
+
+    # ---------- план ----------
+    def _category_source_types(self):
+        src = self._enrich['category_source'] if self._enrich else None
+        if isinstance(src, str):
+            return [src]
+        if isinstance(src, (list, tuple)):
+            return list(src)
+        return []
+
+    def _phases(self):
+        """Фазы: сначала таблицы без обогащения (в т.ч. источники справочника), затем SUPPLIERS с обогащением."""
+        if self._enrich and 'SUPPLIERS' not in self._parse:
+            raise ValueError('enrich() требует parse("SUPPLIERS")')
+        missing = [t for t in self._category_source_types() if t not in self._parse]
+        if missing:
+            raise ValueError(f'Справочник категорий из {missing}, но эти отчёты не парсятся в конвейере')
+        enriched = ['SUPPLIERS'] if self._enrich else []
+        first = [t for t in REPORT_TYPES if t in self._parse and t not in enriched]
+        return [p for p in (first, enriched) if p]
+
+    def explain(self):
+        """Текстовый план выполнения."""
+        lines = ['План конвейера:']
+        n = 1
+        if self._convert:
+            folders = ', '.join(self._parse[t]['subfolder'] for t in REPORT_TYPES if t in self._parse)
+            lines.append(f'  {n}. convert: .xls -> .xlsx в {folders} (пропуск, если .xls нет)')
+            n += 1
+        for phase in self._phases():
+            if self._enrich and phase == ['SUPPLIERS']:
+                src = self._enrich['category_source']
+                src = src if isinstance(src, (str, list, tuple)) else 'DataFrame'
+                lines.append(f'  {n}. справочники enrich: объекты из словаря, Category из {src}')
+                n += 1
+            for t in phase:
+                steps = ['parse', 'schema']
+                if any(self._parse[t]['filters']):
+                    steps.append('filter')
+                if self._normalize:
+                    steps.append(f"normalize[{', '.join(self._normalize)}]")
+                if self._enrich and t == 'SUPPLIERS':
+                    steps.append('enrich')
+                lines.append(f"  {n}. {t} ({self._parse[t]['subfolder']}): {' -> '.join(steps)}  [по файлам, слито]")
+            n += 1
+        lines.append(f'  {n}. объединение таблиц по схеме')
+        if self.cache_dir:
+            lines.append(f'  кэш по файлам: {self.cache_dir}')
+        return '\n'.join(lines)
+
+    # ---------- выполнение ----------
+    def _list_files(self, report_type):
+        opts = self._parse[report_type]
+        base_dir = os.path.join(self.root_main, opts['subfolder'])
+        files = sorted(glob.glob(os.path.join(base_dir, '**', '*.xlsx'), recursive=True))
+        if opts['include_zip']:
+            files = sorted(files + zip_workbooks(base_dir), key=str)
+        if any(x is not None for x in opts['filters']):
+            files = filter_files_by_header(files, report_type, *opts['filters'])
+        return files
+
+    def _spec(self, report_type):
+        opts = self._parse[report_type]
+        enrich = self._enrich if (self._enrich and report_type == 'SUPPLIERS') else None
+        return {
+            'parser_func': opts['parser_func'],
+            'parser': _func_fingerprint(opts['parser_func']),
+            'steps': [_func_fingerprint(f) for f in (_parse_one_file, conform_to_schema,
+                                                     filter_rows_by_period_company, _normalize_columns)],
+            'filters': opts['filters'],
+            'normalize': self._normalize,
+            'enrich': [_func_fingerprint(enrich_suppliers_semantics),
+                       _func_fingerprint(enrich['normalize_company_fn']) if enrich['normalize_company_fn'] else None]
+                      if enrich else None,
+            'enrich_kwargs': {'normalize_company_fn': enrich['normalize_company_fn']} if enrich else {},
+        }
+
+    def _terms(self, tables):
+        src = self._enrich['category_source']
+        if isinstance(src, pd.DataFrame):
+            category_df = src
+        else:
+            col = self._enrich['category_source_col']
+            category_df = pd.concat([tables[t][[col]] for t in self._category_source_types() if col in tables[t].columns],
+                                    ignore_index=True) if self._category_source_types() else None
+        return load_enrich_terms(self._enrich['root_estate_dictionary'], category_df,
+                                 self._enrich['category_source_col'])
+
+    def run(self, max_workers=None, executor='process', guard=None, transfer='auto'):
+        """
+        Выполняет план. executor: 'process' | 'thread'; max_workers=None — последовательно;
+        guard — защищённый режим, как в parse_*_folder; transfer — как процессы возвращают
+        таблицы файлов (см. _transfer_task).
+        Возвращает dict {report_type: DataFrame}; статистика по файлам — в self.last_run.
+        """
+        if self._convert:
+            for t in self._parse:
+                base_dir = os.path.join(self.root_main, self._parse[t]['subfolder'])
+                xls = [y for x in os.walk(base_dir) for y in glob.glob(os.path.join(x[0], '*.xls'))]
+                if xls:
+                    _require_libreoffice()
+                    for path in xls:
+                        _convert_xls_file(path)
+
+        tables = {}
+        stats = {'parsed': 0, 'enriched': 0, 'cached': 0, 'failed': 0}
+        errors = []
+        for phase in self._phases():
+            terms = self._terms(tables) if (self._enrich and phase == ['SUPPLIERS']) else None
+            tasks, owners = [], []
+            for t in phase:
+                spec = self._spec(t)
+                for f in self._list_files(t):
+                    tasks.append((_pipeline_file_task, (f, self.root_main, t, spec, terms, self.cache_dir), f))
+                    owners.append(t)
+            results = _run_parse_tasks(tasks, 'Конвейер: ' + ', '.join(phase), max_workers, executor,
+                                       guard=guard, errors=errors, transfer=transfer)
+            frames = {t: [] for t in phase}
+            for t, res in zip(owners, results):
+                if res is None:
+                    stats['failed'] += 1
+                    continue
+                df, status = res
+                stats[status] += 1
+                frames[t].append(df)
+            for t in phase:
+                schema = 'SUPPLIERS_ENRICHED' if (self._enrich and t == 'SUPPLIERS') else t
+                tables[t] = _combine_report_frames(frames[t], schema)
+
+        self.last_run = dict(stats, errors=errors)
+        print('Конвейер: ' + ', '.join(f'{k}={v}' for k, v in stats.items()))
+        for df in tables.values():
+            _attach_parse_errors(df, errors)
+        _write_parse_report(errors, guard)
+        return tables
+
+# Пример вызова:
+# p = (Pipeline('/content/gdrive/MyDrive/Волгоград', cache_dir='/content/gdrive/MyDrive/_cache')
+#      .convert().parse('STATEMENT').parse('SUPPLIERS').normalize(['Company'])
+#      .enrich('/content/gdrive/MyDrive/Волгоград/Объекты.xlsx', category_source='STATEMENT'))
+# print(p.explain())
+# tables = p.run(max_workers=4)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import datetime as _dt
+import numpy as np
+import pandas as pd
+
+# ----------------- Выгрузка объединённых таблиц в Excel потоком (constant memory) -----------------
+# export_xlsx пишет строки по порядку в режиме constant_memory (xlsxwriter) — в памяти держится
+# только текущая строка листа, а таблица читается кусками по chunk_size строк. При превышении
+# лимита Excel (1 048 576 строк) таблица продолжается на листе 'STATEMENT (2)', 'STATEMENT (3)', ...
+# Форматы (дата, число, перенос текста) задаются один раз на столбец через set_column.
+# Без xlsxwriter используется openpyxl в режиме write_only (медленнее, формат дат — на ячейку).
+
+EXCEL_MAX_ROWS = 1_048_576
+_XLSX_LIST_COLUMNS = ('Doc', 'AnDT', 'AnCR', 'temp')
+
+def _xlsx_column_kind(series):
+    """'number' | 'datetime' | 'list' | 'object' — как писать столбец."""
+    dtype = str(series.dtype)
+    if series.name in _XLSX_LIST_COLUMNS or dtype.startswith('list'):
+        return 'list'
+    if dtype.startswith(('datetime', 'Datetime', 'Date')):
+        return 'datetime'
+    if dtype.startswith(('float', 'int', 'uint', 'Float', 'Int', 'UInt')):
+        return 'number'
+    if dtype == 'object' and pd.api.types.infer_dtype(series, skipna=True) in ('date', 'datetime'):
+        return 'datetime'  # datetime.date / datetime в object-столбце (Date у SUPPLIERS)
+    return 'object'
+
+def _xlsx_chunks(df, chunk_size):
+    """Куски таблицы (pandas или polars) как {столбец: list значений}."""
+    is_pandas = isinstance(df, pd.DataFrame)
+    n = len(df)
+    for start in range(0, n, chunk_size):
+        part = df.iloc[start:start + chunk_size] if is_pandas else df.slice(start, chunk_size)
+        yield [part[col].tolist() if is_pandas else part[col].to_list() for col in df.columns]
+
+def _xlsx_value(v, kind):
+    """Значение ячейки для записи: None — пропустить ячейку."""
+    if v is None:
+        return None
+    if kind == 'list':
+        if isinstance(v, (list, tuple, np.ndarray)):
+            return '\n'.join(str(x) for x in v)
+        return None if (isinstance(v, float) and v != v) else str(v)
+    if isinstance(v, float):
+        return None if v != v or v in (float('inf'), float('-inf')) else v
+    if isinstance(v, (int, np.integer, np.floating, bool)):
+        return v
+    if v is pd.NaT:
+        return None
+    if isinstance(v, (_dt.datetime, _dt.date)):
+        return v
+    return str(v)
+
+def _xlsx_sheet_names(name, n_rows, rows_per_sheet):
+    n_sheets = max(1, -(-n_rows // rows_per_sheet))
+    base = str(name)[:31]
+    return [base if i == 0 else f'{base[:31 - len(f" ({i + 1})")]} ({i + 1})' for i in range(n_sheets)]
+
+def _xlsx_widths(df, sample=1000):
+    widths = []
+    for col in df.columns:
+        head = df[col].head(sample) if isinstance(df, pd.DataFrame) else df[col].head(sample).to_pandas()
+        lens = [len(str(v).split('\n')[0]) for v in head.tolist() if v is not None]
+        widths.append(min(max([len(str(col))] + lens) + 2, 60))
+    return widths
+
+def export_xlsx(tables, path, report_type=None, date_format='dd.mm.yyyy', number_format='#,##0.00',
+                rows_per_sheet=EXCEL_MAX_ROWS - 1, chunk_size=50_000, engine='auto'):
+    """
+    Выгружает объединённые таблицы в .xlsx потоком, с постоянным расходом памяти.
+
+    Аргументы:
+        tables (dict | DataFrame): {'STATEMENT': df, 'INCOME': df, 'SUPPLIERS': df} или одна таблица
+                                   (pandas или polars); имя листа — ключ словаря / report_type
+        path (str): Путь к .xlsx
+        date_format, number_format (str): Форматы столбцов дат и чисел
+        rows_per_sheet (int): Строк данных на лист (по умолчанию — лимит Excel минус заголовок)
+        chunk_size (int): Сколько строк таблицы разворачивать в Python за раз
+        engine (str): 'auto' | 'xlsxwriter' | 'openpyxl'
+
+    Списки (Doc/AnDT/AnCR) пишутся текстом через перевод строки, столбец — с переносом текста.
+    Возвращает dict {имя листа: число строк данных}.
+    """
+    if not isinstance(tables, dict):
+        tables = {report_type or 'Data': tables}
+    if engine == 'auto':
+        try:
+            import xlsxwriter  # noqa: F401
+            engine = 'xlsxwriter'
+        except ImportError:
+            engine = 'openpyxl'
+    writer = _export_xlsx_xlsxwriter if engine == 'xlsxwriter' else _export_xlsx_openpyxl
+    return writer(tables, path, date_format, number_format, rows_per_sheet, chunk_size)
+
+def _export_xlsx_xlsxwriter(tables, path, date_format, number_format, rows_per_sheet, chunk_size):
+    import xlsxwriter
+
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_numbers': False,
+                                    'strings_to_formulas': False, 'strings_to_urls': False})
+    header_fmt = wb.add_format({'bold': True, 'text_wrap': True, 'valign': 'top'})
+    col_formats = {
+        'datetime': wb.add_format({'num_format': date_format}),
+        'number': wb.add_format({'num_format': number_format}),
+        'list': wb.add_format({'text_wrap': True, 'valign': 'top'}),
+        'object': None,
+    }
+    written = {}
+    try:
+        for name, df in tables.items():
+            if df is None:
+                continue
+            columns = list(df.columns)
+            kinds = [_xlsx_column_kind(df[col]) for col in columns]
+            widths = _xlsx_widths(df)
+            sheet_names = _xlsx_sheet_names(name, len(df), rows_per_sheet)
+
+            def new_sheet(sheet_name):
+                ws = wb.add_worksheet(sheet_name)
+                for j, (kind, width) in enumerate(zip(kinds, widths)):
+                    ws.set_column(j, j, width, col_formats[kind])
+                ws.freeze_panes(1, 0)
+                ws.autofilter(0, 0, 0, max(len(columns) - 1, 0))
+                ws.write_row(0, 0, [str(c) for c in columns], header_fmt)
+                written[sheet_name] = 0
+                return ws
+
+            sheet_idx = 0
+            ws = new_sheet(sheet_names[0])
+            row = 1
+            for cols in _xlsx_chunks(df, chunk_size):
+                n = len(cols[0]) if cols else 0
+                for i in range(n):
+                    if row > rows_per_sheet:
+                        sheet_idx += 1
+                        ws = new_sheet(sheet_names[sheet_idx])
+                        row = 1
+                    for j, kind in enumerate(kinds):
+                        v = _xlsx_value(cols[j][i], kind)
+                        if v is None:
+                            continue
+                        if isinstance(v, str):
+                            ws.write_string(row, j, v)
+                        elif isinstance(v, (_dt.datetime, _dt.date)):
+                            ws.write_datetime(row, j, v, col_formats['datetime'])
+                        elif isinstance(v, (bool, np.bool_)):
+                            ws.write_boolean(row, j, bool(v))
+                        else:
+                            ws.write_number(row, j, float(v))
+                    written[ws.get_name()] += 1
+                    row += 1
+    finally:
+        wb.close()
+    return written
+
+def _export_xlsx_openpyxl(tables, path, date_format, number_format, rows_per_sheet, chunk_size):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Font
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    wrap = Alignment(wrap_text=True, vertical='top')
+    written = {}
+    for name, df in tables.items():
+        if df is None:
+            continue
+        columns = list(df.columns)
+        kinds = [_xlsx_column_kind(df[col]) for col in columns]
+        widths = _xlsx_widths(df)
+        sheet_names = _xlsx_sheet_names(name, len(df), rows_per_sheet)
+
+        def new_sheet(sheet_name):
+            ws = wb.create_sheet(sheet_name)
+            for j, width in enumerate(widths):
+                ws.column_dimensions[get_column_letter(j + 1)].width = width
+            ws.freeze_panes = 'A2'
+            header = []
+            for c in columns:
+                cell = WriteOnlyCell(ws, value=str(c))
+                cell.font = Font(bold=True)
+                header.append(cell)
+            ws.append(header)
+            written[sheet_name] = 0
+            return ws
+
+        sheet_idx = 0
+        ws = new_sheet(sheet_names[0])
+        row = 1
+        for cols in _xlsx_chunks(df, chunk_size):
+            n = len(cols[0]) if cols else 0
+            for i in range(n):
+                if row > rows_per_sheet:
+                    sheet_idx += 1
+                    ws = new_sheet(sheet_names[sheet_idx])
+                    row = 1
+                values = []
+                for j, kind in enumerate(kinds):
+                    v = _xlsx_value(cols[j][i], kind)
+                    if isinstance(v, (_dt.datetime, _dt.date)) or (kind == 'list' and v is not None):
+                        cell = WriteOnlyCell(ws, value=v)
+                        if kind == 'list':
+                            cell.alignment = wrap
+                        else:
+                            cell.number_format = date_format
+                        v = cell
+                    elif isinstance(v, np.generic):
+                        v = v.item()
+                    values.append(v)
+                ws.append(values)
+                written[sheet_names[sheet_idx]] += 1
+                row += 1
+    wb.save(path)
+    return written
+
+# Пример вызова:
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', max_workers=4)
+# export_xlsx(tables, '/content/gdrive/MyDrive/Волгоград_все_данные.xlsx')
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import random
+import time
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+# ----------------- Синтетические выгрузки: корпус книг для проверок и замеров -----------------
+# Книги повторяют разметку реальных выгрузок 1С (заливки уровней, шапки, формат сумм),
+# которую ожидают excel_parser_STATEMENT / excel_parser_INCOME / excel_parser_SUPPLIERS.
+# Размер регулируется числом счетов/контрагентов/строк; seed делает корпус воспроизводимым.
+
+_SYNTH_MONTHS = ['Январь', 'Февраль', 'Март', 'Апрель', 'Май', 'Июнь',
+                 'Июль', 'Август', 'Сентябрь', 'Октябрь', 'Ноябрь', 'Декабрь']
+
+def _synth_fill(color):
+    return PatternFill(start_color=color, end_color=color, fill_type='solid')
+
+def write_synthetic_statement(path, company='ООО "Ромашка"', month=1, year=2025,
+                              n_accounts=2, n_partners=3, n_contracts=3, seed=0):
+    """
+    Пишет синтетическую ОСВ по счёту 76 (Счет -> Контрагенты -> Договоры) с согласованными итогами.
+    """
+    rnd = random.Random(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = company
+    ws['A2'] = f'Оборотно-сальдовая ведомость по счету 76 за {_SYNTH_MONTHS[month - 1]} {year} г.'
+    ws['A4'] = 'Счет'
+    ws['B4'] = 'Сальдо на начало периода'
+    ws['D4'] = 'Обороты за период'
+    ws['F4'] = 'Сальдо на конец периода'
+    for i, title in enumerate(['Дебет', 'Кредит'] * 3):
+        ws.cell(row=5, column=2 + i, value=title)
+    ws['A6'] = 'Счет, Наименование счета'
+    ws['A7'] = 'Контрагенты'
+    ws['A8'] = 'Договоры'
+
+    row = 9
+    total = [0] * 6
+    for a in range(n_accounts):
+        account_row = row
+        row += 1
+        account = [0] * 6
+        for p in range(n_partners):
+            ws.cell(row=row, column=1, value=f'Контрагент {a}-{p}').fill = _synth_fill('FFF0F6EF')
+            row += 1
+            for c in range(n_contracts):
+                ws.cell(row=row, column=1, value=f'Договор {a}-{p}-{c}')
+                opening = rnd.randint(0, 1000)
+                debit, credit = rnd.randint(0, 500), rnd.randint(0, 500)
+                closing = opening + debit - credit
+                values = [opening, None, debit or None, credit or None,
+                          closing if closing > 0 else None, -closing if closing < 0 else None]
+                for k, v in enumerate(values):
+                    if v is not None:
+                        ws.cell(row=row, column=2 + k, value=v)
+                        account[k] += v
+                row += 1
+        ws.cell(row=account_row, column=1, value=f'76.{a + 1:02d}, Расчеты {a}').fill = _synth_fill('FFE4F0DD')
+        for k, v in enumerate(account):
+            if v:
+                ws.cell(row=account_row, column=2 + k, value=v)
+                total[k] += v
+    ws.cell(row=row, column=1, value='Итого развернутое').fill = _synth_fill('FFD6E5CB')
+    for k, v in enumerate(total):
+        if v:
+            ws.cell(row=row, column=2 + k, value=v)
+    wb.save(path)
+
+def write_synthetic_income(path, month=1, year=2025, companies=('ООО "Ромашка"',),
+                           n_estates=2, n_rows=5, seed=0):
+    """
+    Пишет синтетический анализ выручки: секция -> компания -> объект -> строки актов.
+    Суммы — строками с пробелами тысяч и запятой, как в выгрузке.
+    """
+    rnd = random.Random(seed)
+    last_day = calendar.monthrange(year, month)[1]
+    wb = Workbook()
+    ws = wb.active
+    ws['B1'] = 'Анализ выручки'
+    ws['B3'] = f'01.{month:02d}.{year} - {last_day}.{month:02d}.{year}'
+    ws['B5'] = 'Наименование'
+    ws['C5'] = 'Договор'
+    ws['D5'] = 'Контрагент'
+    ws['E5'] = 'Выручка'
+    row = 6
+    ws.cell(row=row, column=2, value='Аренда помещения').fill = _synth_fill('FFE0FFE0')
+    row += 1
+    total = 0
+    for company in companies:
+        ws.cell(row=row, column=2, value=company).fill = _synth_fill('FFA6CAF0')
+        row += 1
+        for e in range(n_estates):
+            ws.cell(row=row, column=2, value=f'ТЦ  Объект {e}').fill = _synth_fill('FFC0DCC0')
+            row += 1
+            for i in range(n_rows):
+                v = rnd.randint(1, 10000)
+                ws.cell(row=row, column=2, value=f'Акт {e}-{i}')
+                ws.cell(row=row, column=3, value=f'Договор {i}')
+                ws.cell(row=row, column=4, value=rnd.choice(['ИП Иванов И.И.', 'ООО "Лютик"', 'Петров П.П.']))
+                ws.cell(row=row, column=5, value=f'{v:,}'.replace(',', ' ') + ',00')
+                total += v
+                row += 1
+    ws.cell(row=row, column=2, value='Итого:')
+    ws.cell(row=row, column=5, value=total)
+    wb.save(path)
+
+def write_synthetic_suppliers(path, company='ООО "Ромашка"', year=2025, quarter=1, n_rows=6, seed=0):
+    """
+    Пишет синтетическую карточку счёта 60 за квартал (многострочные Документ / Аналитика Дт/Кт).
+    """
+    rnd = random.Random(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws['A1'] = company
+    ws['A2'] = f'Карточка счета 60 за {quarter} квартал {year} г.'
+    for cell, title in [('A4', 'Период'), ('B4', 'Документ'), ('C4', 'Аналитика Дт'), ('D4', 'Аналитика Кт'),
+                        ('E4', 'Дебет'), ('G4', 'Кредит'), ('I4', 'Текущее сальдо'),
+                        ('E5', 'Счет'), ('F5', 'Сумма'), ('G5', 'Счет'), ('H5', 'Сумма')]:
+        ws[cell] = title
+    ws['A6'] = 'Сальдо на начало'
+    ws['I6'] = 100
+    row = 7
+    for i in range(n_rows):
+        month = (quarter - 1) * 3 + 1 + i % 3
+        day = 1 + i % 28
+        ws.cell(row=row, column=1, value=f'{day:02d}.{month:02d}.{year}')
+        ws.cell(row=row, column=2, value=f'Поступление (акт, накладная) 0000-{i:06d} от {day:02d}.{month:02d}.{year}\n'
+                                         f'Входящий № {i}')
+        ws.cell(row=row, column=3, value=f'ООО "Поставщик {i % 4}"\nДоговор № {i % 7}\n<...>')
+        ws.cell(row=row, column=4, value='Аренда помещений\n40702810000000000001')
+        if i % 2:
+            ws.cell(row=row, column=5, value='60.01')
+            ws.cell(row=row, column=6, value=rnd.randint(1, 999))
+        else:
+            ws.cell(row=row, column=7, value='51')
+            ws.cell(row=row, column=8, value=rnd.randint(1, 999))
+        row += 1
+    ws.cell(row=row, column=1, value='Обороты за период')
+    row += 1
+    ws.cell(row=row, column=1, value='Сальдо на конец')
+    wb.save(path)
+
+def make_synthetic_corpus(root_main, year=2025, months=(1, 2, 3), companies=('ООО "Ромашка"', 'ООО "Лютик"'),
+                          scale=1, seed=0):
+    """
+    Создаёт дерево выгрузок в структуре ingest_folder:
+        <root_main>/Ведомость/<год>/*.xlsx, <root_main>/Выручка/<год>/*.xlsx, <root_main>/Поставщики услуг/*.xlsx
+
+    scale (int): Множитель размера книг (число контрагентов/строк растёт линейно).
+    Возвращает dict {'STATEMENT': [...], 'INCOME': [...], 'SUPPLIERS': [...]} — пути созданных файлов.
+    """
+    folders = {
+        'STATEMENT': os.path.join(root_main, 'Ведомость', str(year)),
+        'INCOME': os.path.join(root_main, 'Выручка', str(year)),
+        'SUPPLIERS': os.path.join(root_main, 'Поставщики услуг'),
+    }
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+    files = {report_type: [] for report_type in folders}
+
+    for m in months:
+        for c, company in enumerate(companies):
+            path = os.path.join(folders['STATEMENT'], f'ОСВ 76 {c + 1} {m:02d}.{year}.xlsx')
+            write_synthetic_statement(path, company=company, month=m, year=year,
+                                      n_partners=3 * scale, seed=seed + 100 * c + m)
+            files['STATEMENT'].append(path)
+        path = os.path.join(folders['INCOME'], f'Выручка {m:02d}.{year}.xlsx')
+        write_synthetic_income(path, month=m, year=year, companies=companies, n_rows=5 * scale, seed=seed + m)
+        files['INCOME'].append(path)
+    for c, company in enumerate(companies):
+        for q in sorted({(m - 1) // 3 + 1 for m in months}):
+            path = os.path.join(folders['SUPPLIERS'], f'Карточка 60 {c + 1} {q} кв {year}.xlsx')
+            write_synthetic_suppliers(path, company=company, year=year, quarter=q,
+                                      n_rows=6 * scale, seed=seed + 10 * c + q)
+            files['SUPPLIERS'].append(path)
+    return files
+
+# Пример вызова:
+# files = make_synthetic_corpus('/tmp/VLGR_synth', months=range(1, 13), scale=20)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+# ----------------- Сверка движков парсеров: эталон против быстрой реализации -----------------
+# compare_parser_engines прогоняет эталонный парсер и альтернативный движок по корпусу книг,
+# сравнивает таблицы ячейка в ячейку и замеряет время каждого движка по каждому файлу.
+# Различия только в типах (int/float, object/string, datetime64/date, list/ndarray, None/NaN)
+# расхождением не считаются; числа сравниваются с допуском atol.
+#
+# Движок — имя из PARSER_ENGINES или функция file -> DataFrame (pandas или polars).
+
+PARSER_ENGINES = {
+    'pandas': lambda parser: (lambda file: parser(file)),
+    'polars': lambda parser: (lambda file: parser(file, backend='polars')),
+}
+
+def _resolve_parser_engine(engine, parser):
+    if callable(engine):
+        return engine
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f'Неизвестный движок {engine!r}; доступны: {sorted(PARSER_ENGINES)} или функция file -> DataFrame')
+    return PARSER_ENGINES[engine](parser)
+
+def _engine_frame(df):
+    """Результат движка -> pandas DataFrame с RangeIndex."""
+    if hasattr(df, 'to_pandas') and not isinstance(df, pd.DataFrame):
+        df = df.to_pandas()
+    return df.reset_index(drop=True)
+
+def _cell_key(v, ndigits):
+    """Значение ячейки без учёта типа: пустые -> None, числа -> округлённый float, даты -> Timestamp."""
+    if v is None or v is pd.NaT or v is pd.NA:
+        return None
+    if isinstance(v, (list, tuple, np.ndarray)):
+        return tuple(_cell_key(x, ndigits) for x in v)
+    if isinstance(v, (bool, np.bool_)):
+        return bool(v)
+    if isinstance(v, (int, float, np.integer, np.floating)):
+        v = float(v)
+        return None if v != v else round(v, ndigits)
+    if isinstance(v, (pd.Timestamp, np.datetime64)) or hasattr(v, 'isoformat'):
+        try:
+            return pd.Timestamp(v)
+        except (TypeError, ValueError):
+            return str(v)
+    return str(v)
+
+def _cells_equal(a, b, atol):
+    if isinstance(a, float) and isinstance(b, float):
+        return abs(a - b) <= atol
+    if isinstance(a, tuple) and isinstance(b, tuple):
+        return len(a) == len(b) and all(_cells_equal(x, y, atol) for x, y in zip(a, b))
+    return a == b
+
+def compare_frames(reference, candidate, atol=1e-6, context_columns=None, max_mismatches=50):
+    """
+    Сравнивает две таблицы ячейка в ячейку, игнорируя различия только в типах.
+
+    Аргументы:
+        reference, candidate: DataFrame (pandas или polars)
+        atol (float): Допуск для чисел
+        context_columns (list, optional): Столбцы эталонной строки для контекста
+                                          (по умолчанию — все столбцы строки)
+        max_mismatches (int): Сколько расхождений ячеек записывать подробно
+
+    Возвращает:
+        list[dict]: расхождения {'kind', 'row', 'column', 'reference', 'candidate', 'context'};
+                    kind — 'columns' (разный набор столбцов), 'rows' (разное число строк) или 'cell'.
+                    Пустой список — таблицы эквивалентны.
+    """
+    ref, cand = _engine_frame(reference), _engine_frame(candidate)
+    mismatches = []
+    ref_cols, cand_cols = list(ref.columns), list(cand.columns)
+    if ref_cols != cand_cols:
+        mismatches.append({'kind': 'columns', 'row': None, 'column': None,
+                           'reference': ref_cols, 'candidate': cand_cols, 'context': None})
+    if len(ref) != len(cand):
+        mismatches.append({'kind': 'rows', 'row': None, 'column': None,
+                           'reference': len(ref), 'candidate': len(cand), 'context': None})
+
+    ndigits = max(0, int(-np.floor(np.log10(atol)))) + 3 if atol > 0 else 12
+    context_columns = [c for c in (context_columns or ref_cols) if c in ref.columns]
+    n_cells = 0
+    for col in [c for c in ref_cols if c in cand.columns]:
+        ref_values, cand_values = ref[col].tolist(), cand[col].tolist()
+        for i in range(min(len(ref_values), len(cand_values))):
+            a, b = _cell_key(ref_values[i], ndigits), _cell_key(cand_values[i], ndigits)
+            if _cells_equal(a, b, atol):
+                continue
+            n_cells += 1
+            if n_cells <= max_mismatches:
+                mismatches.append({'kind': 'cell', 'row': i, 'column': col,
+                                   'reference': ref_values[i], 'candidate': cand_values[i],
+                                   'context': {c: ref.at[i, c] for c in context_columns}})
+    if n_cells > max_mismatches:
+        mismatches.append({'kind': 'cell', 'row': None, 'column': None, 'reference': None,
+                           'candidate': f'… ещё {n_cells - max_mismatches} расхождений', 'context': None})
+    return mismatches
+
+def _timed(func, file, repeat):
+    best, result = None, None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        result = func(file)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def compare_parser_engines(files, parser_func, engine='polars', reference='pandas', repeat=1,
+                           atol=1e-6, max_mismatches=50, warmup=True, show_progress=True):
+    """
+    Дифференциальная проверка: эталонный движок против альтернативного на корпусе книг.
+
+    Аргументы:
+        files (list | str): Список файлов (пути, bytes, _ZipMember) или папка (рекурсивно *.xlsx)
+        parser_func (callable): excel_parser_STATEMENT / excel_parser_INCOME / excel_parser_SUPPLIERS
+        engine, reference (str | callable): Имя движка из PARSER_ENGINES или функция file -> DataFrame
+        repeat (int): Сколько раз запускать каждый движок на файле (берётся лучшее время)
+        atol (float): Допуск для чисел
+        max_mismatches (int): Сколько расхождений ячеек записывать по каждому файлу
+        warmup (bool): Прогнать оба движка на первом файле до замеров (импорты, кэши),
+                       чтобы первая строка отчёта не учитывала разовые затраты
+
+    Возвращает:
+        DataFrame по файлам: file, status ('ok' | 'mismatch' | 'error'), rows_reference, rows_engine,
+        seconds_reference, seconds_engine, speedup (во сколько раз движок быстрее эталона),
+        mismatches (число записанных расхождений), error.
+        Подробные расхождения с контекстом строк — в df.attrs['mismatches'] (список dict с полем 'file').
+    """
+    if isinstance(files, str):
+        files = sorted(glob.glob(os.path.join(files, '**', '*.xlsx'), recursive=True))
+    run_reference = _resolve_parser_engine(reference, parser_func)
+    run_engine = _resolve_parser_engine(engine, parser_func)
+    if warmup and files:
+        for run in (run_reference, run_engine):
+            try:
+                run(files[0])
+            except Exception:
+                pass  # ошибка попадёт в отчёт при основном прогоне
+
+    rows, details = [], []
+    for i in trange(len(files), desc='Сверка движков', unit='файл', disable=not show_progress):
+        file = files[i]
+        record = {'file': str(file), 'status': 'ok', 'rows_reference': None, 'rows_engine': None,
+                  'seconds_reference': None, 'seconds_engine': None, 'speedup': None,
+                  'mismatches': 0, 'error': None}
+        try:
+            ref, record['seconds_reference'] = _timed(run_reference, file, repeat)
+            cand, record['seconds_engine'] = _timed(run_engine, file, repeat)
+        except Exception as e:
+            record.update(status='error', error=f'{type(e).__name__}: {e}')
+            rows.append(record)
+            continue
+        record['rows_reference'], record['rows_engine'] = len(ref), len(cand)
+        if record['seconds_engine']:
+            record['speedup'] = record['seconds_reference'] / record['seconds_engine']
+        found = compare_frames(ref, cand, atol=atol, max_mismatches=max_mismatches)
+        if found:
+            record.update(status='mismatch', mismatches=len(found))
+            details.extend({'file': str(file), **m} for m in found)
+        rows.append(record)
+
+    report = pd.DataFrame(rows, columns=['file', 'status', 'rows_reference', 'rows_engine', 'seconds_reference',
+                                         'seconds_engine', 'speedup', 'mismatches', 'error'])
+    report.attrs['mismatches'] = details
+    if show_progress and len(report):
+        total_ref, total_eng = report['seconds_reference'].sum(), report['seconds_engine'].sum()
+        speedup = f'{total_ref / total_eng:.2f}x' if total_eng else 'n/a'
+        print(f"Файлов: {len(report)}, эквивалентны: {(report['status'] == 'ok').sum()}, "
+              f"расхождения: {(report['status'] == 'mismatch').sum()}, ошибки: {(report['status'] == 'error').sum()}; "
+              f"общее ускорение: {speedup}")
+    return report
+
+# Пример вызова:
+# files = make_synthetic_corpus('/tmp/VLGR_synth', scale=20)
+# report = compare_parser_engines(files['STATEMENT'], excel_parser_STATEMENT, engine='polars')
+# pd.DataFrame(report.attrs['mismatches'])
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import time
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ----------------- Предвыборка: чтение следующих файлов в память, пока парсится текущий -----------------
+# На смонтированных сетевых папках (Google Drive в Colab) первое чтение файла упирается в сеть,
+# а load_workbook всё это время простаивает. С prefetch=N в parse_*_folder / ingest_folder фоновые
+# потоки читают байты N следующих файлов, и сетевое ожидание перекрывается с разбором.
+# Очередь ограничена: в памяти — не больше N прочитанных файлов (плюс разбираемые в пуле).
+# Файл, который не удалось прочитать заранее, передаётся парсеру как есть — ошибка попадёт в отчёт.
+#
+# simulate_slow_disk — имитация медленного диска (задержка + пропускная способность) для
+# проверки на локальных файлах; действует в текущем процессе и в процессах пула (fork).
+
+_SLOW_DISK = None  # (latency, mb_per_s) внутри simulate_slow_disk
+
+class _PrefetchedFile:
+    """Файл, уже прочитанный в память: source — исходный путь или _ZipMember, data — bytes."""
+    __slots__ = ('source', 'data')
+
+    def __init__(self, source, data):
+        self.source = source
+        self.data = data
+
+    def __getstate__(self):
+        return (self.source, self.data)
+
+    def __setstate__(self, state):
+        self.source, self.data = state
+
+    def __str__(self):
+        return str(self.source)
+
+    __repr__ = __str__
+
+def _read_source_bytes(src):
+    """Читает файл (путь или _ZipMember) целиком; под simulate_slow_disk — с задержкой."""
+    data = src.read_bytes() if isinstance(src, _ZipMember) else open(src, 'rb').read()
+    if _SLOW_DISK is not None:
+        latency, mb_per_s = _SLOW_DISK
+        time.sleep(latency + (len(data) / (mb_per_s * 1024 * 1024) if mb_per_s else 0))
+    return data
+
+def _prefetch_sources(sources, depth, threads=None):
+    """
+    Генератор (позиция, источник) в порядке sources: источники заранее читаются в память
+    (не больше depth вперёд) и отдаются как _PrefetchedFile; при ошибке чтения — исходный источник.
+    """
+    depth = max(1, int(depth))
+    pool = ThreadPoolExecutor(max_workers=threads or min(depth, 4), thread_name_prefix='VLGR-prefetch')
+    pending = deque()
+    position = 0
+    try:
+        while position < len(sources) and len(pending) < depth:
+            pending.append(pool.submit(_read_source_bytes, sources[position]))
+            position += 1
+        for i in range(len(sources)):
+            fut = pending.popleft()
+            if position < len(sources):
+                pending.append(pool.submit(_read_source_bytes, sources[position]))
+                position += 1
+            try:
+                yield i, _PrefetchedFile(sources[i], fut.result())
+            except Exception:
+                yield i, sources[i]
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _task_sources(tasks, order, prefetch=0):
+    """(индекс задачи, источник) в порядке order; с prefetch — источники уже в памяти."""
+    order = list(order)
+    if not prefetch:
+        return ((i, tasks[i][2]) for i in order)
+    files = [tasks[i][2] for i in order]
+    prefetchable = [not isinstance(f, (bytes, bytearray, memoryview, _PrefetchedFile)) and not hasattr(f, 'read')
+                    for f in files]
+    if not all(prefetchable):
+        return ((i, tasks[i][2]) for i in order)
+    return ((order[k], source) for k, source in _prefetch_sources(files, prefetch))
+
+def _with_source(args, file, source):
+    """Подставляет прочитанный источник вместо file в аргументы задачи."""
+    if source is file:
+        return args
+    return tuple(source if a is file else a for a in args)
+
+@contextlib.contextmanager
+def simulate_slow_disk(latency=0.2, mb_per_s=5.0):
+    """
+    Имитация медленной сетевой папки: каждое чтение файла парсером или предвыборкой
+    ждёт latency секунд плюс размер / mb_per_s.
+    """
+    global _SLOW_DISK
+    previous = _SLOW_DISK
+    _SLOW_DISK = (latency, mb_per_s)
+    try:
+        yield
+    finally:
+        _SLOW_DISK = previous
+
+# Пример вызова:
+# df = parse_statement_folder('/content/gdrive/MyDrive/Волгоград', 'Ведомость', excel_parser_STATEMENT, prefetch=8)
+# with simulate_slow_disk(latency=0.3, mb_per_s=5):
+#     tables = ingest_folder('/tmp/VLGR_synth', prefetch=8)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import fnmatch
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.worksheet.worksheet import Worksheet
+
+# ----------------- Несколько листов в одной книге: sheets='all' | список -----------------
+# excel_parser_* с sheets=... загружают книгу один раз и вызывают себя же для каждого
+# выбранного листа (вместо пути передаётся объект листа), результат помечается столбцом SHEET.
+# Листы одной загруженной книги разбираются последовательно: это объекты openpyxl в памяти
+# процесса, и потоки под GIL ускорения не дают, — параллельность остаётся на уровне файлов
+# (max_workers в parse_*_folder / ingest_folder).
+#
+# sheets='all' — все листы; листы, которые не разбираются парсером (справочные, пустые),
+# пропускаются с сообщением. Явно перечисленные листы обязаны разбираться — иначе ошибка.
+
+SHEET_COLUMN = 'SHEET'
+
+def _worksheet_of(src):
+    """Лист для разбора: переданный объект листа или активный лист книги из src."""
+    if isinstance(src, Worksheet):
+        return src
+    return load_workbook(_workbook_source(src), data_only=True).active
+
+def _select_sheets(wb, sheets):
+    """
+    Листы книги по sheets: 'all' | имя | список имён, масок ('2025*') или индексов (0 — первый лист).
+    Порядок — как в книге, без повторов.
+    """
+    if sheets == 'all':
+        return list(wb.worksheets)
+    if isinstance(sheets, (str, int)):
+        sheets = [sheets]
+    selected = set()
+    for item in sheets:
+        if isinstance(item, int):
+            if not -len(wb.worksheets) <= item < len(wb.worksheets):
+                raise ValueError(f'Нет листа с индексом {item}; листов в книге: {len(wb.worksheets)}')
+            selected.add(wb.worksheets[item].title)
+            continue
+        matched = [ws.title for ws in wb.worksheets if fnmatch.fnmatchcase(ws.title, item)]
+        if not matched:
+            raise ValueError(f'Лист {item!r} не найден; листы книги: {wb.sheetnames}')
+        selected.update(matched)
+    return [ws for ws in wb.worksheets if ws.title in selected]
+
+def _parse_workbook_sheets(parser, file_path, sheets, backend='pandas', read_only=False, **kwargs):
+    """Одна загрузка книги -> parser(лист) по каждому выбранному листу -> объединение со столбцом SHEET."""
+    wb = load_workbook(_workbook_source(file_path), read_only=read_only, data_only=True)
+    try:
+        frames = _parse_sheets(parser, wb, sheets, backend, **kwargs)
+    finally:
+        if read_only:
+            wb.close()
+    if backend != 'pandas':
+        import polars as pl
+        return pl.concat(frames, how='diagonal_relaxed')
+    return pd.concat(frames, ignore_index=True)
+
+def _parse_sheets(parser, wb, sheets, backend, **kwargs):
+    frames = []
+    for ws in _select_sheets(wb, sheets):
+        try:
+            df = parser(ws, backend=backend, **kwargs)
+        except Exception as e:
+            if sheets != 'all':
+                raise ValueError(f'Лист {ws.title!r}: {e}') from e
+            print(f'Лист {ws.title!r} пропущен ({type(e).__name__}: {e})')
+            continue
+        if backend != 'pandas':
+            import polars as pl
+            frames.append(df.with_columns(pl.lit(ws.title, dtype=pl.Utf8).alias(SHEET_COLUMN)))
+        else:
+            df[SHEET_COLUMN] = ws.title
+            frames.append(df)
+
+    if not frames:
+        raise ValueError(f'Ни один лист книги не разобран; листы книги: {wb.sheetnames}')
+    return frames
+
+# Пример вызова:
+# df = excel_parser_STATEMENT('/content/ОСВ 76 все компании.xlsx', sheets='all')
+# df = excel_parser_INCOME(path, sheets=['Январь', 'Февраль'])
+# df = parse_suppliers_folder(root, 'Поставщики услуг', sheets='ООО*', max_workers=4)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import re
+import json
+import hashlib
+import functools
+import itertools
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.utils import column_index_from_string
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+
+# ----------------- Описания разметки отчётов (layout) и компилируемые парсеры -----------------
+# Разметка выгрузки 1С задаётся словарём, а не отдельной функцией с циклом по ячейкам:
+#
+#   'header'  — значения шапки: {'имя': {'cell': 'A1', 'convert': 'strip'}} или
+#               {'first_text': {'rows', 'columns', 'min_len', 'exclude'}, 'fallback': ['A1', ...]};
+#   'start'   — первая строка данных: {'row': 9} или поиск текста
+#               {'find': 'Наименование', 'columns': ['B'], 'offset': 1, 'ignore_case', 'max_row', 'default', 'error'};
+#   'anchors' — столбцы, найденные по шапке: {'dt_account': {'match': regex, 'below': 'счет', 'default': 'E'}};
+#               в ссылках на столбцы — '@dt_account', '@dt_account+1';
+#   'role_column', 'levels', 'roles' — цвет заливки (и текст) ячейки role_column -> роль строки:
+#               {'colors': [...], 'contains': 'итого', 'set': 'уровень', 'convert', 'emit': True | {поле: источник},
+#                'require_any': [столбцы], 'require_text': [столбцы]}; первая подходящая роль,
+#               роль без 'colors' подходит к любой строке. 'set' сбрасывает все более низкие уровни;
+#   'fields'  — поля записи: (имя, источник[, convert]); источник — 'header:имя', 'level:имя', 'col:B',
+#               'text' (текст role_column) или None; имя '@x' — название поля берётся из шапки 'x';
+#   'melt'    — столбцы значений -> записи с метками {'columns': {'B': ('Показатель', 'Дебет/Кредит'), ...},
+#               'labels': (...), 'value': 'Value'}; пустые ячейки пропускаются;
+#   'pairs'   — пары (счёт, сумма в соседнем столбце) -> по записи на пару (Dt/Cr карточки счёта);
+#   'rename', 'finish' — переименование столбцов и постобработка ('STATEMENT' | 'INCOME' | 'SUPPLIERS'
+#               — те же функции, что у excel_parser_*, или своя функция (records, header, layout, backend)).
+#
+# compile_layout превращает описание в парсер с той же сигнатурой, что у excel_parser_*:
+# книга читается в режиме read_only одним проходом по строкам (шапка буферизуется до начала данных),
+# роли по цветам — поиск в словаре, поля и преобразования разрешаются один раз при компиляции.
+# Три текущих парсера описаны как STATEMENT_LAYOUT / INCOME_LAYOUT / SUPPLIERS_LAYOUT;
+# совпадение результатов с excel_parser_* проверяется compare_parser_engines(..., engine='layout').
+
+_LAYOUT_MONTH_YEAR = re.compile(r'([А-ЯЁа-яё]+)\s+(\d{4})')
+_LAYOUT_ACCOUNT_CODE = re.compile(r'^\d{1,3}(?:\.\d{1,2})?$')
+_LAYOUT_NO_FILL = '00000000'  # цвет незалитой ячейки (как у openpyxl в обычном режиме)
+
+def _lc_text(v):
+    if v is None:
+        return None
+    s = str(v).strip()
+    return s if s else None
+
+def _lc_month_year(v):
+    text = v.strip()
+    match = _LAYOUT_MONTH_YEAR.search(text)
+    return f'{match.group(1)} {match.group(2)}' if match else text
+
+def _lc_list(v):
+    if v is None:
+        return []
+    parts = [p.strip() for p in str(v).replace('\r\n', '\n').replace('\r', '\n').split('\n')]
+    return [p for p in parts if p and p != '<...>']
+
+@functools.lru_cache(maxsize=65536)
+def _lc_date_cached(v):
+    dt = pd.to_datetime(v, dayfirst=True, errors='coerce')
+    return None if (dt is None or pd.isna(dt)) else dt.date()
+
+def _lc_date(v):
+    if v is None or (isinstance(v, float) and pd.isna(v)):
+        return None
+    try:
+        return _lc_date_cached(v)
+    except TypeError:  # нехэшируемое значение
+        return _lc_date_cached.__wrapped__(v)
+
+def _lc_number(x):
+    if x is None:
+        return None
+    if isinstance(x, (int, float)):
+        return None if pd.isna(x) else float(x)
+    try:
+        return float(str(x).replace('\xa0', '').replace(' ', '').replace(',', '.'))
+    except Exception:
+        return None
+
+def _lc_account(v):
+    s = _lc_text(v)
+    if s is not None:
+        return s
+    if isinstance(v, (int, float)) and not pd.isna(v):
+        return ('%f' % float(v)).rstrip('0').rstrip('.')
+    return None
+
+def _lc_looks_like_account(text):
+    if text is None:
+        return False
+    return _LAYOUT_ACCOUNT_CODE.match(str(text).strip().replace('\xa0', '').replace(' ', '')) is not None
+
+LAYOUT_CONVERTERS = {
+    'raw': lambda v: v,
+    'or_none': lambda v: v if v else None,
+    'strip': lambda v: v.strip(),
+    'strip_or_none': lambda v: v.strip() if v else None,
+    'text_or_none': lambda v: str(v).strip() if v else None,
+    'text': _lc_text,
+    'month_year': _lc_month_year,
+    'list': _lc_list,
+    'date': _lc_date,
+    'number': _lc_number,
+    'account': _lc_account,
+}
+
+STATEMENT_LAYOUT = {
+    'report_type': 'STATEMENT',
+    'header': {
+        'Company': {'cell': 'A1', 'convert': 'strip'},
+        'Period': {'cell': 'A2', 'convert': 'month_year'},
+        # названия уровней иерархии — заголовки столбцов результата
+        'level_account': {'cell': 'A6', 'convert': 'or_none'},
+        'level_sublevel': {'cell': 'A7', 'convert': 'or_none'},
+        'level_detail': {'cell': 'A8', 'convert': 'or_none'},
+    },
+    'start': {'row': 9},
+    'role_column': 'A',
+    'levels': ['account', 'sublevel', 'detail'],
+    'roles': [
+        {'colors': ['FFD6E5CB'], 'contains': 'итого',
+         'emit': {'@level_account': 'text', '@level_sublevel': None, '@level_detail': None}},
+        {'colors': ['FFE4F0DD'], 'set': 'account', 'emit': True},
+        {'colors': ['FFF0F6EF'], 'set': 'sublevel'},
+        {'colors': ['FFD6E5CB']},
+        {'set': 'detail', 'emit': True},
+    ],
+    'fields': [
+        ('Company', 'header:Company'),
+        ('Period', 'header:Period'),
+        ('@level_account', 'level:account'),
+        ('@level_sublevel', 'level:sublevel'),
+        ('@level_detail', 'level:detail'),
+    ],
+    'melt': {
+        'columns': {
+            'B': ('Сальдо на начало периода', 'Дебет'),
+            'C': ('Сальдо на начало периода', 'Кредит'),
+            'D': ('Обороты за период', 'Дебет'),
+            'E': ('Обороты за период', 'Кредит'),
+            'F': ('Сальдо на конец периода', 'Дебет'),
+            'G': ('Сальдо на конец периода', 'Кредит'),
+        },
+        'labels': ('Показатель', 'Дебет/Кредит'),
+        'value': 'Value',
+    },
+    'rename': STATEMENT_RENAME,
+    'finish': 'STATEMENT',
+}
+
+INCOME_LAYOUT = {
+    'report_type': 'INCOME',
+    'header': {'Date': {'cell': 'B3', 'convert': 'strip_or_none'}},
+    'start': {'find': 'Наименование', 'columns': ['B'], 'offset': 1,
+              'error': "Не найдена строка с заголовком 'Наименование'."},
+    'role_column': 'B',
+    'levels': ['section', 'company', 'object'],
+    'roles': [
+        # те же списки оттенков, что в excel_parser_INCOME
+        {'colors': ['00E0FFE0', 'FFE0FFE0', 'FFCCFFCC', '00CCFFCC', '00CFFFD7', None], 'set': 'section', 'convert': 'text_or_none'},
+        {'colors': ['00A6CAF0', 'FFA6CAF0', 'FFB7DEE8', 'FFB7DEE9', None], 'set': 'company', 'convert': 'text_or_none'},
+        {'colors': ['00C0DCC0', 'FFC0DCC0', 'FF99CC99', 'FF92D050', 'FF00B050', None], 'set': 'object', 'convert': 'text_or_none'},
+        {'require_any': ['B', 'C', 'D', 'E'], 'emit': True},
+    ],
+    'fields': [
+        ('Date', 'header:Date'),
+        ('Category', 'level:section'),
+        ('Company', 'level:company'),
+        ('Estate', 'level:object'),
+        ('Document', 'col:B'),
+        ('Contract', 'col:C'),
+        ('Partner', 'col:D'),
+        ('Value', 'col:E'),
+    ],
+    'finish': 'INCOME',
+}
+
+SUPPLIERS_LAYOUT = {
+    'report_type': 'SUPPLIERS',
+    'header': {
+        'Company': {'first_text': {'rows': 4, 'columns': 3, 'min_len': 3,
+                                   'exclude': r'(период|отчет|дата|счет|наименование|организац)'},
+                    'fallback': ['A1', 'B1', 'C1']},
+    },
+    'start': {'find': 'сальдо на начало', 'ignore_case': True, 'max_row': 120, 'max_column': 50,
+              'offset': 1, 'default': 10},
+    'anchors': {
+        'dt_account': {'match': r'\b(дебет|дт)\b', 'below': 'счет', 'default': 'E'},
+        'cr_account': {'match': r'\b(кредит|кт)\b', 'below': 'счет', 'default': 'G'},
+    },
+    'roles': [
+        {'require_text': ['A', 'B', 'C', 'D', '@dt_account', '@dt_account+1', '@cr_account', '@cr_account+1'],
+         'emit': True},
+    ],
+    'fields': [
+        ('Date', 'col:A', 'date'),
+        ('Company', 'header:Company'),
+        ('Doc', 'col:B', 'list'),
+        ('AnDT', 'col:C', 'list'),
+        ('AnCR', 'col:D', 'list'),
+    ],
+    'pairs': {
+        'groups': [('Dt', '@dt_account'), ('Cr', '@cr_account')],  # (метка, столбец счёта; сумма — следующий)
+        'label': 'DtCr', 'account': 'Счет', 'value': 'Value',
+        # в итоговых строках сумма могла «слиться» в столбец счёта
+        'total_words': ('итог', 'обороты', 'оборот', 'сальдо'), 'context_columns': 6,
+    },
+    'finish': 'SUPPLIERS',
+}
+
+REPORT_LAYOUTS = {'STATEMENT': STATEMENT_LAYOUT, 'INCOME': INCOME_LAYOUT, 'SUPPLIERS': SUPPLIERS_LAYOUT}
+
+_LAYOUT_KEYS = {'report_type', 'header', 'start', 'anchors', 'role_column', 'levels', 'roles',
+                'fields', 'melt', 'pairs', 'rename', 'finish'}
+
+def _finish_statement(records, header, layout, backend):
+    level_names = {level: header.get(f'level_{level}') for level in ('account', 'sublevel', 'detail')}
+    if backend != 'pandas':
+        return _statement_polars(records, level_names, layout.get('rename'))
+    return _statement_frame(records, level_names, layout.get('rename'))
+
+def _finish_income(records, header, layout, backend):
+    if backend != 'pandas':
+        return _income_polars(records, _income_next_month_firstday(header.get('Date')))
+    return _income_frame(records)
+
+def _finish_suppliers(records, header, layout, backend):
+    if backend != 'pandas':
+        return _suppliers_polars(records)
+    return _suppliers_frame(records)
+
+def _finish_generic(records, header, layout, backend):
+    df = pd.DataFrame(records).rename(columns=layout.get('rename') or {})
+    if backend != 'pandas':
+        import polars as pl
+        return pl.from_pandas(df)
+    return df
+
+_LAYOUT_FINISHERS = {'STATEMENT': _finish_statement, 'INCOME': _finish_income, 'SUPPLIERS': _finish_suppliers}
+
+def _layout_color(cell):
+    fill = getattr(cell, 'fill', None)
+    if fill is None:
+        return _LAYOUT_NO_FILL
+    color = getattr(fill, 'fgColor', None)
+    return getattr(color, 'rgb', None) if color is not None else None
+
+def _layout_converter(name):
+    if callable(name):
+        return name
+    if name not in LAYOUT_CONVERTERS:
+        raise ValueError(f'Неизвестное преобразование {name!r}; доступны: {sorted(LAYOUT_CONVERTERS)}')
+    return LAYOUT_CONVERTERS[name]
+
+def _layout_column(ref, anchors=None):
+    """Ссылка на столбец ('B', 2, '@anchor', '@anchor+1') -> индекс с нуля."""
+    if isinstance(ref, int):
+        return ref - 1
+    match = re.fullmatch(r'@(\w+)([+-]\d+)?', ref)
+    if match:
+        if anchors is None or match.group(1) not in anchors:
+            raise ValueError(f'Неизвестный якорь столбца {ref!r}')
+        return anchors[match.group(1)] + int(match.group(2) or 0)
+    return column_index_from_string(ref) - 1
+
+def _layout_cell_ref(ref):
+    match = re.fullmatch(r'([A-Za-z]+)(\d+)', ref)
+    if not match:
+        raise ValueError(f'Некорректный адрес ячейки {ref!r}')
+    return int(match.group(2)) - 1, column_index_from_string(match.group(1).upper()) - 1
+
+class _LayoutParser:
+    """
+    Парсер, скомпилированный из описания разметки (см. compile_layout).
+    Сериализуется по описанию — пригоден для пула процессов.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        self._compile()
+
+    def __getstate__(self):
+        return self.layout
+
+    def __setstate__(self, layout):
+        self.layout = layout
+        self._compile()
+
+    def __repr__(self):
+        spec = json.dumps(self.layout, sort_keys=True, ensure_ascii=False,
+                          default=lambda o: sorted(o) if isinstance(o, (set, frozenset)) else repr(o))
+        digest = hashlib.sha1(spec.encode()).hexdigest()[:12]
+        return f'<layout {self.layout.get("report_type", "?")} {digest}>'
+
+    # ---------- компиляция ----------
+    def _compile(self):
+        layout = self.layout
+        unknown = set(layout) - _LAYOUT_KEYS
+        if unknown:
+            raise ValueError(f'Неизвестные ключи описания разметки: {sorted(unknown)}')
+        if 'melt' in layout and 'pairs' in layout:
+            raise ValueError("Описание разметки: 'melt' и 'pairs' взаимоисключающие")
+
+        header = []
+        header_rows = 0
+        for name, spec in (layout.get('header') or {}).items():
+            convert = _layout_converter(spec.get('convert', 'raw'))
+            if 'cell' in spec:
+                r, c = _layout_cell_ref(spec['cell'])
+                header.append((name, 'cell', (r, c), convert))
+                header_rows = max(header_rows, r + 1)
+            elif 'first_text' in spec:
+                opts = dict(spec['first_text'])
+                opts['exclude'] = re.compile(opts['exclude'], re.I) if opts.get('exclude') else None
+                fallback = [_layout_cell_ref(ref) for ref in spec.get('fallback', [])]
+                header.append((name, 'first_text', (opts, fallback), convert))
+                header_rows = max([header_rows, opts.get('rows', 1)] + [r + 1 for r, _ in fallback])
+            else:
+                raise ValueError(f"Шапка {name!r}: нужен 'cell' или 'first_text'")
+        self._header = header
+        self._header_rows = header_rows
+
+        start = layout.get('start') or {'row': 1}
+        self._start_row = start.get('row')
+        self._find = None
+        if 'find' in start:
+            cols = start.get('columns')
+            self._find = {
+                'needle': start['find'].lower() if start.get('ignore_case') else start['find'],
+                'ignore_case': bool(start.get('ignore_case')),
+                'columns': [_layout_column(c) for c in cols] if cols else None,
+                'max_column': start.get('max_column'),
+                'max_row': start.get('max_row'),
+                'offset': start.get('offset', 1),
+                'default': start.get('default'),
+                'error': start.get('error', f"Не найдена строка с текстом {start['find']!r}"),
+            }
+        elif self._start_row is None:
+            raise ValueError("Описание разметки: 'start' должен содержать 'row' или 'find'")
+
+        self._anchor_specs = {
+            name: (re.compile(spec['match'], re.I), spec.get('below', '').lower(),
+                   _layout_column(spec.get('default', 1)), spec.get('max_column', 50), spec.get('rows_after_start', 3))
+            for name, spec in (layout.get('anchors') or {}).items()
+        }
+        self._lookahead = max([spec[4] for spec in self._anchor_specs.values()] + [-1]) + 2
+
+        self._role_column = _layout_column(layout.get('role_column', 'A'))
+        self._levels = list(layout.get('levels') or [])
+        self._needs_color = any(role.get('colors') for role in layout.get('roles') or [])
+        for role in layout.get('roles') or []:
+            if role.get('set') is not None and role['set'] not in self._levels:
+                raise ValueError(f"Роль задаёт неизвестный уровень {role['set']!r}; уровни: {self._levels}")
+            _layout_converter(role.get('convert', 'raw'))
+        for field in layout.get('fields') or []:
+            if len(field) > 2:
+                _layout_converter(field[2])
+
+    # ---------- разбор ----------
+    def __call__(self, file_path, backend='pandas', sheets=None):
+        if sheets is not None:
+            return _parse_workbook_sheets(self, file_path, sheets, backend=backend, read_only=True)
+        if isinstance(file_path, (Worksheet, ReadOnlyWorksheet)):
+            records, header = self._scan(file_path.iter_rows())
+        else:
+            wb = load_workbook(_workbook_source(file_path), read_only=True, data_only=True)
+            try:
+                records, header = self._scan(wb.active.iter_rows())
+            finally:
+                wb.close()
+        finish = self.layout.get('finish')
+        if finish is None:
+            finish = _finish_generic
+        elif not callable(finish):
+            finish = _LAYOUT_FINISHERS[finish]
+        return finish(records, header, self.layout, backend)
+
+    def _resolve_header(self, buffer, start):
+        def value(r, c):
+            if r < len(buffer) and c < len(buffer[r]):
+                return buffer[r][c].value
+            return None
+
+        header = {}
+        for name, kind, arg, convert in self._header:
+            if kind == 'cell':
+                header[name] = convert(value(*arg))
+                continue
+            opts, fallback = arg
+            found = None
+            for r in range(min(opts.get('rows', 1), len(buffer))):
+                for c in range(opts.get('columns', 1)):
+                    text = _lc_text(value(r, c))
+                    if (text and len(text) >= opts.get('min_len', 1)
+                            and not (opts['exclude'] and opts['exclude'].search(text))):
+                        found = text
+                        break
+                if found:
+                    break
+            if not found:
+                found = next((t for t in (_lc_text(value(r, c)) for r, c in fallback) if t), None)
+            header[name] = convert(found)
+
+        anchors = {}
+        for name, (match, below, default, max_column, rows_after_start) in self._anchor_specs.items():
+            column = default
+            for r in range(min(start + rows_after_start, len(buffer))):
+                for c in range(min(len(buffer[r]), max_column)):
+                    text = _lc_text(buffer[r][c].value)
+                    if text and match.search(text):
+                        under = _lc_text(value(r + 1, c))
+                        if under and below in under.lower():
+                            column = c
+            anchors[name] = column
+        return header, anchors
+
+    def _start_match(self, row):
+        find = self._find
+        cells = row if find['columns'] is None else [row[c] for c in find['columns'] if c < len(row)]
+        if find['columns'] is None and find['max_column']:
+            cells = cells[:find['max_column']]
+        for cell in cells:
+            text = _lc_text(cell.value)
+            if text and find['needle'] in (text.lower() if find['ignore_case'] else text):
+                return True
+        return False
+
+    def _scan(self, rows):
+        layout = self.layout
+        rows = iter(rows)
+
+        # 1. Шапка: буферизуем строки до начала данных (+ запас для якорей под заголовками)
+        buffer = []
+        start = self._start_row
+        for row in rows:
+            buffer.append(row)
+            n = len(buffer)
+            if start is None:
+                if self._start_match(row):
+                    start = n + self._find['offset']
+                elif self._find['max_row'] and n >= self._find['max_row']:
+                    start = self._find['default']
+            if start is not None and n >= max(self._header_rows, start - 1 + self._lookahead):
+                break
+        if start is None:
+            if self._find['default'] is None:
+                raise ValueError(self._find['error'])
+            start = self._find['default']
+        header, anchors = self._resolve_header(buffer, start)
+
+        # 2. Компиляция полей и ролей под найденные шапку и якоря
+        def field_key(name):
+            return header.get(name[1:]) if isinstance(name, str) and name.startswith('@') else name
+
+        def source(src, convert=None):
+            convert = _layout_converter(convert) if convert else None
+            if src is None:
+                return ('const', None, None)
+            if src == 'text':
+                return ('text', None, convert)
+            kind, _, arg = src.partition(':')
+            if kind == 'header':
+                value = header.get(arg)
+                return ('const', convert(value) if convert else value, None)
+            if kind == 'level':
+                return ('level', arg, convert)
+            if kind == 'col':
+                return ('col', _layout_column(arg, anchors), convert)
+            raise ValueError(f'Неизвестный источник поля {src!r}')
+
+        fields = [(field_key(f[0]), f[0], source(f[1], f[2] if len(f) > 2 else None))
+                  for f in layout.get('fields') or []]
+
+        roles = []
+        for role in layout.get('roles') or []:
+            emit = role.get('emit')
+            overrides = {}
+            if isinstance(emit, dict):
+                overrides = {name: source(src) for name, src in emit.items()}
+            roles.append((
+                frozenset(role['colors']) if role.get('colors') else None,
+                role.get('contains'),
+                role.get('set'),
+                _layout_converter(role.get('convert', 'raw')),
+                bool(emit),
+                overrides,
+                [_layout_column(c, anchors) for c in role.get('require_any', [])],
+                [_layout_column(c, anchors) for c in role.get('require_text', [])],
+            ))
+
+        melt = layout.get('melt')
+        melt_columns = [(_layout_column(c), labels) for c, labels in melt['columns'].items()] if melt else []
+        melt_labels = melt['labels'] if melt else ()
+        melt_value = melt.get('value', 'Value') if melt else None
+        pairs = layout.get('pairs')
+        if pairs:
+            pair_groups = [(label, _layout_column(ref, anchors)) for label, ref in pairs['groups']]
+            total_words = tuple(pairs.get('total_words', ()))
+            context_columns = pairs.get('context_columns', 6)
+
+        levels = dict.fromkeys(self._levels)
+        level_order = self._levels
+        role_column = self._role_column
+        needs_color = self._needs_color
+        records = []
+
+        def cell(vals, i):
+            return vals[i] if 0 <= i < len(vals) else None
+
+        # 3. Один проход по строкам данных
+        for row in itertools.chain(buffer[start - 1:], rows):
+            vals = [c.value for c in row]
+            text = cell(vals, role_column)
+            color = None
+            if needs_color:
+                color = _layout_color(row[role_column]) if role_column < len(row) else _LAYOUT_NO_FILL
+
+            for colors, contains, set_level, convert, emit, overrides, require_any, require_text in roles:
+                if colors is not None and color not in colors:
+                    continue
+                if contains is not None and (text is None or contains not in str(text).strip().lower()):
+                    continue
+                break
+            else:
+                continue  # строка без роли — пропуск
+
+            if require_any and not any(cell(vals, i) for i in require_any):
+                continue
+            if require_text and all(_lc_text(cell(vals, i)) is None for i in require_text):
+                continue
+            if set_level is not None:
+                levels[set_level] = convert(text)
+                for lower in level_order[level_order.index(set_level) + 1:]:
+                    levels[lower] = None
+            if not emit:
+                continue
+
+            base = {}
+            for key, name, (kind, arg, conv) in fields:
+                if name in overrides:
+                    kind, arg, conv = overrides[name]
+                if kind == 'const':
+                    value = arg
+                elif kind == 'level':
+                    value = levels[arg]
+                elif kind == 'col':
+                    value = cell(vals, arg)
+                else:
+                    value = text
+                base[key] = conv(value) if conv else value
+
+            if melt:
+                for i, labels in melt_columns:
+                    value = cell(vals, i)
+                    if value not in (None, ''):
+                        record = dict(base)
+                        record.update(zip(melt_labels, labels))
+                        record[melt_value] = value
+                        records.append(record)
+            elif pairs:
+                is_total = None
+                for label, acc_i in pair_groups:
+                    acc_cell, sum_cell = cell(vals, acc_i), cell(vals, acc_i + 1)
+                    acc_text = _lc_account(acc_cell)
+                    value = _lc_number(sum_cell)
+                    if value is None:
+                        if is_total is None:
+                            context = ' '.join(t for t in map(_lc_text, vals[:context_columns]) if t).lower()
+                            is_total = any(w in context for w in total_words)
+                        if is_total and not _lc_looks_like_account(acc_text):
+                            maybe = _lc_number(acc_cell)
+                            if maybe is not None and _lc_text(sum_cell) is None:
+                                value, acc_text = maybe, None
+                    if value is not None:
+                        record = dict(base)
+                        record[pairs['label']] = label
+                        record[pairs['account']] = acc_text
+                        record[pairs['value']] = value
+                        records.append(record)
+            else:
+                records.append(base)
+        return records, header
+
+def compile_layout(layout):
+    """
+    Компилирует описание разметки отчёта в парсер file -> DataFrame.
+
+    Аргументы:
+        layout (dict): Описание (см. STATEMENT_LAYOUT / INCOME_LAYOUT / SUPPLIERS_LAYOUT и комментарий раздела)
+
+    Возвращает:
+        Парсер с сигнатурой excel_parser_*: parser(file_path, backend='pandas', sheets=None);
+        подходит для parse_*_folder, ingest_folder(parsers=...) и Pipeline.parse(parser_func=...).
+    """
+    return _LayoutParser(layout)
+
+layout_parser_STATEMENT = compile_layout(STATEMENT_LAYOUT)
+layout_parser_INCOME = compile_layout(INCOME_LAYOUT)
+layout_parser_SUPPLIERS = compile_layout(SUPPLIERS_LAYOUT)
+
+PARSER_ENGINES['layout'] = lambda parser: {
+    excel_parser_STATEMENT: layout_parser_STATEMENT,
+    excel_parser_INCOME: layout_parser_INCOME,
+    excel_parser_SUPPLIERS: layout_parser_SUPPLIERS,
+}[parser]
+
+# Пример вызова:
+# df = layout_parser_STATEMENT('/content/ОСВ 76 февраль 2025.xlsx')
+# report = compare_parser_engines(files, excel_parser_STATEMENT, engine='layout')
+# my_layout = dict(STATEMENT_LAYOUT, header=dict(STATEMENT_LAYOUT['header'], Company={'cell': 'B1', 'convert': 'strip'}))
+# df = parse_statement_folder(root, 'Ведомость', compile_layout(my_layout), max_workers=4)
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import json
+import datetime as _dt
+import pandas as pd
+
+# ----------------- Снимки таблиц в Arrow IPC (Feather v2) с отображением в память -----------------
+# save_snapshot сохраняет объединённые таблицы (ingest_folder, enrich_suppliers_semantics, ...) в
+# <root>/<ИМЯ>.feather — формат Arrow IPC без сжатия, — и манифест _snapshot.json (строки, столбцы, attrs).
+# load_snapshot открывает файлы через memory map: данные не читаются целиком и не копируются —
+# страницы подгружаются ОС по мере обращения и общие для всех процессов, открывших тот же снимок.
+#
+# Без копирования возвращаются backend='arrow' (pa.Table), 'polars' и 'pandas' с
+# dtype_backend='pyarrow' (столбцы pd.ArrowDtype; только даты приводятся к datetime64 / date).
+# dtype_backend='numpy' даёт таблицы в точности как у парсеров (списки Python в Doc/AnDT/AnCR,
+# object-столбцы) — ценой полного чтения в память.
+
+SNAPSHOT_MANIFEST = '_snapshot.json'
+SNAPSHOT_SUFFIX = '.feather'
+
+def _snapshot_table(df):
+    """pandas / polars / pa.Table -> pa.Table с предсказуемыми типами."""
+    import pyarrow as pa
+
+    if isinstance(df, pa.Table):
+        return df
+    if isinstance(df, pd.DataFrame):
+        return _df_to_arrow(df)
+    return df.to_arrow()  # polars
+
+def _snapshot_types_mapper(arrow_type):
+    """dtype_backend='pyarrow': всё — pd.ArrowDtype без копирования, кроме дат/времени
+    (datetime64 / date, как у парсеров, — на них рассчитаны .dt-операции модуля)."""
+    import pyarrow as pa
+
+    if pa.types.is_temporal(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+def _snapshot_attrs(df):
+    attrs = getattr(df, 'attrs', None) or {}
+    try:
+        return json.loads(json.dumps(attrs, ensure_ascii=False, default=str))
+    except (TypeError, ValueError):
+        return {}
+
+def _snapshot_nulls(df):
+    """{столбец: 'None' | 'NaN'} — чем заполнены пропуски object-столбцов (Arrow хранит только маску)."""
+    if not isinstance(df, pd.DataFrame):
+        return {}
+    nulls = {}
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        values = df[col].to_numpy()
+        na_values = values[pd.isna(values)]
+        if len(na_values):
+            nulls[str(col)] = 'None' if na_values[0] is None else 'NaN'
+    return nulls
+
+def save_snapshot(tables, root, compression=None, chunk_rows=262_144):
+    """
+    Сохраняет таблицы в снимок Arrow IPC (Feather v2) для мгновенной загрузки в новой сессии.
+
+    Аргументы:
+        tables (dict): {'STATEMENT': df, 'INCOME': df, 'SUPPLIERS': df, 'SUPPLIERS_ENRICHED': df, ...}
+                       — pandas, polars или pa.Table
+        root (str): Папка снимка
+        compression (str, optional): None (по умолчанию) — без сжатия, файл отображается в память
+                                     без копирования; 'lz4' | 'zstd' — меньше на диске, но при
+                                     загрузке данные распаковываются в память
+        chunk_rows (int): Строк в одном record batch
+
+    Возвращает:
+        dict {имя: число строк}. Файл каждой таблицы заменяется атомарно; таблицы снимка,
+        не переданные в tables, остаются.
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+
+    os.makedirs(root, exist_ok=True)
+    manifest_path = os.path.join(root, SNAPSHOT_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    written = {}
+    for name, df in tables.items():
+        if df is None:
+            continue
+        table = _snapshot_table(df)
+        path = os.path.join(root, f'{name}{SNAPSHOT_SUFFIX}')
+        tmp_path = path + '.tmp'
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table, max_chunksize=chunk_rows)
+        os.replace(tmp_path, path)
+        manifest[name] = {
+            'file': os.path.basename(path),
+            'rows': table.num_rows,
+            'columns': table.schema.names,
+            'compression': compression,
+            'dtypes': {str(c): str(t) for c, t in df.dtypes.items()} if isinstance(df, pd.DataFrame) else {},
+            'nulls': _snapshot_nulls(df),
+            'attrs': _snapshot_attrs(df),
+            'saved_at': _dt.datetime.now().isoformat(timespec='seconds'),
+        }
+        written[name] = table.num_rows
+
+    tmp_manifest = manifest_path + '.tmp'
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_manifest, manifest_path)
+    return written
+
+def load_snapshot(root, names=None, columns=None, backend='pandas', dtype_backend='pyarrow', memory_map=True):
+    """
+    Загружает таблицы из снимка save_snapshot.
+
+    Аргументы:
+        root (str): Папка снимка
+        names (str | list, optional): Какие таблицы загрузить (по умолчанию — все); строка — одна таблица
+        columns (list, optional): Какие столбцы оставить (отсутствующие в таблице пропускаются)
+        backend (str): 'pandas' | 'polars' | 'arrow' (pa.Table)
+        dtype_backend (str): Для pandas: 'pyarrow' — столбцы pd.ArrowDtype поверх отображённого файла
+                             (без копирования, кроме дат); 'numpy' — как у парсеров (списки, object)
+        memory_map (bool): Открывать файлы через memory map (False — обычное чтение в память)
+
+    Возвращает:
+        dict {имя: таблица} или одну таблицу, если names — строка. attrs (например, parse_errors)
+        восстанавливаются для pandas.
+    """
+    _require_pyarrow()
+    import pyarrow as pa
+
+    if backend not in ('pandas', 'polars', 'arrow'):
+        raise ValueError(f"backend: 'pandas' | 'polars' | 'arrow', получено {backend!r}")
+    if dtype_backend not in ('pyarrow', 'numpy'):
+        raise ValueError(f"dtype_backend: 'pyarrow' | 'numpy', получено {dtype_backend!r}")
+    manifest_path = os.path.join(root, SNAPSHOT_MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f'Снимок не найден: {manifest_path}')
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    single = isinstance(names, str)
+    wanted = [names] if single else list(names or manifest)
+    missing = [n for n in wanted if n not in manifest]
+    if missing:
+        raise KeyError(f'В снимке нет таблиц {missing}; есть: {sorted(manifest)}')
+
+    out = {}
+    for name in wanted:
+        path = os.path.join(root, manifest[name]['file'])
+        source = pa.memory_map(path, 'r') if memory_map else pa.OSFile(path, 'rb')
+        with source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.schema.names])
+
+        if backend == 'arrow':
+            out[name] = table
+        elif backend == 'polars':
+            pl = _require_polars()
+            out[name] = pl.from_arrow(table, rechunk=False)
+        else:
+            if dtype_backend == 'pyarrow':
+                df = table.to_pandas(types_mapper=_snapshot_types_mapper)
+            else:
+                df = _arrow_to_df(table)
+                # столбцы object, целиком пустые или текстовые, Arrow возвращает строковым dtype
+                for col, dtype in (manifest[name].get('dtypes') or {}).items():
+                    if dtype == 'object' and col in df.columns and df[col].dtype != object:
+                        df[col] = df[col].astype(object)
+                # пропуски — тем же значением, что в исходной таблице (None или NaN), как в _transfer_column
+                for col, na in (manifest[name].get('nulls') or {}).items():
+                    if col in df.columns and df[col].dtype == object:
+                        values = df[col].to_numpy(copy=True)
+                        values[pd.isna(values)] = None if na == 'None' else np.nan
+                        df[col] = pd.Series(values, index=df.index, dtype=object)
+            df.attrs.update(manifest[name].get('attrs') or {})
+            out[name] = df
+    return out[wanted[0]] if single else out
+
+# Пример вызова:
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', max_workers=4)
+# tables['SUPPLIERS_ENRICHED'] = enrich_suppliers_semantics(tables['SUPPLIERS'], '/content/gdrive/MyDrive/Объекты.xlsx')
+# save_snapshot(tables, '/content/gdrive/MyDrive/Волгоград/_snapshot')
+# # новая сессия:
+# tables = load_snapshot('/content/gdrive/MyDrive/Волгоград/_snapshot')                       # pandas поверх mmap
+# df = load_snapshot('/content/gdrive/MyDrive/Волгоград/_snapshot', 'STATEMENT', dtype_backend='numpy')
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import os
+import gc
+import shutil
+import tempfile
+import uuid
+import contextlib
+import datetime as _dt
+import numpy as np
+import pandas as pd
+
+# ----------------- Передача результатов из процессов-обработчиков через Arrow IPC -----------------
+# Обычно ProcessPoolExecutor возвращает DataFrame файла через pickle: каждый список Doc/AnDT/AnCR
+# и каждая дата SUPPLIERS сериализуются в обработчике, проходят через канал между процессами
+# и собираются заново в родителе, который в это время не принимает другие результаты.
+# С transfer='arrow' обработчик сам записывает таблицу в файл Arrow IPC в общей памяти
+# (/dev/shm, иначе во временной папке) и возвращает только дескриптор _ArrowFrame;
+# родитель отображает файл в память и восстанавливает столбцы целиком: числа и даты —
+# копированием массивов, строки и списки — из буферов Arrow без разбора pickle.
+# Результат совпадает с pickle вплоть до dtype и вида пропусков (None / NaN); столбцы,
+# которые Arrow не передаёт без потерь (смешанные типы в object), идут через pickle, как раньше.
+
+TRANSFER_MODES = ('auto', 'pickle', 'arrow')
+
+class _ArrowFrame:
+    """Дескриптор DataFrame, переданного из обработчика файлом Arrow IPC."""
+    __slots__ = ('path', 'kind', 'labels', 'columns', 'index', 'attrs')
+
+    def __init__(self, path, kind, labels=None, columns=None, index=None, attrs=None):
+        self.path = path          # файл Arrow IPC (None — все столбцы в columns)
+        self.kind = kind          # 'pandas' | 'polars'
+        self.labels = labels      # df.columns
+        self.columns = columns    # на каждый столбец: ('arrow', способ восстановления) | ('pickle', значения)
+        self.index = index        # None — RangeIndex
+        self.attrs = attrs
+
+def _transfer_base_dir():
+    """Папка файлов передачи: /dev/shm (общая память) или временная папка системы."""
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK):
+        return shm
+    return tempfile.gettempdir()
+
+def _resolve_transfer(transfer, executor, max_workers):
+    """'arrow' — передавать результаты файлами Arrow IPC; 'pickle' — как есть."""
+    if transfer not in TRANSFER_MODES:
+        raise ValueError(f"transfer: {' | '.join(TRANSFER_MODES)}, получено {transfer!r}")
+    if executor != 'process' or not max_workers or max_workers <= 1 or transfer == 'pickle':
+        return 'pickle'  # результат остаётся в том же процессе — передавать нечего
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        if transfer == 'arrow':
+            _require_pyarrow()
+        return 'pickle'
+    return 'arrow'
+
+def _transfer_column(s):
+    """
+    Столбец pandas -> (pa.Array, способ восстановления) без потерь
+    или (None, None), если Arrow его точно не передаёт.
+    """
+    import pyarrow as pa
+
+    dtype = s.dtype
+    try:
+        if isinstance(dtype, np.dtype) and dtype.kind in 'biufmM':
+            return pa.array(s.to_numpy()), ('numpy', dtype)
+        if isinstance(dtype, pd.StringDtype):
+            return pa.array(s), ('pandas', dtype)
+        if dtype != object:
+            return None, None
+
+        values = s.to_numpy()
+        missing = pd.isna(values)
+        na_values = values[missing]
+        if len({type(v) for v in na_values}) > 1:
+            return None, None  # None вперемешку с NaN — восстановить позиции можно только pickle
+        na = na_values[0] if len(na_values) else None
+
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind in ('string', 'empty'):
+            return pa.array(values, type=pa.string(), from_pandas=True), ('object', na)
+        if kind == 'date' and all(type(v) is _dt.date for v in values[~missing]):
+            # 'date' у infer_dtype — и date вперемешку с datetime: время date32 бы отбросил
+            return pa.array(values, type=pa.date32(), from_pandas=True), ('date', na)
+        if not missing.any() and all(type(v) is list for v in values):
+            return pa.array(values, type=pa.list_(pa.string())), ('list', None)
+    except (pa.ArrowException, TypeError, ValueError):
+        pass
+    return None, None
+
+def _arrow_strings(array):
+    """
+    Строковый pa.Array -> object ndarray (None на месте пропусков). Одинаковые значения —
+    один объект str: создаются только уникальные строки, остальное — ссылки на них.
+    """
+    import pyarrow.compute as pc
+
+    encoded = pc.dictionary_encode(array)
+    words = np.append(encoded.dictionary.to_numpy(zero_copy_only=False), None)
+    indices = pc.fill_null(encoded.indices, len(words) - 1).to_numpy()
+    return words[indices]
+
+def _restore_column(array, how):
+    """pa.Array -> pd.Series по способу восстановления из _transfer_column (данные копируются)."""
+    kind, arg = how
+    if kind == 'numpy':
+        return pd.Series(np.array(array.to_numpy(zero_copy_only=False), dtype=arg), copy=False)
+    if kind == 'pandas':
+        return array.to_pandas().astype(arg)
+    if kind == 'list':
+        # Строки с одинаковой длиной списка собираются одним блоком: values[start + arange(L)].tolist()
+        values = _arrow_strings(array.values)
+        offsets = array.offsets.to_numpy()
+        starts, lengths = offsets[:-1], np.diff(offsets)
+        out = np.empty(len(array), dtype=object)
+        for length in np.unique(lengths):
+            rows = np.flatnonzero(lengths == length)
+            block = values[starts[rows, None] + np.arange(length)].tolist()
+            out[rows] = np.fromiter(block, dtype=object, count=len(rows))
+        return pd.Series(out, dtype=object, copy=False)
+    if kind == 'date':
+        out = array.to_pandas(date_as_object=True).to_numpy(dtype=object)
+    else:
+        out = _arrow_strings(array)
+    if array.null_count and arg is not None:
+        out[array.is_null().to_numpy(zero_copy_only=False)] = arg
+    return pd.Series(out, dtype=object, copy=False)
+
+def _write_transfer_frame(df, spill_dir):
+    """DataFrame / pl.DataFrame -> _ArrowFrame (файл в spill_dir)."""
+    import pyarrow as pa
+
+    path = os.path.join(spill_dir, f'{uuid.uuid4().hex}.arrow')
+    if not isinstance(df, pd.DataFrame):
+        df.write_ipc(path, compression='uncompressed')  # polars
+        return _ArrowFrame(path, 'polars')
+
+    arrays, names, columns = [], [], []
+    for k in range(df.shape[1]):
+        array, how = _transfer_column(df.iloc[:, k])
+        if array is None:
+            columns.append(('pickle', df.iloc[:, k].to_numpy()))
+        else:
+            columns.append(('arrow', how))
+            arrays.append(array)
+            names.append(f'c{k}')
+    if arrays:
+        table = pa.Table.from_arrays(arrays, names=names)
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        path = None
+    index = None if df.index.equals(pd.RangeIndex(len(df))) else df.index
+    return _ArrowFrame(path, 'pandas', df.columns, columns, index, dict(df.attrs))
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Без циклического сборщика мусора: при создании сотен тысяч списков строк (циклов в них нет)
+    он раз за разом обходит всю кучу родителя, где уже лежат таблицы предыдущих файлов."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def _read_transfer_frame(handle):
+    """_ArrowFrame -> DataFrame; файл передачи удаляется."""
+    import pyarrow as pa
+
+    if handle.kind == 'polars':
+        import polars as pl
+        try:
+            with open(handle.path, 'rb') as f:
+                return pl.read_ipc(f)  # из файлового объекта — в память, без отображения удаляемого файла
+        finally:
+            os.remove(handle.path)
+
+    n_rows = None
+    data = {}
+    try:
+        table = None
+        if handle.path is not None:
+            with pa.memory_map(handle.path, 'r') as source, _gc_paused():
+                table = pa.ipc.open_file(source).read_all()
+                n_rows = table.num_rows
+                for k, (where, value) in enumerate(handle.columns):
+                    if where == 'arrow':
+                        data[k] = _restore_column(table.column(f'c{k}').combine_chunks(), value)
+    finally:
+        if handle.path is not None:
+            os.remove(handle.path)
+    for k, (where, value) in enumerate(handle.columns):
+        if where == 'pickle':
+            data[k] = pd.Series(value, dtype=value.dtype, copy=False)
+            n_rows = len(value)
+    data = {k: data[k] for k in range(len(handle.columns))}
+    df = pd.DataFrame(data) if data else pd.DataFrame(index=pd.RangeIndex(n_rows or 0))
+    df.columns = handle.labels
+    if handle.index is not None:
+        df.index = handle.index
+    df.attrs.update(handle.attrs or {})
+    return df
+
+def _transfer_encode(result, spill_dir):
+    """Результат задачи -> то же с _ArrowFrame вместо таблиц (в т.ч. внутри кортежей)."""
+    if isinstance(result, tuple):
+        return tuple(_transfer_encode(x, spill_dir) for x in result)
+    if isinstance(result, pd.DataFrame) or type(result).__module__.startswith('polars') and hasattr(result, 'write_ipc'):
+        try:
+            return _write_transfer_frame(result, spill_dir)
+        except Exception:
+            return result  # нет места в /dev/shm и т.п. — передаём через pickle
+    return result
+
+def _transfer_decode(result):
+    """Обратное к _transfer_encode, в родителе."""
+    if isinstance(result, tuple):
+        return tuple(_transfer_decode(x) for x in result)
+    if isinstance(result, _ArrowFrame):
+        return _read_transfer_frame(result)
+    return result
+
+def _transfer_task(spill_dir, func, *args):
+    """Задача пула при transfer='arrow': парсинг в обработчике и запись результата в spill_dir."""
+    return _transfer_encode(func(*args), spill_dir)
+
+# Пример вызова:
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', max_workers=4)                      # transfer='auto' -> Arrow
+# tables = ingest_folder('/content/gdrive/MyDrive/Волгоград', max_workers=4, transfer='pickle')   # как раньше
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+
+import numpy as np
+import pandas as pd
+
+# ----------------- Динамика сальдо и оборотов период к периоду -----------------
+# Помесячные изменения сальдо и оборотов ОСВ по сочетаниям Company × Счет × Partner × Contract × Estate.
+# Вместо слияния таблицы с самой собой по ключам и предыдущему месяцу (при повторяющихся ключах
+# число строк слияния растёт как произведение) помесячные суммы один раз упорядочиваются
+# по ключам и Date — и предыдущий период сочетания оказывается просто предыдущей строкой:
+# лаги, разности, первое/последнее появление и пропуски месяцев — сдвиги массивов.
+# Как и куб оборотов, панель хранит частичные суммы по SOURCE_FILE: при поступлении файла
+# за новый месяц (или замене старого) пересчитываются только затронутые им сочетания.
+
+DELTA_KEYS = ['Company', 'Счет', 'Partner', 'Contract', 'Estate']
+DELTA_MEASURES = ['Opening', 'TurnDt', 'TurnCr', 'Closing']
+
+def build_balance_panel(df, keys=None):
+    """
+    Панель ОСВ для period_deltas: SOURCE_FILE × keys × Date (первое число месяца) ->
+    Opening (сальдо на начало, Дт − Кт), TurnDt, TurnCr (обороты), Closing (сальдо на конец, Дт − Кт).
+    Берутся листовые строки (statement_leaf_mask), чтобы суммы не дублировались.
+    Ключи, которых нет в df (парсер создаёт только уровни, названные в A6–A8), считаются пустыми.
+    """
+    keys = list(keys or DELTA_KEYS)
+    missing = [c for c in ['SOURCE_FILE'] + keys if c not in df.columns]
+    if missing:
+        df = df.assign(**{c: None for c in missing})
+    if df.empty:
+        panel = pd.DataFrame({c: pd.Series(dtype='object') for c in ['SOURCE_FILE'] + keys})
+        panel['Date'] = pd.Series(dtype='datetime64[ns]')
+        for m in DELTA_MEASURES:
+            panel[m] = pd.Series(dtype='float64')
+    else:
+        base = _cube_base_rows(df, 'STATEMENT')
+        base = base[base['Date'].notna()]
+        wide = _statement_wide(base, ['SOURCE_FILE'] + keys + ['Date'])
+        panel = wide[['SOURCE_FILE'] + keys + ['Date']].assign(
+            Opening=wide['OpenDt'] - wide['OpenCr'],
+            TurnDt=wide['TurnDt'],
+            TurnCr=wide['TurnCr'],
+            Closing=wide['CloseDt'] - wide['CloseCr'],
+        )
+    panel.attrs['keys'] = keys
+    return panel
+
+def _lag(values, new, fill):
+    """Значение предыдущей строки; в первой строке каждого сочетания (new) — fill."""
+    out = np.empty_like(values)
+    out[1:] = values[:-1]
+    out[new] = fill
+    return out
+
+def _delta_entity_key(df, keys):
+    """64-битный хэш сочетания keys в каждой строке; пустые значения (None / NaN) равны между собой."""
+    cols = {k: df[k].astype(object).where(df[k].notna(), '\x00') for k in keys}
+    return pd.util.hash_pandas_object(pd.DataFrame(cols, index=df.index), index=False)
+
+def period_deltas(panel, keys=None):
+    """
+    Динамика период к периоду: одна строка на сочетание keys × месяц.
+
+    Аргументы:
+        panel (pd.DataFrame): build_balance_panel(...) или сразу таблица STATEMENT
+                              (excel_parser_STATEMENT / parse_statement_folder / read_dataset)
+        keys (list, optional): Ключи сочетания (по умолчанию — ключи панели, иначе DELTA_KEYS)
+
+    Возвращает:
+        pd.DataFrame: keys, Date, Opening, TurnDt, TurnCr, Closing и
+            PrevDate — предыдущий месяц, в котором сочетание встречалось (NaT при первом появлении);
+            Gap — сколько месяцев между ними пропущено (0 — подряд);
+            <мера>Delta — изменение к PrevDate; ClosingPrev — сальдо на конец PrevDate;
+            Carry — Opening − ClosingPrev, расхождение переноса сальдо (при Gap = 0 должно быть 0);
+            First / Last — первое / последнее появление сочетания, FirstDate / LastDate — их месяцы.
+        Строки сгруппированы по сочетаниям keys, внутри — по Date. Отсутствие сочетания в месяце
+        означает нулевые сальдо и обороты: LastDate раньше последнего месяца данных — сочетание выбыло.
+    """
+    keys = list(keys or panel.attrs.get('keys') or DELTA_KEYS)
+    if not set(DELTA_MEASURES) <= set(panel.columns):
+        panel = build_balance_panel(panel, keys)
+
+    # Единственная сортировка: суммы по источникам, упорядоченные по keys и Date
+    agg = (panel.groupby(keys + ['Date'], dropna=False, sort=True)[DELTA_MEASURES]
+                .sum()
+                .reset_index())
+    n = len(agg)
+    ent = agg.groupby(keys, dropna=False, sort=False).ngroup().to_numpy()
+    new = np.ones(n, dtype=bool)
+    new[1:] = ent[1:] != ent[:-1]
+    last = np.ones(n, dtype=bool)
+    last[:-1] = new[1:]
+    pos = np.arange(n)
+    first_pos = np.maximum.accumulate(np.where(new, pos, 0)) if n else pos
+    last_pos = np.minimum.accumulate(np.where(last, pos, n - 1)[::-1])[::-1] if n else pos
+
+    dates = agg['Date'].to_numpy()
+    month = agg['Date'].dt.year.to_numpy() * 12 + agg['Date'].dt.month.to_numpy()
+    out = agg
+    out['PrevDate'] = _lag(dates, new, np.datetime64('NaT'))
+    out['Gap'] = np.where(new, 0, month - _lag(month, new, 0) - 1)
+    for m in DELTA_MEASURES:
+        values = agg[m].to_numpy(dtype='float64')
+        prev = _lag(values, new, np.nan)
+        out[m + 'Delta'] = values - prev
+        if m == 'Closing':
+            out['ClosingPrev'] = prev
+    out['Carry'] = out['Opening'] - out['ClosingPrev']
+    out['First'] = new
+    out['Last'] = last
+    out['FirstDate'] = dates[first_pos]
+    out['LastDate'] = dates[last_pos]
+    out.attrs['keys'] = keys
+    return out
+
+def update_period_deltas(deltas, panel, df_changed, removed_sources=()):
+    """
+    Инкрементально обновляет динамику по новым/изменённым файлам STATEMENT (например, за новый месяц):
+    строки панели из SOURCE_FILE df_changed (и removed_sources) заменяются, а period_deltas
+    пересчитывается только для сочетаний keys, встречающихся в заменённых строках.
+
+    Возвращает (deltas, panel) — обновлённые динамику и панель; строки deltas упорядочены,
+    как у period_deltas.
+    """
+    keys = list(panel.attrs.get('keys') or DELTA_KEYS)
+    if not df_changed.empty and 'SOURCE_FILE' not in df_changed.columns:
+        raise ValueError('update_period_deltas: в df_changed нужен столбец SOURCE_FILE — по нему заменяются строки панели')
+    changed = set(df_changed['SOURCE_FILE'].dropna().unique()) if not df_changed.empty else set()
+    changed |= set(removed_sources)
+
+    stale = panel['SOURCE_FILE'].isin(changed).to_numpy()
+    fresh = build_balance_panel(df_changed, keys)
+    affected = set(_delta_entity_key(panel[stale], keys)) | set(_delta_entity_key(fresh, keys))
+
+    panel = pd.concat([panel[~stale]] + ([fresh] if len(fresh) else []), ignore_index=True)
+    panel.attrs['keys'] = keys
+    print(f'Динамика: заменено источников {len(changed)}, пересчитано сочетаний {len(affected)}')
+    if len(affected) > 0.5 * deltas['First'].sum():
+        # Затронута бо́льшая часть сочетаний — отбор их строк дороже, чем пересчёт целиком
+        return period_deltas(panel, keys), panel
+
+    in_deltas = _delta_entity_key(deltas, keys).isin(affected).to_numpy()
+    in_panel = _delta_entity_key(panel, keys).isin(affected).to_numpy()
+    recomputed = period_deltas(panel[in_panel], keys)
+    out = pd.concat([deltas[~in_deltas]] + ([recomputed] if len(recomputed) else []), ignore_index=True)
+    # пересчитанные сочетания — на свои места: порядок как у period_deltas (keys, затем Date)
+    out = out.sort_values(keys + ['Date'], kind='stable', na_position='last', ignore_index=True)
+    out.attrs['keys'] = keys
+    return out, panel
+
+# Пример вызова:
+# df = parse_statement_folder('/content/gdrive/MyDrive/Волгоград', 'Ведомость', excel_parser_STATEMENT)
+# panel = build_balance_panel(df)
+# deltas = period_deltas(panel)
+# deltas[deltas['ClosingDelta'].abs() > 1_000_000]          # крупные изменения сальдо за месяц
+# deltas[(deltas['Gap'] == 0) & (deltas['Carry'].abs() > 0.01)]  # сальдо не перенесено
+# # пришёл файл за новый месяц:
+# df_new = excel_parser_STATEMENT(path_new); df_new['SOURCE_FILE'] = 'Ведомость/2025/ОСВ 76 1 03.2025.xlsx'
+# deltas, panel = update_period_deltas(deltas, panel, df_new)
@@ -0,0 +1,262 @@
+"""
+Командная строка для запусков без ноутбука (cron, сервер).
+
+    python VLGR_cli.py convert  /data/Волгоград
+    python VLGR_cli.py ingest   /data/Волгоград --dataset /data/_dataset --workers 4
+    python VLGR_cli.py ingest   /data/Волгоград --dataset /data/_dataset --workers 4 --timeout 300 --max-rows 500000 --error-report errors.json
+    python VLGR_cli.py ingest   /content/gdrive/MyDrive/Волгоград --dataset /data/_dataset --prefetch 8
+    python VLGR_cli.py ingest   /data/Волгоград --type SUPPLIERS --subfolder 'Поставщики услуг' --store /data/ledger.sqlite
+    python VLGR_cli.py ingest   /data/Волгоград --dataset /data/_shards/0 --shard 0/4   # на каждой машине свой шард
+    python VLGR_cli.py merge    /data/_shards/0 /data/_shards/1 /data/_shards/2 /data/_shards/3 --dataset /data/_dataset
+    python VLGR_cli.py watch    /data/Волгоград --dataset /data/_dataset --interval 300 --refresh-cube
+    python VLGR_cli.py enrich   --dataset /data/_dataset --estate-dictionary /data/Объекты.xlsx
+    python VLGR_cli.py export   --dataset /data/_dataset --type STATEMENT --out /data/statement.csv --date-from 2025-01-01
+    python VLGR_cli.py check-engines /data/Волгоград/Ведомость --type STATEMENT --engine polars --report engines.csv
+
+Тяжёлые зависимости (pandas, openpyxl, pyarrow) импортируются только внутри команд,
+поэтому запуск и --help не тратят время на их загрузку. Прогресс выводится в терминал (tqdm).
+"""
+import argparse
+import sys
+
+REPORT_TYPES = ('STATEMENT', 'INCOME', 'SUPPLIERS')
+
+
+def _filters(args):
+    return dict(date_from=args.date_from, date_to=args.date_to, companies=args.company or None)
+
+
+def _sheets(args):
+    if not args.sheets:
+        return None
+    return 'all' if args.sheets == ['all'] else args.sheets
+
+
+def cmd_convert(args):
+    import VLGR
+    VLGR.convert_and_replace_xls_to_xlsx(args.root)
+
+
+def cmd_ingest(args):
+    import VLGR
+
+    guard = None
+    if args.timeout or args.max_rows or args.max_memory_mb or args.error_report:
+        guard = {'timeout': args.timeout, 'max_rows': args.max_rows,
+                 'max_memory_mb': args.max_memory_mb, 'report': args.error_report}
+
+    if args.type == 'auto':
+        tables = VLGR.ingest_folder(args.root, subfolder=args.subfolder, max_workers=args.workers,
+                                    guard=guard, shard=args.shard, include_zip=args.include_zip,
+                                    prefetch=args.prefetch, sheets=_sheets(args), transfer=args.transfer,
+                                    **_filters(args))
+    else:
+        folder_funcs = {
+            'STATEMENT': (VLGR.parse_statement_folder, VLGR.excel_parser_STATEMENT, 'Ведомость'),
+            'INCOME': (VLGR.parse_income_folder, VLGR.excel_parser_INCOME, 'Выручка'),
+            'SUPPLIERS': (VLGR.parse_suppliers_folder, VLGR.excel_parser_SUPPLIERS, 'Поставщики услуг'),
+        }
+        func, parser, default_sub = folder_funcs[args.type]
+        df = func(args.root, args.subfolder or default_sub, parser, max_workers=args.workers,
+                  guard=guard, shard=args.shard, include_zip=args.include_zip, prefetch=args.prefetch,
+                  sheets=_sheets(args), transfer=args.transfer, **_filters(args))
+        tables = {args.type: df}
+
+    for report_type, df in tables.items():
+        print(f'{report_type}: {len(df)} строк')
+    errors = VLGR.parse_errors_frame(tables)
+    if len(errors):
+        print(f'Файлов с ошибками: {len(errors)}', file=sys.stderr)
+        print(errors[['file', 'status', 'error']].to_string(index=False), file=sys.stderr)
+    if args.dataset:
+        print('Записано part-файлов:', VLGR.write_dataset(tables, args.dataset))
+    if args.store:
+        print('Загружено в хранилище:', VLGR.store_load(args.store, tables))
+    if not args.dataset and not args.store:
+        print('Внимание: не указаны --dataset / --store, результат не сохранён', file=sys.stderr)
+
+
+def cmd_merge(args):
+    import VLGR
+    print('Скопировано part-файлов:', VLGR.merge_datasets(args.shards, args.dataset))
+
+
+def _shard_spec(text):
+    try:
+        i, n = (int(x) for x in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('ожидается i/n, например 0/4')
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError('ожидается 0 <= i < n')
+    return i, n
+
+
+def cmd_watch(args):
+    import VLGR
+
+    guard = {'timeout': args.timeout} if args.timeout else None
+    VLGR.watch_folder(args.root, args.dataset, interval=args.interval, max_cycles=args.max_cycles,
+                      subfolders=args.subfolder, debounce=args.debounce, batch_size=args.batch_size,
+                      max_workers=args.workers, guard=guard, store=args.store, refresh_cube=args.refresh_cube)
+
+
+def cmd_enrich(args):
+    import pandas as pd
+    import VLGR
+
+    df_suppliers = VLGR.read_dataset(args.dataset, 'SUPPLIERS', **_filters(args))
+    category_source = pd.concat(
+        [VLGR.read_dataset(args.dataset, t, columns=['Category']) for t in args.category_source],
+        ignore_index=True)
+    enriched = VLGR.enrich_suppliers_semantics(
+        df_suppliers,
+        root_estate_dictionary=args.estate_dictionary,
+        category_source_df=category_source,
+        show_progress=not args.quiet,
+    )
+    print(f'SUPPLIERS_ENRICHED: {len(enriched)} строк')
+    VLGR.write_dataset(enriched, args.dataset, report_type='SUPPLIERS_ENRICHED')
+
+
+def cmd_export(args):
+    import VLGR
+
+    df = VLGR.read_dataset(args.dataset, args.type, columns=args.columns, **_filters(args))
+    out = args.out
+    if out.endswith('.csv'):
+        df.to_csv(out, index=False)
+    elif out.endswith('.parquet'):
+        df.to_parquet(out, index=False)
+    elif out.endswith('.xlsx'):
+        VLGR.export_xlsx({args.type: df}, out)
+    else:
+        raise SystemExit(f'Неизвестный формат выгрузки: {out} (ожидается .csv / .parquet / .xlsx)')
+    print(f'{args.type}: {len(df)} строк -> {out}')
+
+
+def cmd_snapshot(args):
+    import VLGR
+
+    tables = {t: VLGR.read_dataset(args.dataset, t, **_filters(args)) for t in args.types}
+    tables = {t: df for t, df in tables.items() if len(df)}
+    rows = VLGR.save_snapshot(tables, args.out, compression=args.compression)
+    for name, n in rows.items():
+        print(f'{name}: {n} строк -> {args.out}')
+
+
+def cmd_check_engines(args):
+    import VLGR
+
+    parser_func = VLGR.PIPELINE_PARSERS[args.type]
+    report = VLGR.compare_parser_engines(args.folder, parser_func, engine=args.engine,
+                                         reference=args.reference, repeat=args.repeat)
+    for m in report.attrs['mismatches']:
+        print(f"{m['file']}: {m['kind']} row={m['row']} column={m['column']}: "
+              f"{m['reference']!r} != {m['candidate']!r}", file=sys.stderr)
+    if args.report:
+        report.to_csv(args.report, index=False)
+    if (report['status'] != 'ok').any():
+        raise SystemExit(1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='VLGR_cli', description='Парсинг выгрузок 1С (ОСВ, выручка, поставщики услуг)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    def add_filters(p):
+        p.add_argument('--date-from', help='Начало периода по Date (например, 2025-01-01)')
+        p.add_argument('--date-to', help='Конец периода по Date')
+        p.add_argument('--company', action='append', help='Компания (можно указать несколько раз)')
+
+    p = sub.add_parser('convert', help='Конвертировать .xls -> .xlsx (LibreOffice) во всех вложенных папках')
+    p.add_argument('root')
+    p.set_defaults(func=cmd_convert)
+
+    p = sub.add_parser('ingest', help='Распарсить выгрузки и сохранить в датасет / хранилище')
+    p.add_argument('root', help='Корневая папка выгрузок')
+    p.add_argument('--type', choices=('auto',) + REPORT_TYPES, default='auto',
+                   help='Тип отчёта; auto — определить по шапке каждого файла')
+    p.add_argument('--subfolder', help='Подкаталог root (для --type по умолчанию — стандартная папка отчёта)')
+    p.add_argument('--workers', type=int, default=None, help='Число процессов парсинга')
+    p.add_argument('--dataset', help='Папка Parquet-датасета (write_dataset)')
+    p.add_argument('--store', help='Файл SQLite-хранилища (store_load)')
+    p.add_argument('--include-zip', action='store_true', help='Читать также .xlsx внутри .zip-архивов')
+    p.add_argument('--shard', type=_shard_spec, help='Обработать только шард i/n (например, 0/4)')
+    p.add_argument('--prefetch', type=int, default=0,
+                   help='Читать заранее в память N следующих файлов (сетевые папки, Google Drive)')
+    p.add_argument('--sheets', nargs='+',
+                   help="Разбирать эти листы каждой книги: all или имена/маски ('ООО*'); по умолчанию — активный лист")
+    p.add_argument('--transfer', choices=('auto', 'arrow', 'pickle'), default='auto',
+                   help='Как процессы возвращают таблицы файлов: arrow — файлами Arrow IPC в общей памяти')
+    p.add_argument('--timeout', type=float, help='Защищённый режим: таймаут на файл, секунд')
+    p.add_argument('--max-rows', type=int, help='Защищённый режим: максимум строк на листе')
+    p.add_argument('--max-memory-mb', type=int, help='Защищённый режим: лимит памяти процесса на файл, МБ')
+    p.add_argument('--error-report', help='Защищённый режим: JSON-файл отчёта об ошибках')
+    add_filters(p)
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser('merge', help='Слить датасеты шардов (ingest --shard) в один датасет')
+    p.add_argument('shards', nargs='+', help='Папки датасетов шардов')
+    p.add_argument('--dataset', required=True, help='Итоговая папка датасета')
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser('watch', help='Следить за папкой и дозагружать новые/изменённые выгрузки в датасет')
+    p.add_argument('root', help='Корневая папка выгрузок')
+    p.add_argument('--dataset', required=True, help='Папка Parquet-датасета')
+    p.add_argument('--subfolder', action='append', help='Наблюдаемый подкаталог (можно несколько раз)')
+    p.add_argument('--interval', type=float, default=60, help='Период опроса, секунд')
+    p.add_argument('--debounce', type=float, default=10, help='Сколько секунд файл должен не меняться')
+    p.add_argument('--batch-size', type=int, default=50)
+    p.add_argument('--max-cycles', type=int, help='Остановиться после N циклов')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--timeout', type=float, help='Защищённый режим: таймаут на файл, секунд')
+    p.add_argument('--store', help='Файл SQLite-хранилища')
+    p.add_argument('--refresh-cube', action='store_true', help='Обновлять кубы оборотов')
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser('enrich', help='Обогатить SUPPLIERS из датасета (enrich_suppliers_semantics)')
+    p.add_argument('--dataset', required=True)
+    p.add_argument('--estate-dictionary', required=True, help='Excel-словарь объектов')
+    p.add_argument('--category-source', nargs='+', default=['STATEMENT'], choices=REPORT_TYPES,
+                   help='Таблицы датасета — источник справочника Category')
+    p.add_argument('--quiet', action='store_true', help='Без прогресса')
+    add_filters(p)
+    p.set_defaults(func=cmd_enrich)
+
+    p = sub.add_parser('export', help='Выгрузить таблицу датасета в .csv / .parquet / .xlsx')
+    p.add_argument('--dataset', required=True)
+    p.add_argument('--type', required=True, choices=REPORT_TYPES + ('SUPPLIERS_ENRICHED',))
+    p.add_argument('--out', required=True)
+    p.add_argument('--columns', nargs='+', help='Какие столбцы выгрузить')
+    add_filters(p)
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('snapshot', help='Сохранить таблицы датасета снимком Arrow IPC для быстрой загрузки')
+    p.add_argument('--dataset', required=True)
+    p.add_argument('--out', required=True, help='Папка снимка')
+    p.add_argument('--types', nargs='+', default=list(REPORT_TYPES) + ['SUPPLIERS_ENRICHED'],
+                   choices=REPORT_TYPES + ('SUPPLIERS_ENRICHED',))
+    p.add_argument('--compression', choices=('lz4', 'zstd'), help='Сжатие (по умолчанию без сжатия — '
+                   'только так работает загрузка без копирования)')
+    add_filters(p)
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser('check-engines', help='Сверить альтернативный движок парсера с эталоном на папке книг')
+    p.add_argument('folder', help='Папка с .xlsx (рекурсивно)')
+    p.add_argument('--type', required=True, choices=REPORT_TYPES)
+    p.add_argument('--engine', default='polars', help='Проверяемый движок (VLGR.PARSER_ENGINES)')
+    p.add_argument('--reference', default='pandas', help='Эталонный движок')
+    p.add_argument('--repeat', type=int, default=1, help='Повторов на файл для замера времени')
+    p.add_argument('--report', help='CSV-отчёт по файлам')
+    p.set_defaults(func=cmd_check_engines)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
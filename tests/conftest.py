@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import VLGR  # noqa: E402
+
+
+@pytest.fixture
+def parse_statement():
+    """excel_parser_STATEMENT + SOURCE_FILE, как при сборке по папке."""
+    def parse(path, sheets=None):
+        df = VLGR.excel_parser_STATEMENT(path, **({} if sheets is None else {'sheets': sheets}))
+        df['SOURCE_FILE'] = os.path.basename(path)
+        return df
+    return parse
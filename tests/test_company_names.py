@@ -0,0 +1,37 @@
+import pytest
+
+import VLGR
+
+
+def _clusters(names):
+    mapping = VLGR.build_company_name_mapping(names)
+    return dict(zip(mapping['Name'], mapping['Cluster'])), mapping
+
+
+@pytest.mark.parametrize('variant', [
+    'Ромашка ООО',                    # ОПФ после названия
+    'ООО Ромашкa',                    # латинская a
+    'OOO Ромaшка',                    # латинские OOO и a
+    'ООО "Торговый дом Ромашкка"',    # лишняя буква внутри слова
+])
+def test_spelling_variants_merge(variant):
+    base = 'ООО "Торговый дом Ромашка"' if 'Торговый' in variant else 'ООО Ромашка'
+    clusters, _ = _clusters([base, variant])
+    assert clusters[base] == clusters[variant]
+
+
+@pytest.mark.parametrize('a, b', [
+    ('ООО "Ромашка"', 'ООО "Ромашка Плюс"'),
+    ('ИП Иванов И.И.', 'ИП Иванова И.И.'),
+    ('ООО Ромашка', 'АО Ромашка'),
+])
+def test_different_entities_do_not_merge(a, b):
+    clusters, _ = _clusters([a, b])
+    assert clusters[a] != clusters[b]
+
+
+def test_near_pairs_go_to_review():
+    _, mapping = _clusters(['ООО "Ромашка"', 'ООО "Ромашка Плюс"', 'ИП Иванов И.И.', 'ИП Иванова И.И.'])
+    pairs = {frozenset((r['Name'], r['Candidate'])) for r in mapping.attrs['review']}
+    assert frozenset(('ООО РОМАШКА', 'ООО РОМАШКА ПЛЮС')) in pairs
+    assert frozenset(('ИП ИВАНОВ И И', 'ИП ИВАНОВА И И')) in pairs
@@ -0,0 +1,35 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import VLGR
+
+
+def test_compare_frames_ignores_types_only():
+    reference = pd.DataFrame({
+        'Value': pd.Series([1, 2], dtype='Int64'),
+        'Date': [datetime.date(2025, 1, 1), None],
+        'Doc': [['a', 'b'], []],
+        'Name': ['x', None],
+    })
+    candidate = pd.DataFrame({
+        'Value': [1.0, 2.0 + 1e-9],
+        'Date': pd.to_datetime(['2025-01-01', None]),
+        'Doc': [np.array(['a', 'b']), np.array([])],
+        'Name': pd.Series(['x', np.nan], dtype='str'),
+    })
+    assert VLGR.compare_frames(reference, candidate) == []
+
+
+def test_compare_frames_reports_differences():
+    reference = pd.DataFrame({'Account': ['60', '62', '76'], 'Value': [1.0, 2.0, 3.0]})
+    cell = VLGR.compare_frames(reference, reference.assign(Value=[1.0, 2.5, 3.0]))
+    assert [(m['kind'], m['row'], m['column']) for m in cell] == [('cell', 1, 'Value')]
+    assert cell[0]['context'] == {'Account': '62', 'Value': 2.0}
+
+    kinds = {m['kind'] for m in VLGR.compare_frames(reference, reference.iloc[:2].rename(columns={'Value': 'V'}))}
+    assert kinds == {'columns', 'rows'}
+
+    many = VLGR.compare_frames(reference, reference.assign(Value=0.0), max_mismatches=1)
+    assert len(many) == 2 and many[-1]['row'] is None
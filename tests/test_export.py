@@ -0,0 +1,43 @@
+import pytest
+
+import VLGR
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+@pytest.fixture
+def tables(tmp_path):
+    VLGR.make_synthetic_corpus(str(tmp_path / 'root'), months=(1,), companies=('ООО "Ромашка"',))
+    return VLGR.ingest_folder(str(tmp_path / 'root'), max_workers=1)
+
+
+def _date_cells(path, sheet, column='Date'):
+    ws = openpyxl.load_workbook(path, read_only=True)[sheet]
+    rows = ws.iter_rows()
+    j = [c.value for c in next(rows)].index(column)
+    return [row[j] for row in rows if row[j].value is not None]
+
+
+@pytest.mark.parametrize('engine', ['xlsxwriter', 'openpyxl'])
+def test_object_dates_get_date_format(tables, tmp_path, engine):
+    if engine == 'xlsxwriter':
+        pytest.importorskip('xlsxwriter')
+    assert tables['SUPPLIERS']['Date'].dtype == object
+    path = str(tmp_path / 'out.xlsx')
+    VLGR.export_xlsx(tables, path, engine=engine)
+
+    for sheet in ('SUPPLIERS', 'STATEMENT'):
+        cells = _date_cells(path, sheet)
+        assert cells
+        assert all(c.is_date and c.number_format == 'dd.mm.yyyy' for c in cells)
+
+
+def test_dataset_dates_get_date_format(tables, tmp_path):
+    pytest.importorskip('pyarrow')
+    VLGR.write_dataset(tables, str(tmp_path / 'ds'))
+    df = VLGR.read_dataset(str(tmp_path / 'ds'), 'SUPPLIERS')
+    path = str(tmp_path / 'out.xlsx')
+    VLGR.export_xlsx({'SUPPLIERS': df}, path)
+
+    cells = _date_cells(path, 'SUPPLIERS')
+    assert cells and all(c.is_date and c.number_format == 'dd.mm.yyyy' for c in cells)
@@ -0,0 +1,22 @@
+import json
+
+import VLGR
+
+
+def test_parse_report_written_once(tmp_path, monkeypatch):
+    root = tmp_path / 'root'
+    VLGR.make_synthetic_corpus(str(root), months=(1,), companies=('ООО "Ромашка"',))
+    (root / 'Ведомость' / 'битый.xlsx').write_bytes(b'not a workbook')
+    report = str(tmp_path / 'errors.json')
+
+    writes = []
+    dump = json.dump
+    monkeypatch.setattr(VLGR.json, 'dump', lambda obj, f, **kw: (writes.append(f.name), dump(obj, f, **kw)))
+    tables = VLGR.ingest_folder(str(root), max_workers=1, guard={'report': report})
+
+    assert writes.count(report) == 1
+    with open(report, encoding='utf-8') as f:
+        errors = json.load(f)
+    assert any(e['file'].endswith('битый.xlsx') for e in errors)
+    assert [e['file'] for e in errors] == [e['file'] for e in tables['STATEMENT'].attrs['parse_errors']]
+    assert all(df.attrs['parse_errors'] == tables['STATEMENT'].attrs['parse_errors'] for df in tables.values())
@@ -0,0 +1,33 @@
+import pytest
+
+import VLGR
+
+PARSERS = {
+    'STATEMENT': (VLGR.excel_parser_STATEMENT, VLGR.layout_parser_STATEMENT),
+    'INCOME': (VLGR.excel_parser_INCOME, VLGR.layout_parser_INCOME),
+    'SUPPLIERS': (VLGR.excel_parser_SUPPLIERS, VLGR.layout_parser_SUPPLIERS),
+}
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp('corpus')
+    return VLGR.make_synthetic_corpus(str(root), months=(1, 2, 4), scale=2, seed=5)
+
+
+@pytest.mark.parametrize('report_type', sorted(PARSERS))
+def test_layout_engine_equals_parsers(corpus, report_type):
+    parser, _ = PARSERS[report_type]
+    report = VLGR.compare_parser_engines(corpus[report_type], parser, engine='layout', show_progress=False)
+    assert len(report) == len(corpus[report_type])
+    assert (report['status'] == 'ok').all(), report.attrs['mismatches'][:5]
+
+
+@pytest.mark.parametrize('report_type', sorted(PARSERS))
+def test_layout_engine_equals_parsers_polars(corpus, report_type):
+    pytest.importorskip('polars')
+    parser, layout = PARSERS[report_type]
+    report = VLGR.compare_parser_engines(corpus[report_type], parser,
+                                         engine=lambda f: layout(f, backend='polars'),
+                                         reference='polars', show_progress=False)
+    assert (report['status'] == 'ok').all(), report.attrs['mismatches'][:5]
@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+import pytest
+
+import VLGR
+
+
+@pytest.fixture
+def statement_files(tmp_path):
+    files = VLGR.make_synthetic_corpus(str(tmp_path), months=(1, 2, 3), companies=('ООО "Ромашка"',), seed=2)
+    return sorted(files['STATEMENT'])
+
+
+def test_raw_parser_output(statement_files):
+    raw = VLGR.excel_parser_STATEMENT(statement_files[0])
+    assert 'Estate' not in raw.columns
+    deltas = VLGR.period_deltas(raw)
+    assert len(deltas) > 0
+    assert deltas['Estate'].isna().all()
+    assert deltas['First'].all() and deltas['Last'].all()
+
+
+def test_incremental_update_from_parser_output(statement_files, parse_statement):
+    full = pd.concat([parse_statement(f) for f in statement_files], ignore_index=True)
+    panel = VLGR.build_balance_panel(pd.concat([parse_statement(f) for f in statement_files[:-1]], ignore_index=True))
+    deltas = VLGR.period_deltas(panel)
+
+    df_new = VLGR.excel_parser_STATEMENT(statement_files[-1])
+    df_new['SOURCE_FILE'] = os.path.basename(statement_files[-1])
+    deltas, panel = VLGR.update_period_deltas(deltas, panel, df_new)
+
+    pd.testing.assert_frame_equal(deltas, VLGR.period_deltas(full), check_dtype=False)
+    assert (deltas.loc[deltas['Last'], 'Date'] == deltas['Date'].max()).all()
+
+
+def test_partial_update_keeps_order(tmp_path, capsys, parse_statement):
+    companies = ('ООО "Астра"', 'ООО "Лютик"', 'ООО "Ромашка"')
+    files = sorted(VLGR.make_synthetic_corpus(str(tmp_path), months=(1, 2, 3), companies=companies,
+                                              seed=3)['STATEMENT'])
+    new_file = [f for f in files if os.path.basename(f) == 'ОСВ 76 1 03.2025.xlsx'][0]
+    full = pd.concat([parse_statement(f) for f in files], ignore_index=True)
+    panel = VLGR.build_balance_panel(pd.concat([parse_statement(f) for f in files if f != new_file], ignore_index=True))
+    deltas = VLGR.period_deltas(panel)
+
+    deltas, panel = VLGR.update_period_deltas(deltas, panel, parse_statement(new_file))
+
+    expected = VLGR.period_deltas(full)
+    assert deltas['First'].sum() > 2 * int(capsys.readouterr().out.split()[-1])  # пересчитана часть сочетаний
+    pd.testing.assert_frame_equal(deltas, expected, check_dtype=False)
+
+
+def test_update_requires_source_file(statement_files, parse_statement):
+    panel = VLGR.build_balance_panel(parse_statement(statement_files[0]))
+    with pytest.raises(ValueError):
+        VLGR.update_period_deltas(VLGR.period_deltas(panel), panel, VLGR.excel_parser_STATEMENT(statement_files[1]))
@@ -0,0 +1,39 @@
+import pytest
+
+import VLGR
+
+
+@pytest.mark.parametrize('func, helper', [
+    ('excel_parser_STATEMENT', '_statement_frame'),
+    ('excel_parser_INCOME', '_income_frame'),
+    ('excel_parser_SUPPLIERS', '_suppliers_frame'),
+    ('_normalize_columns', 'normalize_company_names'),
+    ('enrich_suppliers_semantics', '_enrich_norm'),
+])
+def test_fingerprint_covers_helpers(func, helper, monkeypatch):
+    before = VLGR._func_fingerprint(getattr(VLGR, func))
+    monkeypatch.setattr(VLGR, helper, lambda *args, **kwargs: None)
+    assert VLGR._func_fingerprint(getattr(VLGR, func)) != before
+
+
+def test_fingerprint_covers_schema(monkeypatch):
+    before = VLGR._func_fingerprint(VLGR.conform_to_schema)
+    monkeypatch.setitem(VLGR.STATEMENT_SCHEMA, 'Extra', 'object')
+    assert VLGR._func_fingerprint(VLGR.conform_to_schema) != before
+
+
+@pytest.mark.parametrize('helper', ['_suppliers_frame', 'filter_rows_by_period_company'])
+def test_helper_change_reparses_cached_files(helper, tmp_path, monkeypatch):
+    VLGR.make_synthetic_corpus(str(tmp_path / 'root'), months=(1,), companies=('ООО "Ромашка"',))
+
+    def run():
+        p = VLGR.Pipeline(str(tmp_path / 'root'), cache_dir=str(tmp_path / 'cache')).parse('SUPPLIERS')
+        p.run()
+        return p.last_run
+
+    assert run()['parsed'] > 0
+    assert run()['parsed'] == 0
+    original = getattr(VLGR, helper)
+    monkeypatch.setattr(VLGR, helper, lambda *args, **kwargs: original(*args, **kwargs))
+    stats = run()
+    assert stats['parsed'] > 0 and stats['cached'] == 0
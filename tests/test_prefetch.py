@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+import pytest
+
+import VLGR
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    root = tmp_path_factory.mktemp('corpus')
+    return VLGR.make_synthetic_corpus(str(root), months=(1, 2, 4), scale=2, seed=5)
+
+
+def test_prefetch_keeps_order_and_bound(tmp_path, monkeypatch):
+    paths = []
+    for i in range(6):
+        path = tmp_path / f'{i}.bin'
+        path.write_bytes(bytes([i]) * 10)
+        paths.append(str(path))
+    paths.insert(3, str(tmp_path / 'missing.bin'))
+    started = []
+    read = VLGR._read_source_bytes
+    monkeypatch.setattr(VLGR, '_read_source_bytes', lambda source: (started.append(source), read(source))[1])
+
+    out = []
+    for i, source in VLGR._prefetch_sources(paths, depth=2):
+        assert len(started) <= i + 1 + 2  # вперёд читается не больше depth файлов
+        out.append((i, source))
+    assert [i for i, _ in out] == list(range(len(paths)))
+    assert out[3][1] == paths[3]  # не прочитан — передаётся как есть
+    assert all(s.source == paths[i] and s.data == bytes([int(os.path.basename(paths[i])[0])]) * 10
+               for i, s in out if i != 3)
+
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_prefetch_same_result(corpus, max_workers):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(corpus['STATEMENT'][0])))
+    plain = VLGR.parse_statement_folder(root, 'Ведомость', VLGR.excel_parser_STATEMENT, max_workers=max_workers)
+    with VLGR.simulate_slow_disk(latency=0.01, mb_per_s=1000):
+        ahead = VLGR.parse_statement_folder(root, 'Ведомость', VLGR.excel_parser_STATEMENT,
+                                            max_workers=max_workers, prefetch=3)
+    assert len(plain) > 0
+    pd.testing.assert_frame_equal(ahead, plain)
+
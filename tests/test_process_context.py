@@ -0,0 +1,34 @@
+import subprocess
+import sys
+
+import pytest
+
+import VLGR
+
+pytest.importorskip('polars')
+
+NOTEBOOK = """
+exec(compile(open({src!r}, encoding='utf-8').read(), 'VLGR.py', 'exec'))
+import polars
+make_synthetic_corpus({root!r}, months=(1, 2), companies=('ООО "Ромашка"',))
+df = parse_statement_folder({root!r}, 'Ведомость', excel_parser_STATEMENT, max_workers=2)
+print('RESULT', _process_context().get_start_method(), len(df))
+"""
+
+
+def test_notebook_main_keeps_fork(tmp_path):
+    # как в Colab: код модуля выполнен в __main__, у которого нет __file__
+    code = NOTEBOOK.format(src=VLGR.__file__, root=str(tmp_path / 'root'))
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=300)
+    method, n_rows = proc.stdout.split('RESULT')[-1].split()
+    assert method == 'fork'
+    assert int(n_rows) > 0
+
+
+def test_imported_module_uses_forkserver_with_polars():
+    import multiprocessing as mp
+
+    if 'forkserver' not in mp.get_all_start_methods():
+        pytest.skip('forkserver недоступен')
+    import polars  # noqa: F401
+    assert VLGR._process_context().get_start_method() == 'forkserver'
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+import VLGR
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture
+def tables(tmp_path):
+    VLGR.make_synthetic_corpus(str(tmp_path), months=(1, 2), seed=1)
+    return VLGR.ingest_folder(str(tmp_path), max_workers=1)
+
+
+def test_numpy_round_trip_matches_parsers(tables, tmp_path):
+    root = str(tmp_path / '_snapshot')
+    VLGR.save_snapshot(tables, root)
+    loaded = VLGR.load_snapshot(root, dtype_backend='numpy')
+    for name, df in tables.items():
+        if df is not None:
+            pd.testing.assert_frame_equal(loaded[name], df)
+
+
+def test_numpy_round_trip_keeps_null_sentinel(tmp_path):
+    df = pd.DataFrame({
+        'none': pd.Series([None, None], dtype=object),
+        'nan': pd.Series([float('nan'), 'x'], dtype=object),
+    })
+    VLGR.save_snapshot({'T': df}, str(tmp_path))
+    loaded = VLGR.load_snapshot(str(tmp_path), 'T', dtype_backend='numpy')
+    assert loaded['none'].tolist() == [None, None]
+    assert pd.isna(loaded['nan'][0]) and loaded['nan'][0] is not None
+    pd.testing.assert_frame_equal(loaded, df)
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+import VLGR
+
+
+@pytest.fixture
+def statement_file(tmp_path):
+    path = str(tmp_path / 'ОСВ 76 1 01.2025.xlsx')
+    VLGR.write_synthetic_statement(path, month=1, year=2025, n_partners=6, seed=1)
+    return path
+
+
+def _corrupt(df):
+    df = df.copy()
+    detail = VLGR.statement_row_kind(df) == 'detail'
+    turn = detail & (df['Показатель'] == 'Обороты за период') & (df['Дебет/Кредит'] == 'Дебет')
+    df.loc[turn[turn].index[0], 'Value'] += 1000
+    return df
+
+
+def test_sheet_column_is_not_a_level(statement_file, parse_statement):
+    plain, by_sheet = parse_statement(statement_file), parse_statement(statement_file, sheets=[0])
+    assert VLGR.SHEET_COLUMN in by_sheet.columns
+    assert VLGR.SHEET_COLUMN not in VLGR.statement_level_columns(by_sheet)
+    assert (VLGR.statement_row_kind(plain).value_counts().to_dict()
+            == VLGR.statement_row_kind(by_sheet).value_counts().to_dict())
+
+
+def test_cube_same_with_and_without_sheets(statement_file, parse_statement):
+    plain, by_sheet = parse_statement(statement_file), parse_statement(statement_file, sheets=[0])
+    dims = ['Date', 'Company', 'Показатель', 'Дебет/Кредит']
+    expected = VLGR.turnover_report(VLGR.build_turnover_cube(plain), dims=dims)
+    actual = VLGR.turnover_report(VLGR.build_turnover_cube(by_sheet), dims=dims)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype=False)
+
+
+@pytest.mark.parametrize('sheets', [[0], 'all'])
+def test_validator_same_with_and_without_sheets(statement_file, sheets, parse_statement):
+    plain, by_sheet = parse_statement(statement_file), parse_statement(statement_file, sheets=sheets)
+    assert VLGR.validate_statement_balances(by_sheet).empty
+
+    expected = VLGR.validate_statement_balances(_corrupt(plain))
+    actual = VLGR.validate_statement_balances(_corrupt(by_sheet))
+    assert len(expected) == 2
+    assert sorted(expected['Check']) == sorted(actual['Check'])
+    pd.testing.assert_frame_equal(expected.drop(columns='Check'),
+                                  actual.drop(columns=['Check', VLGR.SHEET_COLUMN]).sort_index(),
+                                  check_dtype=False, check_like=True)
@@ -0,0 +1,53 @@
+import datetime
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import VLGR
+
+pytest.importorskip('pyarrow')
+
+
+def _arrow_round_trip(df, tmp_path):
+    return VLGR._transfer_decode(VLGR._transfer_encode(df, str(tmp_path)))
+
+
+def _assert_same_as_pickle(df, tmp_path):
+    expected = pickle.loads(pickle.dumps(df))
+    actual = _arrow_round_trip(df, tmp_path)
+    pd.testing.assert_frame_equal(actual, expected)
+    for col in df.columns:
+        if df[col].dtype == object:
+            assert [type(v) for v in actual[col]] == [type(v) for v in expected[col]], col
+            assert [v is None for v in actual[col]] == [v is None for v in expected[col]], col
+
+
+@pytest.mark.parametrize('values', [
+    [datetime.date(2020, 1, 1), datetime.datetime(2020, 1, 1, 5, 30)],
+    [datetime.date(2020, 1, 1), None, datetime.date(2020, 2, 1)],
+    ['a', None, 'b'],
+    ['a', np.nan, 'b'],
+    ['a', None, np.nan],
+    [['x', 'y'], [], ['z']],
+    [1, 'a', None],
+])
+def test_object_columns_as_pickle(values, tmp_path):
+    _assert_same_as_pickle(pd.DataFrame({'c': pd.Series(values, dtype=object), 'n': range(len(values))}), tmp_path)
+
+
+def test_parsed_tables_as_pickle(tmp_path):
+    VLGR.make_synthetic_corpus(str(tmp_path / 'root'), months=(1,), companies=('ООО "Ромашка"',))
+    tables = VLGR.ingest_folder(str(tmp_path / 'root'), max_workers=1)
+    for df in tables.values():
+        _assert_same_as_pickle(df, tmp_path)
+
+
+def test_pool_arrow_equals_pickle(tmp_path):
+    VLGR.make_synthetic_corpus(str(tmp_path / 'root'), months=(1, 2), companies=('ООО "Ромашка"',))
+    arrow = VLGR.ingest_folder(str(tmp_path / 'root'), max_workers=2, transfer='arrow')
+    plain = VLGR.ingest_folder(str(tmp_path / 'root'), max_workers=2, transfer='pickle')
+    for name in VLGR.REPORT_TYPES:
+        assert len(arrow[name]) > 0
+        pd.testing.assert_frame_equal(arrow[name], plain[name])
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import VLGR
+
+
+@pytest.fixture
+def watched(tmp_path):
+    root = tmp_path / 'root'
+    VLGR.make_synthetic_corpus(str(root), months=(1,), companies=('ООО "Ромашка"',))
+    (root / 'Ведомость' / 'старая.xls').write_bytes(b'not really xls')
+    return str(root), str(tmp_path / 'ds')
+
+
+def _no_office():
+    raise RuntimeError('LibreOffice не установлена')
+
+
+def test_missing_libreoffice_is_a_file_error(watched, monkeypatch):
+    root, ds = watched
+    monkeypatch.setattr(VLGR, '_require_libreoffice', _no_office)
+
+    summary = VLGR.watch_once(root, ds, debounce=0)
+    assert [e['file'] for e in summary['errors']] == [os.path.join('Ведомость', 'старая.xls')]
+    assert len(summary['added']) == 3  # .xlsx разобраны, несмотря на .xls
+
+    summary = VLGR.watch_once(root, ds, debounce=0)
+    assert not summary['errors'] and not summary['added']
+
+
+def test_failed_conversion_not_retried_until_file_changes(watched, monkeypatch):
+    root, ds = watched
+    calls = []
+    monkeypatch.setattr(VLGR, '_require_libreoffice', lambda: None)
+    monkeypatch.setattr(VLGR, '_convert_xls_file', lambda path: calls.append(path))
+
+    VLGR.watch_once(root, ds, debounce=0)
+    VLGR.watch_once(root, ds, debounce=0)
+    assert len(calls) == 1
+
+    with open(os.path.join(root, 'Ведомость', 'старая.xls'), 'ab') as f:
+        f.write(b'!')
+    VLGR.watch_once(root, ds, debounce=0)
+    assert len(calls) == 2
+
+
+def test_watch_folder_survives_cycle_errors(watched, monkeypatch):
+    root, ds = watched
+    monkeypatch.setattr(VLGR, '_require_libreoffice', _no_office)
+    real_watch_once = VLGR.watch_once
+    cycles = []
+
+    def flaky(*args, **kwargs):
+        cycles.append(1)
+        if len(cycles) == 1:
+            raise OSError('Drive недоступен')
+        return real_watch_once(*args, **kwargs)
+
+    monkeypatch.setattr(VLGR, 'watch_once', flaky)
+    summary = VLGR.watch_folder(root, ds, interval=0, max_cycles=2, debounce=0)
+    assert len(cycles) == 2
+    assert len(summary['added']) == 3